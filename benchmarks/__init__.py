@@ -0,0 +1,6 @@
+"""Benchmarks
+
+Run them from the root of repository, for example
+
+    python -m benchmarks.bench_article_content
+"""
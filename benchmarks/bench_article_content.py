@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Latency of fetching article content with synchronous views update.
+
+Compare the former two round-trips (update_one and aggregate)
+with the single find_one_and_update of ArticlesConnector.get_content.
+
+Needs a MongoDB 4.4 or later, the test schema in config.ini is used.
+
+Usage:
+    python -m benchmarks.bench_article_content [--articles 1000] [--comments 50] [--requests 5000]
+"""
+
+import random
+from argparse import ArgumentParser
+
+from bson import ObjectId
+
+from benchmarks.common import get_test_database, summarize, timed, report
+from marucat_app.database_helper.articles_mongodb import ArticlesConnector
+
+# collection only used by this benchmark
+COLLECTION = 'bench_article_content'
+
+
+def seed(collection, articles, comments):
+    """Create articles with comments
+
+    :return: list of article ID
+    """
+    collection.drop()
+    docs = []
+    for i in range(articles):
+        aid = ObjectId()
+        docs.append({
+            '_id': aid,
+            'title': 'Article {}'.format(i),
+            'author': 'Richard',
+            'peek': 'Just a peek at there.',
+            'content': 'Nothing here. ' * 200,
+            'views': 0,
+            'tags': ['OK', 'red'],
+            'comments': [{
+                'aid': aid,
+                'cid': ObjectId(),
+                'from': 'Mary',
+                'body': 'Just comment for {}'.format(j),
+                'timestamp': j,
+                'deleted': j % 3 == 1
+            } for j in range(comments)],
+            'reviews': comments - len(range(1, comments, 3)),
+            'timestamp': i,
+            'deleted': False
+        })
+    collection.insert_many(docs)
+    return [str(x['_id']) for x in docs]
+
+
+def two_round_trips(collection, article_id, comments_size):
+    """The former get_content, update views then aggregate"""
+    condition = {'_id': ObjectId(article_id), 'deleted': False}
+    collection.update_one(condition, {'$inc': {'views': 1}})
+    return [x for x in collection.aggregate([
+        {'$match': condition},
+        {'$project': {
+            '_id': 1, 'title': 1, 'author': 1, 'content': 1, 'views': 1,
+            'tags': 1, 'timestamp': 1,
+            'reviews': {'$ifNull': ['$reviews', 0]},
+            'comments': {'$slice': [
+                {'$filter': {'input': '$comments', 'as': 'c', 'cond': {'$not': '$$c.deleted'}}},
+                comments_size
+            ]}
+        }}
+    ])]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Latency of fetching article content.')
+    parser.add_argument('--articles', type=int, default=1000)
+    parser.add_argument('--comments', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--comments-size', type=int, default=10)
+    args = parser.parse_args()
+
+    col = get_test_database()[COLLECTION]
+    ids = seed(col, args.articles, args.comments)
+    connector = ArticlesConnector(col)
+
+    # warm up
+    for x in ids[:100]:
+        connector.get_content(x, comments_size=args.comments_size)
+
+    before, after = [], []
+    for _ in range(args.requests):
+        x = random.choice(ids)
+        before.append(timed(two_round_trips, col, x, args.comments_size)[0])
+        after.append(timed(connector.get_content, x, comments_size=args.comments_size)[0])
+
+    col.drop()
+
+    report({
+        'benchmark': 'article_content',
+        'articles': args.articles,
+        'comments': args.comments,
+        'two_round_trips': summarize(before),
+        'find_one_and_update': summarize(after),
+    })
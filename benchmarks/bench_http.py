@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Throughput and tail latency of every endpoint over HTTP
+
+The app is booted against the memory database or a local MongoDB,
+seeded with generated articles, and loaded by concurrent clients,
+one endpoint after another.
+
+- memory: a threaded server in one process, seeded after the app was created
+- mongodb: the prefork runner on the test schema in config.ini,
+  the articles collection of the test schema is dropped and seeded
+
+Articles are picked by a Zipf distribution, the exponent is --skew, 0 means uniform,
+pages of list are picked the same way.
+The result is printed as JSON, and written to --output if provided,
+so runs on different commits can be compared.
+
+Usage:
+    python -m benchmarks.bench_http [--backend memory] [--articles 10000] [--comments 10]
+        [--skew 1.1] [--clients 8] [--duration 5] [--workers N] [--output result.json]
+"""
+
+import os
+import random
+import signal
+import subprocess
+import sys
+from argparse import ArgumentParser
+from itertools import accumulate
+
+from benchmarks.bench_runner import HOST, free_port
+from benchmarks.common import get_test_database, summarize, report
+from benchmarks.load import run_load, wait_until_up
+from marucat_app.database_helper.articles_memory import generate_articles
+from marucat_app.utils.utils import get_initial_file
+
+# endpoints in the order they are loaded, writes last
+ENDPOINTS = ['list', 'list_by_tag', 'content', 'comments', 'settings', 'post_comment', 'delete_comment']
+
+# tags of generated articles, the first ones are the most common
+TAGS = ['python', 'flask', 'mongodb', 'linux', 'web', 'cache', 'http', 'benchmark']
+
+# page size of list and comments
+PAGE_SIZE = 10
+
+# counts of requests prepared for an endpoint, clients send them in turn
+REQUESTS = 20000
+
+# threaded server of werkzeug on the memory database, seeded in the process
+MEMORY_SERVER = '''
+from werkzeug.serving import make_server
+from marucat_app import create_app
+from marucat_app.utils.utils import CONNECTOR_FACTORY
+app = create_app(db='memory')
+app.config[CONNECTOR_FACTORY].seed({articles}, comments={comments}, tags={tags!r}, seed={seed})
+make_server({host!r}, {port}, app, threaded=True).serve_forever()
+'''
+
+
+class Zipf(object):
+    """Pick ranks by a Zipf distribution"""
+
+    def __init__(self, n, skew, rng):
+        """Initial distribution
+
+        :param n: counts of ranks
+        :param skew: exponent, 0 means uniform
+        :param rng: random generator
+        """
+        self._ranks = range(n)
+        self._weights = list(accumulate(1 / (i + 1) ** skew for i in range(n)))
+        self._rng = rng
+
+    def sample(self, k):
+        """Pick ranks
+
+        :param k: counts of ranks
+        :return: list of ranks, 0 is the most popular
+        """
+        return self._rng.choices(self._ranks, cum_weights=self._weights, k=k)
+
+
+def seed_mongodb(articles):
+    """Drop and seed the articles collection of the test schema
+
+    :param articles: list of article documents
+    """
+    collection = get_test_database()[get_initial_file()['mongodb']['articles_collection']]
+    collection.drop()
+    for i in range(0, len(articles), 1000):
+        collection.insert_many(articles[i:i + 1000])
+
+
+def prepare(articles, *, skew, seed):
+    """Prepare requests of every endpoint
+
+    :param articles: list of article documents, newest last
+    :param skew: exponent of Zipf distribution
+    :param seed: random seed
+    :return: dict, endpoint: list of requests
+    """
+    rng = random.Random(seed)
+
+    # popularity is not related to age
+    popular = [str(x['_id']) for x in articles]
+    rng.shuffle(popular)
+    picked = [popular[i] for i in Zipf(len(popular), skew, rng).sample(REQUESTS)]
+
+    pages = (len(articles) + PAGE_SIZE - 1) // PAGE_SIZE
+    offsets = [i * PAGE_SIZE for i in Zipf(pages, skew, rng).sample(REQUESTS)]
+    tags = Zipf(len(TAGS), skew, rng).sample(REQUESTS)
+
+    # every comment is deleted once, popular articles first
+    by_id = {str(x['_id']): x for x in articles}
+    comments = [
+        (aid, str(c['cid'])) for aid in popular for c in by_id[aid]['comments']
+    ][:REQUESTS]
+
+    return {
+        'list': ['/articles?size={}&offset={}'.format(PAGE_SIZE, x) for x in offsets],
+        'list_by_tag': ['/articles?size={}&tags={}'.format(PAGE_SIZE, TAGS[x]) for x in tags],
+        'content': ['/articles/{}'.format(x) for x in picked],
+        'comments': ['/articles/{}/comments?size={}'.format(x, PAGE_SIZE) for x in picked],
+        'settings': ['/settings'],
+        'post_comment': [
+            ('POST', '/articles/{}/comments'.format(x), {'from': 'bench', 'body': 'Load test.', 'timestamp': 0})
+            for x in picked
+        ],
+        'delete_comment': [
+            ('DELETE', '/articles/{}/comments/{}'.format(aid, cid), None) for aid, cid in comments
+        ]
+    }
+
+
+def start_server(args, port):
+    """Start the server of the backend
+
+    :param args: parsed arguments
+    :param port: port of the server
+    :return: Popen
+    """
+    if args.backend == 'memory':
+        command = [sys.executable, '-c', MEMORY_SERVER.format(
+            host=HOST, port=port, articles=args.articles,
+            comments=args.comments, tags=TAGS, seed=args.seed
+        )]
+    else:
+        command = [
+            sys.executable, '-m', 'marucat_app.runner', '--host', HOST, '--port', str(port),
+            '--workers', str(args.workers), '--db', 'mongodb', '--test'
+        ]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def git_commit():
+    """Get the commit of the working tree
+
+    :return: commit hash, or None if it is not a git repository
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Throughput and tail latency of every endpoint over HTTP.')
+    parser.add_argument('--backend', choices=['memory', 'mongodb'], default='memory')
+    parser.add_argument('--articles', type=int, default=10000)
+    parser.add_argument('--comments', type=int, default=10)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load of an endpoint')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='workers of the runner, for mongodb')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='endpoints separated by commas')
+    parser.add_argument('--output', default=None, help='write the result to the file too')
+    args = parser.parse_args()
+
+    # the server generates the same articles by the same seed
+    articles = list(generate_articles(args.articles, comments=args.comments, tags=TAGS, seed=args.seed))
+    if args.backend == 'mongodb':
+        seed_mongodb(articles)
+    requests = prepare(articles, skew=args.skew, seed=args.seed)
+
+    port = free_port()
+    server = start_server(args, port)
+    results = {}
+    try:
+        if not wait_until_up(HOST, port, timeout=600):
+            raise RuntimeError('Server was not up: {}'.format(args.backend))
+        for endpoint in args.endpoints.split(','):
+            result = run_load(HOST, port, requests[endpoint], clients=args.clients, duration=args.duration)
+            result['latency'] = summarize(result.pop('latencies'))
+            results[endpoint] = result
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    result = {
+        'benchmark': 'http',
+        'commit': git_commit(),
+        'backend': args.backend,
+        'articles': args.articles,
+        'comments': args.comments,
+        'skew': args.skew,
+        'seed': args.seed,
+        'clients': args.clients,
+        'duration': args.duration,
+        'workers': args.workers if args.backend == 'mongodb' else 1,
+        'results': results
+    }
+    report(result)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            report(result, f)
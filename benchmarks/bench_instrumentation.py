@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Overhead of instrumentation of database calls
+
+The former log decorator formatted its message on every call,
+even if INFO was disabled. It is kept here for comparison.
+
+Usage:
+    python -m benchmarks.bench_instrumentation [--calls 200000]
+"""
+
+from argparse import ArgumentParser
+from functools import wraps
+from logging import getLogger, ERROR
+from time import perf_counter
+
+from benchmarks.common import report
+from marucat_app.database_helper import Articles
+from marucat_app.utils.metrics import INSTRUMENTATION
+
+logger = getLogger()
+
+
+class NullConnector(object):
+    """Connector doing nothing, only the decorator is measured"""
+
+    @staticmethod
+    def update_views(article_id, n=1):
+        return None
+
+
+def formatted_log(func):
+    """The former decorator"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        real_args = args[1:]
+        logger.info('{}/{} is executed. {}'.format(
+            args[0].__class__.__name__,
+            func.__name__,
+            'Parameter(s): {} {}'.format(
+                real_args if not real_args == () else '',
+                kwargs if not kwargs == {} else ''
+            ) if not kwargs == {} or not args[1:] == () else ''
+        ))
+        return result
+
+    return wrapper
+
+
+class FormattedArticles(Articles):
+    """Articles with the former decorator"""
+
+    @formatted_log
+    def update_views(self, article_id, n=1):
+        return self._connector.update_views(article_id, n)
+
+
+def per_call(method, calls):
+    """Average time of a call
+
+    :param method: bound method, called with an article ID
+    :param calls: counts of calls
+    :return: microseconds per call
+    """
+    start = perf_counter()
+    for _ in range(calls):
+        method('aid1234')
+    return round((perf_counter() - start) / calls * 1e6, 3)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Overhead of instrumentation of database calls.')
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    # the default level, logs are dropped
+    logger.setLevel(ERROR)
+    connector = NullConnector()
+    articles = Articles(connector)
+
+    results = {
+        'bare': per_call(connector.update_views, args.calls),
+        'formatted_log': per_call(FormattedArticles(connector).update_views, args.calls)
+    }
+    INSTRUMENTATION.configure(metrics=False, logs=False)
+    results['disabled'] = per_call(articles.update_views, args.calls)
+    INSTRUMENTATION.configure(metrics=True, logs=False)
+    results['metrics'] = per_call(articles.update_views, args.calls)
+
+    report({
+        'benchmark': 'instrumentation',
+        'calls': args.calls,
+        'us_per_call': results
+    })
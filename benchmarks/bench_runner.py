@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Throughput of the development server and the prefork runner
+
+Both serve the fake database, so only the server and the app are measured.
+
+Usage:
+    python -m benchmarks.bench_runner [--clients 16] [--duration 10] [--workers N]
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+from benchmarks.common import summarize, report
+from benchmarks.load import run_load, wait_until_up
+
+HOST = '127.0.0.1'
+
+PATHS = [
+    '/articles?size=10',
+    '/articles/aid1234',
+    '/articles/aid1234/comments?size=10',
+    '/settings'
+]
+
+# development server of werkzeug, threaded
+DEV_SERVER = '''
+from werkzeug.serving import run_simple
+from marucat_app import create_app
+run_simple({host!r}, {port}, create_app(db='test'), threaded=True)
+'''
+
+
+def free_port():
+    """Find a free port
+
+    :return: port
+    """
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def measure(command, port, clients, duration):
+    """Start a server and load it
+
+    :param command: command to start the server
+    :param port: port of the server
+    :param clients: counts of concurrent clients
+    :param duration: seconds of load
+    :return: dict
+    """
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_until_up(HOST, port):
+            raise RuntimeError('Server was not up: {}'.format(command))
+        result = run_load(HOST, port, PATHS, clients=clients, duration=duration)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    result['latency'] = summarize(result.pop('latencies'))
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Throughput of the development server and the prefork runner.')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    port = free_port()
+    dev = measure(
+        [sys.executable, '-c', DEV_SERVER.format(host=HOST, port=port)],
+        port, args.clients, args.duration
+    )
+
+    port = free_port()
+    prefork = measure(
+        [sys.executable, '-m', 'marucat_app.runner', '--host', HOST, '--port', str(port),
+         '--workers', str(args.workers), '--db', 'test'],
+        port, args.clients, args.duration
+    )
+
+    report({
+        'benchmark': 'runner',
+        'clients': args.clients,
+        'duration': args.duration,
+        'workers': args.workers,
+        'results': {
+            'development_server': dev,
+            'prefork_runner': prefork
+        }
+    })
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Throughput of JSON serializer backends.
+
+Dump realistic pages of articles and comments by every available backend
+of marucat_app.utils.serializer, compact and pretty.
+
+Also compare the former conversion, deal_with_object_id walking
+the documents before dumping, with converting ObjectId in the encoder.
+
+Usage:
+    python -m benchmarks.bench_serializer [--size 999] [--rounds 50]
+"""
+
+from argparse import ArgumentParser
+from copy import deepcopy
+from time import perf_counter
+
+from bson import ObjectId
+
+from benchmarks.common import report
+from marucat_app.utils import serializer
+from marucat_app.utils.utils import get_current_time_in_milliseconds, deal_with_object_id
+
+
+def make_articles(size):
+    """A page of articles' list, like ArticlesConnector.get_list returns
+
+    :param size: counts of articles
+    :return: list of articles
+    """
+    return [{
+        '_id': ObjectId(),
+        'title': 'The article title {}'.format(i),
+        'author': 'Richard',
+        'peek': 'Just a peek at there. ' * 5,
+        'views': 998 + i,
+        'reviews': i % 17,
+        'tags': ['OK', 'red', 'blue'],
+        'timestamp': get_current_time_in_milliseconds(),
+        'deleted': False
+    } for i in range(size)]
+
+
+def make_comments(size):
+    """A page of comments, like ArticlesConnector.get_comments returns
+
+    :param size: counts of comments
+    :return: list of comments
+    """
+    aid = ObjectId()
+    return [{
+        'aid': aid,
+        'cid': ObjectId(),
+        'from': 'Mary',
+        'body': 'Just comment for {}, nothing special here.'.format(i),
+        'timestamp': get_current_time_in_milliseconds(),
+        'deleted': False
+    } for i in range(size)]
+
+
+def measure(dumps, data, pretty, rounds):
+    """Dump data many times
+
+    :return: dict, seconds per dump and MB per second
+    """
+    size = len(dumps(data, pretty))
+    start = perf_counter()
+    for _ in range(rounds):
+        dumps(data, pretty)
+    elapsed = (perf_counter() - start) / rounds
+    return {
+        'ms_per_dump': round(elapsed * 1000, 3),
+        'mb_per_s': round(size / elapsed / 1024 / 1024, 2),
+        'bytes': size
+    }
+
+
+def measure_conversion(data, rounds):
+    """Former walk-then-dump against dumping with the encoder hook
+
+    deal_with_object_id converts in place,
+    so every round of the former one gets its own copy made in advance.
+
+    :return: dict, milliseconds per page of both
+    """
+    copies = [deepcopy(data) for _ in range(rounds)]
+    start = perf_counter()
+    for x in copies:
+        serializer.dumps(deal_with_object_id(x))
+    before = (perf_counter() - start) / rounds
+
+    start = perf_counter()
+    for _ in range(rounds):
+        serializer.dumps(data)
+    after = (perf_counter() - start) / rounds
+
+    return {
+        'walk_then_dump_ms': round(before * 1000, 3),
+        'encoder_ms': round(after * 1000, 3),
+        'speedup': round(before / after, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Throughput of JSON serializer backends.')
+    parser.add_argument('--size', type=int, default=999, help='counts of items in a page')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    payloads = {
+        'articles': make_articles(args.size),
+        'comments': make_comments(args.size),
+    }
+
+    results = {}
+    for name, dumps in serializer.BACKENDS.items():
+        results[name] = {
+            '{}_{}'.format(payload, 'pretty' if pretty else 'compact'): measure(dumps, data, pretty, args.rounds)
+            for payload, data in payloads.items()
+            for pretty in (False, True)
+        }
+
+    report({
+        'benchmark': 'serializer',
+        'size': args.size,
+        'picked': serializer.BACKEND,
+        'backends': results,
+        'object_id_conversion': {
+            payload: measure_conversion(data, args.rounds) for payload, data in payloads.items()
+        }
+    })
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cold-start time of create_app.
+
+Every sample runs in a fresh interpreter, so imports are counted too.
+For MongoDB, the time until the app is ready is measured as well,
+it is what create_app blocked on when it wrote the connection log
+and created indexes synchronously.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 20] [--ready-timeout 30]
+"""
+
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+from benchmarks.common import summarize, report
+
+# run in a child interpreter, print seconds as JSON
+CHILD = '''
+import json, time
+start = time.perf_counter()
+from marucat_app import create_app
+from marucat_app.utils.utils import CONNECTOR_FACTORY
+app = create_app(db={db!r})
+created = time.perf_counter() - start
+ready = None
+factory = app.config[CONNECTOR_FACTORY]
+while time.perf_counter() - start < {timeout}:
+    if factory.readiness()['ready']:
+        ready = time.perf_counter() - start
+        break
+    time.sleep(0.001)
+print(json.dumps({{'created': created, 'ready': ready}}))
+'''
+
+
+def cold_start(db, timeout):
+    """Start the app in a fresh interpreter
+
+    :param db: db parameter of create_app
+    :param timeout: seconds to wait for readiness
+    :return: dict, seconds until created and until ready, None if not ready
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD.format(db=db, timeout=timeout)],
+        stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Cold-start time of create_app.')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--ready-timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    results = {}
+    for db in ('test', 'mongodb'):
+        samples = [cold_start(db, args.ready_timeout) for _ in range(args.runs)]
+        ready = [x['ready'] for x in samples if x['ready'] is not None]
+        results[db] = {
+            'create_app': summarize([x['created'] for x in samples]),
+            'until_ready': summarize(ready),
+            'never_ready': len(samples) - len(ready)
+        }
+
+    report({
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'results': results
+    })
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Helpers shared by benchmarks"""
+
+import json
+import sys
+from time import perf_counter
+
+from pymongo import MongoClient
+
+from marucat_app.utils.utils import get_initial_file
+
+
+def get_test_database():
+    """Get the test schema of MongoDB from config.ini
+
+    :return: database instance
+    """
+    mongo_conf = get_initial_file()['mongodb']
+    client = MongoClient(mongo_conf['url'], int(mongo_conf['port']))
+    return client[mongo_conf['test_schema']]
+
+
+def percentile(samples, p):
+    """Get the p-th percentile of samples
+
+    :param samples: sorted list of numbers
+    :param p: percentile, 0 to 100
+    :return: the value, or None if there is no sample
+    """
+    if not samples:
+        return None
+    k = min(len(samples) - 1, max(0, int(round(p / 100 * (len(samples) - 1)))))
+    return samples[k]
+
+
+def summarize(samples):
+    """Summarize latency samples
+
+    :param samples: list of seconds
+    :return: dict, counts and p50/p95/p99/max in milliseconds
+    """
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+        'p95_ms': round(percentile(samples, 95) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None,
+        'max_ms': round(samples[-1] * 1000, 3) if samples else None,
+    }
+
+
+def timed(func, *args, **kwargs):
+    """Call the function and measure it
+
+    :return: seconds, result
+    """
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def report(result, stream=sys.stdout):
+    """Print result as JSON
+
+    :param result: dict
+    :param stream: output stream
+    """
+    stream.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
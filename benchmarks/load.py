@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""HTTP load generator shared by benchmarks
+
+Clients run in processes, so the generator is not limited by the GIL
+of a single interpreter, every client sends requests one by one.
+"""
+
+import json
+import time
+from http.client import HTTPConnection
+from multiprocessing import Pool
+
+
+def _client(args):
+    """Send requests until the duration is over
+
+    :param args: host, port, requests, duration in seconds
+    :return: list of latency in seconds, counts of errors, counts of statuses
+    """
+    host, port, requests, duration = args
+    latencies = []
+    errors = 0
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        method, path, body = _request(requests[i % len(requests)])
+        i += 1
+        start = time.perf_counter()
+        try:
+            # a new connection per request, werkzeug speaks HTTP/1.0
+            connection = HTTPConnection(host, port, timeout=10)
+            if body is None:
+                connection.request(method, path)
+            else:
+                connection.request(method, path, json.dumps(body), {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if response.status >= 500:
+                errors += 1
+                continue
+        except OSError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors, statuses
+
+
+def _request(request):
+    """Normalize a request
+
+    :param request: path, or (method, path, JSON body or None)
+    :return: method, path, body
+    """
+    if isinstance(request, str):
+        return 'GET', request, None
+    return request
+
+
+def run_load(host, port, paths, *, clients=8, duration=10):
+    """Send requests by concurrent clients
+
+    Requests are dealt to clients in turn, so requests which can be sent only once,
+    like deleting a comment, are never sent by two clients.
+    If there are fewer requests than clients, every client sends all of them.
+
+    :param host: host of server
+    :param port: port of server
+    :param paths: list of paths, or of (method, path, JSON body or None), requested in turn
+    :param clients: counts of concurrent clients
+    :param duration: seconds of load
+    :return: dict, requests, errors, statuses, requests per second and latency samples
+    """
+    if len(paths) >= clients:
+        dealt = [paths[i::clients] for i in range(clients)]
+    else:
+        dealt = [paths] * clients
+
+    with Pool(clients) as pool:
+        start = time.perf_counter()
+        results = pool.map(_client, [(host, port, x, duration) for x in dealt])
+        elapsed = time.perf_counter() - start
+
+    latencies = [x for result in results for x in result[0]]
+    statuses = {}
+    for result in results:
+        for status, n in result[2].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + n
+    return {
+        'requests': len(latencies),
+        'errors': sum(result[1] for result in results),
+        'statuses': statuses,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latencies': latencies
+    }
+
+
+def wait_until_up(host, port, *, timeout=30):
+    """Wait until the server accepts requests
+
+    :param host: host of server
+    :param port: port of server
+    :param timeout: seconds to wait
+    :return: True if it is up
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = HTTPConnection(host, port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
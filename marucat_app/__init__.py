@@ -3,21 +3,158 @@
 
 """Integrate the app, register blueprints and handle errors"""
 
-from logging import basicConfig, ERROR
+from logging import basicConfig, getLogger, ERROR, INFO
+from time import perf_counter
 
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
 
 from marucat_app.database_helper import ConnectorCreator
 from marucat_app.articles import bp as articles
 from marucat_app.settings import bp as settings
+from marucat_app.utils.compression import Compression
+from marucat_app.utils.metrics import (
+    INSTRUMENTATION, REGISTRY, MetricsExporter, RouteMetrics, merge, render
+)
 from marucat_app.utils.utils import (
-    CONNECTOR_FACTORY, APP_NAME
+    CONNECTOR_FACTORY, APP_NAME, STREAM_THRESHOLD, STREAM_CHUNK_SIZE, COMPRESSION, LIST_CACHE, METRICS,
+    get_initial_file, is_true
 )
 from marucat_app.utils.messages import create_error_message
 
 
+def _init_state(app, connector_factory, conf):
+    """Set connectors and caches to the app
+
+    :param app: app
+    :param connector_factory: ConnectorCreator
+    :param conf: ini file instance
+    """
+    app.config[CONNECTOR_FACTORY] = connector_factory
+
+    # cache pages of articles list, any write of articles drops them
+    cache_conf = conf['cache']
+    list_cache = connector_factory.create_cache(
+        'list', int(cache_conf['list_size']), cache_conf, ttl=float(cache_conf['list_ttl'])
+    )
+    app.config[LIST_CACHE] = list_cache
+    connector_factory.articles_helper.add_write_listener(
+        lambda article_id: list_cache.clear()
+    )
+
+    # compress responses
+    compression_conf = conf['compression']
+    if is_true(compression_conf['enabled']):
+        app.config[COMPRESSION] = Compression(
+            level=int(compression_conf['level']),
+            min_size=int(compression_conf['min_size']),
+            cpu_budget=float(compression_conf['cpu_budget']),
+            cache=connector_factory.create_cache(
+                'compression', int(compression_conf['cache_size']), cache_conf
+            )
+        )
+
+
+def _cache_samples(app, *, shared):
+    """Counters of caches as metrics samples
+
+    :param app: app
+    :param shared: True for caches shared by processes, False for the ones of this process
+    :return: list of (name, kind, labels, state)
+    """
+    factory = app.config[CONNECTOR_FACTORY]
+    caches = {
+        'list': app.config[LIST_CACHE],
+        'settings': factory.settings_cache.cache
+    }
+    if factory.articles_helper.content_cache is not None:
+        caches['content'] = factory.articles_helper.content_cache.cache
+    if COMPRESSION in app.config:
+        caches['compression'] = app.config[COMPRESSION].cache
+
+    samples = []
+    for name, cache in sorted(caches.items()):
+        if cache.shared != shared:
+            continue
+        stats = cache.stats()
+        labels = {'cache': name}
+        samples.extend([
+            ('cache_hits_total', 'counter', labels, stats['hits']),
+            ('cache_misses_total', 'counter', labels, stats['misses']),
+            ('cache_evictions_total', 'counter', labels, stats['evictions']),
+            ('cache_items', 'gauge', labels, stats['items']),
+            ('cache_bytes', 'gauge', labels, stats['bytes'])
+        ])
+    return samples
+
+
+def _init_metrics(app, conf, directory):
+    """Record requests and export metrics
+
+    Hooks are registered before compression, so its time is counted.
+
+    :param app: app
+    :param conf: ini file instance
+    :param directory: directory shared by workers, None means this process only
+    """
+    exporter = MetricsExporter(
+        directory,
+        interval=float(conf['metrics']['interval']),
+        # shared caches are counted once, by the process serving /metrics
+        collectors=[lambda: _cache_samples(app, shared=False)]
+    )
+    app.config[METRICS] = exporter
+
+    if not INSTRUMENTATION.metrics:
+        return
+
+    # registered on the first request of a route, later requests only look them up
+    routes = {None: RouteMetrics(blueprint='', endpoint='', route='')}
+    in_flight = REGISTRY.gauge('http_requests_in_flight')
+
+    @app.before_request
+    def _start_request():
+        """Count the request in flight"""
+        exporter.ensure_started()
+        in_flight.inc()
+        g.request_started = perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        """Record latency until the response was created, streamed bodies are not counted"""
+        started = g.get('request_started')
+        if started is None:
+            return response
+
+        route = routes.get(request.endpoint)
+        if route is None:
+            route = RouteMetrics(
+                blueprint=request.blueprint or '', endpoint=request.endpoint, route=request.url_rule.rule
+            )
+            routes[request.endpoint] = route
+        route.observe(perf_counter() - started, response.status_code)
+        return response
+
+    @app.teardown_request
+    def _finish_request(e):
+        if g.get('request_started') is not None:
+            in_flight.dec()
+
+
+def reset_app(app):
+    """Recreate connectors and caches of the app
+
+    Threads, locks and connections do not survive fork,
+    call it in a worker process after fork.
+    Connectors of the parent should be closed before fork.
+
+    :param app: app created by create_app
+    """
+    factory = app.config[CONNECTOR_FACTORY]
+    _init_state(app, ConnectorCreator(factory.db, test=factory.test), get_initial_file())
+
+
 # create flask application
-def create_app(*, level=ERROR, db='mongodb', test_flag=False):
+def create_app(*, level=ERROR, db='mongodb', test_flag=False, metrics_dir=None):
 
     # logging configuration
     basicConfig(
@@ -26,15 +163,71 @@ def create_app(*, level=ERROR, db='mongodb', test_flag=False):
     )
 
     app = Flask(APP_NAME)
-
-    app.config[CONNECTOR_FACTORY] = ConnectorCreator(db, test=test_flag)
     app.url_map.strict_slashes = False
 
+    conf = get_initial_file()
+
+    # instrument database calls, only a flag is read when both are off
+    INSTRUMENTATION.configure(
+        metrics=is_true(conf['metrics']['enabled']),
+        logs=getLogger().isEnabledFor(INFO)
+    )
+
+    # large pages are streamed
+    response_conf = conf['response']
+    app.config[STREAM_THRESHOLD] = int(response_conf['stream_threshold'])
+    app.config[STREAM_CHUNK_SIZE] = int(response_conf['stream_chunk_size'])
+
+    # connected in background, indexes are created once connected
+    _init_state(app, ConnectorCreator(db, test=test_flag), conf)
+
+    # metrics of workers are merged in the directory, from the runner or config.ini
+    _init_metrics(app, conf, metrics_dir or conf['metrics']['directory'] or None)
+
+    # compress responses
+    if COMPRESSION in app.config:
+        @app.after_request
+        def _compress(response):
+            """Compress by the current compression, it is recreated after fork"""
+            return app.config[COMPRESSION].after_request(response)
+
     @app.route('/')
     def _hello():
         """A greeting when the root path was visited"""
         return jsonify({'message': 'Hello'}), 202
 
+    @app.route('/ready')
+    def _ready():
+        """Readiness of the database, 503 until it was reached"""
+        readiness = app.config[CONNECTOR_FACTORY].readiness()
+        return jsonify(readiness), 200 if readiness['ready'] else 503
+
+    @app.route('/stats')
+    def _stats():
+        """Counters of caches, to size them in production"""
+        result = {
+            'list_cache': app.config[LIST_CACHE].stats(),
+            'settings_cache': app.config[CONNECTOR_FACTORY].settings_cache.stats()
+        }
+        content_cache = app.config[CONNECTOR_FACTORY].articles_helper.content_cache
+        if content_cache is not None:
+            result['content_cache'] = content_cache.stats()
+        single_flight = app.config[CONNECTOR_FACTORY].articles_helper.single_flight
+        if single_flight is not None:
+            result['single_flight'] = single_flight.stats()
+        if COMPRESSION in app.config:
+            result['compression'] = app.config[COMPRESSION].stats()
+        return jsonify(result), 200
+
+    @app.route('/metrics')
+    def _metrics():
+        """Metrics in the text format of Prometheus, of all workers"""
+        samples = merge([
+            app.config[METRICS].collect_all(),
+            _cache_samples(app, shared=True)
+        ])
+        return Response(render(samples), content_type='text/plain; version=0.0.4; charset=utf-8')
+
     @app.errorhandler(404)
     @app.errorhandler(405)
     def _not_found_or_method_not_allowed(e):
@@ -21,7 +21,14 @@ def articles_list_fetch():
     Query parameters
         - size: number, fetch size, 10 by default
         - offset: number, fetch start position, 0 by default
+        - cursor: string, next-cursor of previous page, offset is ignored if provided
         - tags: string or strings array, tags
+        - count: true or 1, set counts of articles to total-count header
+
+    Pages are cached per process until TTL or any write of articles,
+    except streamed ones.
+    ETag is the digest of the body, If-Modified-Since is ignored
+    since views and reviews change without changing timestamp.
 
     :return:
         - 200 normally
@@ -50,6 +57,16 @@ def articles_list_fetch():
 
     size = size if size != 0 else max_size
 
+    # get cursor from request
+    cursor = request.args.get('cursor')
+    # decode cursor if it is not a None
+    if cursor is not None:
+        try:
+            cursor = utils.decode_cursor(cursor)
+        except errors.InvalidCursorError:
+            error = messages.invalid_cursor()
+            return jsonify(error), 400
+
     # get tags from request
     tags = request.args.get('tags')
     # convert tags to list if it is not a None
@@ -59,23 +76,122 @@ def articles_list_fetch():
     # get articles helper
     articles_helper = utils.get_db_helper(current_app, ARTICLES_HELPER)
 
+    # large pages are streamed
+    if size >= current_app.config[utils.STREAM_THRESHOLD]:
+        return _stream_articles_list(articles_helper, size, offset, tags, cursor)
+
+    # pretty print if required or in debug mode
+    pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    count_flag = utils.is_true(request.args.get('count'))
+
+    # same page, same response
+    list_cache = current_app.config[utils.LIST_CACHE]
+    cache_key = (
+        size,
+        offset if cursor is None else 0,
+        tuple(tags) if isinstance(tags, list) else tags,
+        tuple(cursor) if cursor is not None else None,
+        count_flag,
+        pretty_flag
+    )
+    cached = list_cache.get(cache_key)
+    if cached is not None:
+        data, headers, etag = cached
+        # 304 without fetching
+        if utils.is_not_modified(etag):
+            return utils.create_not_modified_response(etag)
+        return make_response(data, 200, dict(headers))
+
     # fetch list
-    a_list = articles_helper.get_list(size=size, offset=offset, tags=tags)
+    try:
+        a_list, next_page = articles_helper.get_list(
+            size=size, offset=offset, tags=tags, cursor=cursor
+        )
+    except errors.InvalidCursorError:
+        error = messages.invalid_cursor()
+        return jsonify(error), 400
 
     # 404 not found
     if a_list is None or len(a_list) == 0:
         error = messages.articles_list_not_found(tags, offset)
         return jsonify(error), 404
 
-    # get all counts of articles
-    all_counts = articles_helper.get_articles_counts()
+    # the cursor points to the last article of this page
+    next_cursor = None
+    if next_page:
+        last = a_list[-1]
+        next_cursor = utils.encode_cursor([last['timestamp'], str(last['_id'])])
+
+    # next page was decided by the fetch
+    headers, data = utils.set_next_page_and_data(
+        None, size, offset, a_list, pretty_flag, next_cursor=next_cursor
+    )
+
+    # counts of articles costs one more query, only if required
+    if count_flag:
+        headers['total-count'] = articles_helper.get_articles_counts(tags=tags)
+
+    # validators, the newest article tells the last modified time
+    etag = utils.make_body_etag(data)
+    timestamps = [x['timestamp'] for x in a_list if 'timestamp' in x]
+    utils.set_validators(headers, etag, max(timestamps) if timestamps else None)
+
+    # keep the serialized page, its size is about the size of body
+    list_cache.set(cache_key, (data, dict(headers), etag), len(data) + 256)
+
+    # 304
+    if utils.is_not_modified(etag):
+        return utils.create_not_modified_response(etag)
+
+    # 200
+    return make_response(data, 200, headers)
+
+
+def _stream_articles_list(articles_helper, size, offset, tags, cursor):
+    """Stream articles list
+
+    Articles are fetched in batches and dumped in chunks while sending.
+    There is no ETag or Last-Modified, the body is not known before it is sent,
+    and views and reviews in it change without changing any version.
+
+    :param articles_helper: articles helper
+    :param size: fetch size
+    :param offset: fetch start position
+    :param tags: tags
+    :param cursor: decoded cursor or None
+    :return: response
+    """
+    chunk_size = current_app.config[utils.STREAM_CHUNK_SIZE]
+
+    # sort keys of the page are fetched here, articles are fetched while sending
+    try:
+        a_list, next_page, last = articles_helper.iter_list(
+            size=size, offset=offset, tags=tags, cursor=cursor, batch_size=chunk_size
+        )
+    except errors.InvalidCursorError:
+        error = messages.invalid_cursor()
+        return jsonify(error), 400
+
+    # 404 not found
+    if a_list is None:
+        error = messages.articles_list_not_found(tags, offset)
+        return jsonify(error), 404
+
+    # the cursor points to the last article of this page
+    next_cursor = None
+    if next_page:
+        next_cursor = utils.encode_cursor([last['timestamp'], str(last['_id'])])
+
     # pretty print if required or in debug mode
     pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
 
-    headers, data = utils.set_next_page_and_data(all_counts, size, offset, a_list, pretty_flag)
+    # headers are completed before the body starts
+    headers = utils.set_next_page(None, size, offset, next_cursor=next_cursor)
+    if utils.is_true(request.args.get('count')):
+        headers['total-count'] = articles_helper.get_articles_counts(tags=tags)
 
     # 200
-    return make_response(data, 200, headers)
+    return utils.create_stream_response(headers, a_list, 200, pretty_flag, chunk_size)
 
 
 @bp.route('/<article_id>', methods=['GET'])
@@ -85,9 +201,15 @@ def article_content(article_id):
     Query parameter
         comment_sizes: number, fetch comments size
 
+    ETag is made from the generation of article,
+    views are not a part of it, they change on every visit.
+    Conditional requests are checked by reading the version of article only,
+    the view is counted even if 304 is returned.
+
     :param article_id: string, the id of article
     :return:
         - 200 normally
+        - 304 not modified
         - 400 invalid query parameter
         - 404 not found
     """
@@ -120,21 +242,33 @@ def article_content(article_id):
 
     articles_helper = utils.get_db_helper(current_app, ARTICLES_HELPER)
 
+    # pretty print if required or in debug mode
+    pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+
     # fetch content
     try:
-        content = articles_helper.get_content(article_id, comments_size=comments_size)
+        state = None
+        if request.if_none_match or request.if_modified_since:
+            # check the version first, content is not fetched for 304
+            state = articles_helper.touch_article(article_id)
+            etag = utils.make_etag('content', article_id, state['generation'], comments_size, pretty_flag)
+            if utils.is_not_modified(etag, state['modified']):
+                return utils.create_not_modified_response(etag, state['modified'])
+
+        content = articles_helper.get_content(article_id, comments_size=comments_size, state=state)
     except errors.NoSuchArticleError:
         # 404
         error = messages.no_such_article()
         return jsonify(error), 404
 
-    # pretty print if required or in debug mode
-    pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
-
     headers, data = utils.set_next_page_and_data(
         content['reviews'], comments_size, 0, content, pretty_flag
     )
 
+    # validators
+    etag = utils.make_etag('content', article_id, content['generation'], comments_size, pretty_flag)
+    utils.set_validators(headers, etag, content['modified'])
+
     # 200
     return make_response(data, 200, headers)
 
@@ -145,11 +279,17 @@ def article_comments_fetch(article_id):
 
     Query parameters
         - size: number, fetch size
-        - page: number, fetch start position
+        - offset: number, fetch start position
+        - cursor: string, next-cursor of previous page, offset is ignored if provided
+
+    ETag is made from the generation of article and the page.
+    Only if the request has validators, they are checked by reading the version of article,
+    otherwise the version is read along with comments.
 
     :param article_id: article ID
     :return:
         - 200 normally
+        - 304 not modified
         - 400 invalid query parameters
         - 404 not found
     """
@@ -180,29 +320,91 @@ def article_comments_fetch(article_id):
 
     size = size if size != 0 else max_size
 
+    # get cursor from request
+    cursor = request.args.get('cursor')
+    # decode cursor if it is not a None
+    if cursor is not None:
+        try:
+            cursor = utils.decode_cursor(cursor)
+        except errors.InvalidCursorError:
+            error = messages.invalid_cursor()
+            return jsonify(error), 400
+
     articles_helper = utils.get_db_helper(current_app, ARTICLES_HELPER)
 
+    # pretty print if required or in debug mode
+    pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+
     # fetch comments
     try:
-        comments, count = articles_helper.get_comments(
-            article_id, size=size, offset=offset
+        if request.if_none_match or request.if_modified_since:
+            # check the version first, comments are not fetched for 304
+            state = articles_helper.touch_article(article_id, count_view=False)
+            etag = _comments_etag(article_id, state['generation'], size, offset, cursor, pretty_flag)
+            if utils.is_not_modified(etag, state['modified']):
+                return utils.create_not_modified_response(etag, state['modified'])
+
+        # the version of article is read along with comments
+        comments, count, state = articles_helper.get_comments(
+            article_id, size=size, offset=offset, cursor=cursor
         )
     except errors.NoSuchArticleError:
         # 404
         error = messages.no_such_article()
         return jsonify(error), 404
+    except errors.InvalidCursorError:
+        error = messages.invalid_cursor()
+        return jsonify(error), 400
 
-    # pretty print if required or in debug mode
-    pretty_flag = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    # validators of the fetched page
+    etag = _comments_etag(article_id, state['generation'], size, offset, cursor, pretty_flag)
+
+    # a full page may be followed by next page,
+    # the cursor points to the last comment of this page
+    next_cursor = None
+    if len(comments) == size:
+        next_cursor = utils.encode_cursor([str(comments[-1]['cid'])])
 
+    # large pages are dumped in chunks while sending
+    if size >= current_app.config[utils.STREAM_THRESHOLD]:
+        # counts of comments is meaningless for keyset paging
+        headers = utils.set_next_page(
+            count if cursor is None else None, size, offset, next_cursor=next_cursor
+        )
+        utils.set_validators(headers, etag, state['modified'])
+        # 200
+        return utils.create_stream_response(
+            headers, comments, 200, pretty_flag, current_app.config[utils.STREAM_CHUNK_SIZE]
+        )
+
+    # counts of comments is meaningless for keyset paging
     headers, data = utils.set_next_page_and_data(
-        count, size, offset, comments, pretty_flag
+        count if cursor is None else None, size, offset, comments, pretty_flag,
+        next_cursor=next_cursor
     )
+    utils.set_validators(headers, etag, state['modified'])
 
     # 200
     return make_response(data, 200, headers)
 
 
+def _comments_etag(article_id, generation, size, offset, cursor, pretty_flag):
+    """Make ETag of a comments page
+
+    :param article_id: article ID
+    :param generation: generation of article
+    :param size: fetch size
+    :param offset: fetch start position, ignored if cursor was provided
+    :param cursor: decoded cursor or None
+    :param pretty_flag: pretty print flag
+    :return: ETag without quotes
+    """
+    return utils.make_etag(
+        'comments', article_id, generation,
+        size, offset if cursor is None else None, cursor, pretty_flag
+    )
+
+
 @bp.route('/<article_id>/comments', methods=['POST'])
 def article_comments_save(article_id):
     """Push comment
@@ -4,93 +4,285 @@
 """DB connector API defined here"""
 
 from functools import wraps
+from hashlib import blake2b
 from logging import getLogger
+from time import perf_counter
 
 from pymongo import MongoClient
 
+from marucat_app.database_helper.article_cache import ArticleCache
 from marucat_app.database_helper.fake_articles_connector import FakeArticlesConnector
-from marucat_app.database_helper.articles_mongodb import ArticlesConnector
+from marucat_app.database_helper.fake_settings_connector import FakeSettingsConnector
+from marucat_app.database_helper.articles_mongodb import ArticlesConnector, MIN_SERVER_VERSION
+from marucat_app.database_helper.articles_memory import MemoryArticlesConnector, generate_articles
+from marucat_app.database_helper.comments_mongodb import create_comments_connector
+from marucat_app.database_helper.health import HealthProbe
 from marucat_app.database_helper.settings_mogodb import SettingsConnector
+from marucat_app.database_helper.settings_cache import SettingsCache
+from marucat_app.database_helper.single_flight import SingleFlight
+from marucat_app.database_helper.slow_queries import SlowQueryListener
+from marucat_app.database_helper.views_counter import ViewsCounter
+from marucat_app.utils.caches import create_cache
 from marucat_app.utils.errors import DatabaseNotExistError
-from marucat_app.utils.utils import get_initial_file, get_current_time_in_milliseconds
+from marucat_app.utils.metrics import INSTRUMENTATION, REGISTRY
+from marucat_app.utils.utils import get_initial_file, get_current_time_in_milliseconds, is_true
 
 logger = getLogger()
 
 
-def log(func):
-    """Decorator for logging
+def _summarize(value):
+    """Summarize a parameter for logs, without dumping data
 
-    Tell you the when function was called and show it's parameters.
+    :param value: parameter
+    :return: size of containers, short strings, or the value itself
+    """
+    if isinstance(value, (list, tuple, dict)):
+        return '{}[{}]'.format(type(value).__name__, len(value))
+    if isinstance(value, str) and len(value) > 64:
+        return '{}...'.format(value[:64])
+    return value
+
+
+def instrument(func):
+    """Decorator for instrumentation
+
+    Nothing but a flag is read if instrumentation is disabled.
+    Otherwise, latency and errors of the call are recorded to metrics,
+    and the call is logged at INFO with the time and summary of parameters,
+    the fields are in the 'call' attribute of log record too.
 
     :param func: target function
     :return: decorator
     """
+    method = func.__qualname__
+    # registered once, no lookup on calls
+    latency = REGISTRY.histogram('database_call_seconds', method=method)
+    calls_failed = REGISTRY.counter('database_call_errors_total', method=method)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        result = func(*args, **kwargs)
-        # format: Class/Method is executed. Parameter(s): (params) {kw params}
-        real_args = args[1:]
-        logger.info('{}/{} is executed. {}'.format(
-            args[0].__class__.__name__,
-            func.__name__,
-            'Parameter(s): {} {}'.format(
-                real_args if not real_args == () else '',
-                kwargs if not kwargs == {} else ''
-            ) if not kwargs == {} or not args[1:] == () else ''
-        ))
-        return result
+        if not INSTRUMENTATION.enabled:
+            return func(*args, **kwargs)
+
+        error = None
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            if INSTRUMENTATION.metrics:
+                latency.observe(elapsed)
+                if error is not None:
+                    calls_failed.inc()
+            if INSTRUMENTATION.logs:
+                call = {
+                    'method': method,
+                    'ms': round(elapsed * 1000, 3),
+                    'args': [_summarize(x) for x in args[1:]],
+                    'kwargs': {k: _summarize(v) for k, v in kwargs.items()},
+                    'error': type(error).__name__ if error is not None else None
+                }
+                logger.info(
+                    '%s is executed in %.3f ms. Parameter(s): %s %s%s',
+                    method, call['ms'], call['args'], call['kwargs'],
+                    ', failed: {}'.format(call['error']) if error is not None else '',
+                    extra={'call': call}
+                )
 
     return wrapper
 
 
+def _freeze(target):
+    """Make lists in parameters hashable
+
+    :param target: parameter
+    :return: tuple if it is a list, or itself
+    """
+    return tuple(target) if isinstance(target, list) else target
+
+
 class Articles(object):
     """All API about articles
 
     Database manipulator about articles.
+    Listeners are called with the article ID after every write,
+    caches of articles drop stale data by them.
+
+    Concurrent identical reads are coalesced if coalescing_timeout was provided,
+    only one of them reaches the database and the others share its result.
     """
 
-    def __init__(self, articles_connector):
+    def __init__(self, articles_connector, *, content_cache=None, coalescing_timeout=None):
+        """Initial helper
+
+        :param articles_connector: articles connector
+        :param content_cache: cache of content created by create_cache, None disables it
+        :param coalescing_timeout: seconds to wait for an identical read in flight,
+                None disables coalescing
+        """
         self._connector = articles_connector
+        self._write_listeners = []
+        self._content_cache = None
+        if content_cache is not None:
+            self._content_cache = ArticleCache(articles_connector, cache=content_cache)
+            self.add_write_listener(self._content_cache.invalidate)
+        self._single_flight = None
+        if coalescing_timeout is not None:
+            self._single_flight = SingleFlight(timeout=coalescing_timeout)
+            self.add_write_listener(lambda article_id: self._single_flight.forget())
+
+    def add_write_listener(self, listener):
+        """Add a listener of writes
+
+        :param listener: callable, called with the written article ID
+        """
+        self._write_listeners.append(listener)
+
+    def _written(self, article_id):
+        """Tell listeners an article was written
+
+        :param article_id: article ID
+        """
+        for listener in self._write_listeners:
+            listener(article_id)
+
+    def _coalesce(self, key, func):
+        """Share the result of an identical read in flight
 
-    @log
-    def get_list(self, *, size, offset, tags):
+        :param key: method name and parameters
+        :param func: the read
+        :return: result of the read
+        """
+        if self._single_flight is None:
+            return func()
+        return self._single_flight.do(key, func)[0]
+
+    @instrument
+    def get_list(self, *, size, offset, tags, cursor=None):
         """fetch articles list
 
         :param size: fetch size
         :param offset: counts of skips
         :param tags: tags
+        :param cursor: sort key of the last fetched article, offset is ignored if provided
+        :return: list of articles, next page flag
         """
-        return self._connector.get_list(size=size, offset=offset, tags=tags)
+        return self._coalesce(
+            ('get_list', size, offset, _freeze(tags), _freeze(cursor)),
+            lambda: self._connector.get_list(size=size, offset=offset, tags=tags, cursor=cursor)
+        )
+
+    @instrument
+    def iter_list(self, *, size, offset, tags, cursor=None, batch_size=100):
+        """fetch articles list lazily, for large pages
 
-    @log
-    def get_content(self, article_id, *, comments_size):
+        :param size: fetch size
+        :param offset: counts of skips
+        :param tags: tags
+        :param cursor: sort key of the last fetched article, offset is ignored if provided
+        :param batch_size: counts of articles fetched at a time
+        :return: iterator of articles, next page flag, sort key of the last article
+        """
+        return self._connector.iter_list(
+            size=size, offset=offset, tags=tags, cursor=cursor, batch_size=batch_size
+        )
+
+    @instrument
+    def get_content(self, article_id, *, comments_size, state=None):
         """fetch article content
 
         :param article_id: article ID
         :param comments_size: fetch comments size
+        :param state: result of touch_article if it was called, the view was counted by it
+        """
+        if self._single_flight is None:
+            return self._get_content(article_id, comments_size=comments_size, state=state)
+
+        if state is not None:
+            # views were counted one by one
+            content, _, _ = self._single_flight.do(
+                ('get_content', article_id, comments_size, 'counted'),
+                lambda: self._get_content(article_id, comments_size=comments_size, state=state)
+            )
+            content = dict(content)
+            content['views'] = state['views']
+            return content
+
+        content, leader, followers = self._single_flight.do(
+            ('get_content', article_id, comments_size),
+            lambda: self._get_content(article_id, comments_size=comments_size)
+        )
+
+        # the leader counted its own view, and counts the ones of followers by one write
+        if not leader:
+            return dict(content)
+        if followers:
+            self._connector.update_views(article_id, followers)
+        return content
+
+    def _get_content(self, article_id, *, comments_size, state=None):
+        """fetch article content from cache or database
+
+        :param article_id: article ID
+        :param comments_size: fetch comments size
+        :param state: result of touch_article if it was called, the view was counted by it
         """
-        return self._connector.get_content(article_id, comments_size=comments_size)
+        if self._content_cache is not None:
+            return self._content_cache.get_content(
+                article_id, comments_size=comments_size, state=state
+            )
+
+        content = self._connector.get_content(
+            article_id, comments_size=comments_size, count_view=state is None
+        )
+        if state is not None:
+            content['views'] = state['views']
+        return content
 
-    @log
-    def update_views(self, article_id):
+    @instrument
+    def touch_article(self, article_id, *, count_view=True):
+        """count a view and read the version of article, without content
+
+        :param article_id: article ID
+        :param count_view: count this view
+        :return: dict, views, generation and modified time
+        """
+        # views are counted one by one
+        if count_view:
+            return self._connector.touch_article(article_id)
+        return self._coalesce(
+            ('touch_article', article_id),
+            lambda: self._connector.touch_article(article_id, count_view=False)
+        )
+
+    @instrument
+    def update_views(self, article_id, n=1):
         """update the count of views when article was visited
 
         :param article_id: article ID
+        :param n: counts of views
         """
-        return self._connector.update_views(article_id)
+        return self._connector.update_views(article_id, n)
 
-    @log
-    def get_comments(self, article_id, *, size, offset):
+    @instrument
+    def get_comments(self, article_id, *, size, offset, cursor=None):
         """fetch comments of specific article
 
         :param article_id: article ID
         :param size: fetch size
         :param offset: fetch start position
-        :return: list of comments, count
+        :param cursor: ID of the last fetched comment, offset is ignored if provided
+        :return: list of comments, count, version of article, generation and modified time
         """
-        return self._connector.get_comments(article_id, size=size, offset=offset)
+        return self._coalesce(
+            ('get_comments', article_id, size, offset, _freeze(cursor)),
+            lambda: self._connector.get_comments(article_id, size=size, offset=offset, cursor=cursor)
+        )
 
-    @log
+    @instrument
     def post_comment(self, article_id, *, data):
         """Post new comment
 
@@ -100,8 +292,9 @@ class Articles(object):
         :param data: json data
         """
         self._connector.post_comment(article_id, data=data)
+        self._written(article_id)
 
-    @log
+    @instrument
     def delete_comment(self, article_id, comment_id):
         """Delete a comment
 
@@ -109,14 +302,39 @@ class Articles(object):
         :param comment_id: comment ID
         """
         self._connector.delete_comment(article_id, comment_id)
+        self._written(article_id)
 
-    @log
-    def get_articles_counts(self):
+    def ensure_indexes(self):
+        """Create declared indexes of articles and comments"""
+        self._connector.ensure_indexes()
+
+    @property
+    def content_cache(self):
+        """Get content cache
+
+        :return: ArticleCache, or None if it is disabled
+        """
+        return self._content_cache
+
+    @property
+    def single_flight(self):
+        """Get coalescing of reads
+
+        :return: SingleFlight, or None if it is disabled
+        """
+        return self._single_flight
+
+    @instrument
+    def get_articles_counts(self, *, tags=None):
         """Get articles counts
 
+        :param tags: tags
         :return: int, counts of articles
         """
-        return self._connector.get_articles_counts()
+        return self._coalesce(
+            ('get_articles_counts', _freeze(tags)),
+            lambda: self._connector.get_articles_counts(tags=tags)
+        )
 
 
 class Settings(object):
@@ -159,6 +377,17 @@ class Settings(object):
         """
         return self._connector.delete_one(name)
 
+    def get_version(self):
+        """Get the version stamp of settings
+
+        :return: int, version stamp
+        """
+        return self._connector.get_version()
+
+    def ensure_indexes(self):
+        """Create declared indexes of settings"""
+        self._connector.ensure_indexes()
+
 
 class ConnectorCreator(object):
     """Create connector
@@ -169,12 +398,32 @@ class ConnectorCreator(object):
     def __init__(self, db, *, test=False):
         """Initial database connection
 
+        Nothing is sent to the database here,
+        it is connected on first use and probed in background.
+
         :param db: specified database
         """
+        self.db = db
+        self.test = test
+        # prefix of cache names, shared caches of the same database share values
+        self.namespace = 'fake'
+        self._probe = None
+        self._client = None
+        self._views_counter = None
+        self._slow_queries = None
+        self._memory = None
         if db == 'test':
             # TEST mode load fake db helper
-            self._articles = Articles(FakeArticlesConnector())
-            self._settings = None
+            conf = get_initial_file()
+            self._articles = Articles(
+                FakeArticlesConnector(),
+                content_cache=self.content_cache(conf),
+                coalescing_timeout=self.coalescing_timeout(conf)
+            )
+            self._settings = Settings(FakeSettingsConnector())
+        elif db == 'memory':
+            # load in-memory helper, data lives in this process
+            self.init_memory()
         elif db == 'mongodb':
             # load MongoDB helper
             self.init_mongodb(test)
@@ -184,6 +433,52 @@ class ConnectorCreator(object):
                 'Specific Database do not exist: {}'.format(db)
             )
 
+        # cache settings' values
+        cache_conf = get_initial_file()['cache']
+        self._settings_cache = SettingsCache(
+            self._settings,
+            ttl=float(cache_conf['settings_ttl']),
+            cache=self.create_cache('settings', int(cache_conf['settings_size']), cache_conf)
+        )
+
+    def init_memory(self):
+        """Init in-memory helper
+
+        Articles are generated by the memory section of ini file,
+        the same seed generates the same articles in every process.
+        """
+        conf = get_initial_file()
+        memory_conf = conf['memory']
+        self.namespace = 'memory'
+
+        self._memory = MemoryArticlesConnector()
+        self.seed(
+            int(memory_conf['articles']),
+            comments=int(memory_conf['comments']),
+            tags=[x.strip() for x in memory_conf['tags'].split(',') if x.strip()],
+            seed=int(memory_conf['seed'])
+        )
+
+        self._articles = Articles(
+            self._memory,
+            content_cache=self.content_cache(conf),
+            coalescing_timeout=self.coalescing_timeout(conf)
+        )
+        self._settings = Settings(FakeSettingsConnector())
+
+    def seed(self, articles, *, comments=0, tags=(), seed=0):
+        """Generate articles into the memory database
+
+        :param articles: counts of articles
+        :param comments: counts of comments of an article
+        :param tags: tags to pick from
+        :param seed: random seed
+        :raise: DatabaseNotExistError if the database is not memory
+        """
+        if self._memory is None:
+            raise DatabaseNotExistError('Only the memory database can be seeded: {}'.format(self.db))
+        self._memory.insert_many(generate_articles(articles, comments=comments, tags=tags, seed=seed))
+
     def init_mongodb(self, test_flag):
         """Init MongoDB helper"""
         # get connection of MondoDB
@@ -203,24 +498,145 @@ class ConnectorCreator(object):
         # if test flag is True set current schema to test schema
         if test_flag:
             schema = mongo_conf['test_schema']
+        # the same schema of another server is another database,
+        # the server is hashed since the url may not fit in a filename
+        self.namespace = '{}-{}'.format(
+            schema, blake2b('{}:{}'.format(url, port).encode('utf-8'), digest_size=4).hexdigest()
+        )
 
         articles_collection = mongo_conf['articles_collection']
         settings_collection = mongo_conf['settings_collection']
-        # initial mongodb connection
-        client = MongoClient(url, port)
-
-        # test connection
-        # leave a log show the connect time
+        # time commands, log and explain slow ones
+        listeners = []
+        slow_conf = conf['slow_queries']
+        if is_true(slow_conf['enabled']):
+            self._slow_queries = SlowQueryListener(
+                threshold_ms=float(slow_conf['threshold_ms']),
+                sample_rate=float(slow_conf['explain_sample_rate']),
+                path=slow_conf['file'] or None,
+                max_bytes=int(slow_conf['max_bytes']),
+                backup_count=int(slow_conf['backup_count'])
+            )
+            listeners.append(self._slow_queries)
+
+        # initial mongodb connection, connect on first use
+        client = MongoClient(
+            url, port, connect=False,
+            serverSelectionTimeoutMS=int(float(mongo_conf['server_selection_timeout']) * 1000),
+            event_listeners=listeners
+        )
+        if self._slow_queries is not None:
+            self._slow_queries.attach(client)
         db = client[schema]
-        connect_log = db[logs_collection]
-        connect_log.insert_one({'time': get_current_time_in_milliseconds()})
+        self._client = client
+
+        # initial comments connector
+        comments_connector = create_comments_connector(db, mongo_conf)
+
+        # initial views counter
+        views_conf = conf['views']
+        views_counter = None
+        if views_conf['mode'] == 'buffered':
+            views_counter = ViewsCounter(
+                db[articles_collection],
+                interval=float(views_conf['flush_interval']),
+                threshold=int(views_conf['flush_threshold'])
+            )
+            views_counter.start()
+        self._views_counter = views_counter
 
         # initial mongodb connector
         # Articles: SCHEMA/articles
-        self._articles = Articles(ArticlesConnector(db[articles_collection]))
+        self._articles = Articles(
+            ArticlesConnector(db[articles_collection], comments_connector, views_counter),
+            content_cache=self.content_cache(conf),
+            coalescing_timeout=self.coalescing_timeout(conf)
+        )
         # Settings: SCHEMA/settings
         self._settings = Settings(SettingsConnector(db[settings_collection]))
 
+        def connected():
+            """Run once the database was reached"""
+            # leave a log show the connect time
+            db[logs_collection].insert_one({'time': get_current_time_in_milliseconds()})
+            # create indexes the queries need
+            self.ensure_indexes()
+
+        # test connection in background
+        self._probe = HealthProbe(
+            client, interval=float(mongo_conf['probe_interval']),
+            connected=connected, min_version=MIN_SERVER_VERSION
+        )
+        self._probe.start()
+
+    @staticmethod
+    def coalescing_timeout(conf):
+        """Get timeout of coalescing reads
+
+        :param conf: ini file instance
+        :return: seconds, or None if coalescing is disabled
+        """
+        coalescing_conf = conf['coalescing']
+        if not is_true(coalescing_conf['enabled']):
+            return None
+        return float(coalescing_conf['timeout'])
+
+    def create_cache(self, name, max_bytes, cache_conf, *, ttl=None):
+        """Create a cache of this database by the backend in config.ini
+
+        :param name: name of the cache
+        :param max_bytes: budget in bytes
+        :param cache_conf: cache section of ini file
+        :param ttl: seconds a value lives, None means forever
+        :return: cache
+        """
+        return create_cache(
+            '{}-{}'.format(self.namespace, name), max_bytes, conf=cache_conf, ttl=ttl
+        )
+
+    def content_cache(self, conf):
+        """Create the cache of articles' content
+
+        :param conf: ini file instance
+        :return: cache, or None if it is disabled
+        """
+        content_size = int(conf['cache']['content_size'])
+        if not content_size:
+            return None
+        return self.create_cache('content', content_size, conf['cache'])
+
+    def ensure_indexes(self):
+        """Create declared indexes of all connectors
+
+        It is safe to call it many times.
+        """
+        self._articles.ensure_indexes()
+        self._settings.ensure_indexes()
+
+    def close(self):
+        """Stop background threads, write buffered views and close connections
+
+        Connectors can not be used any more.
+        """
+        if self._probe is not None:
+            self._probe.stop()
+        if self._views_counter is not None:
+            self._views_counter.stop()
+        if self._slow_queries is not None:
+            self._slow_queries.stop()
+        if self._client is not None:
+            self._client.close()
+
+    def readiness(self):
+        """Tell whether the database is ready
+
+        :return: dict, ready flag, error and time of the last probe
+        """
+        if self._probe is None:
+            # fake connectors are always ready
+            return {'ready': True, 'error': None, 'checked_at': None}
+        return self._probe.status()
+
     @property
     def articles_helper(self):
         """Get articles helper
@@ -237,6 +653,14 @@ class ConnectorCreator(object):
         """
         return self._settings
 
+    @property
+    def settings_cache(self):
+        """Get settings cache
+
+        :return: settings cache
+        """
+        return self._settings_cache
+
 
 if __name__ == '__main__':
     c = ConnectorCreator('mongodb')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cache of articles' content"""
+
+from marucat_app.utils import serializer
+
+
+class ArticleCache(object):
+    """Cache formatted content of articles
+
+    Content is cached by article ID and comments size,
+    with the generation of article read together with it.
+    Every write of an article bumps its generation.
+
+    On a hit, only views and generation are read by touch_article,
+    which counts the view at the same time.
+    The cached content is used if the generation was not changed,
+    or it is fetched again without counting the view twice.
+    """
+
+    def __init__(self, connector, *, cache):
+        """Initial cache
+
+        :param connector: articles connector
+        :param cache: LRUCache or SharedCache, created by create_cache
+        """
+        self._connector = connector
+        self._cache = cache
+
+    def get_content(self, article_id, *, comments_size, state=None):
+        """Fetch article content and count this view
+
+        :param article_id: article ID
+        :param comments_size: fetch comments size
+        :param state: result of touch_article if it was called,
+                the view was counted by it
+        :raise: 404 NoSuchArticleError
+        :return: content
+        """
+        key = (article_id, comments_size)
+        cached = self._cache.get(key)
+
+        if cached is None:
+            content = self._connector.get_content(
+                article_id, comments_size=comments_size, count_view=state is None
+            )
+            self._store(key, content)
+            if state is not None:
+                content['views'] = state['views']
+            return content
+
+        if state is None:
+            state = self._connector.touch_article(article_id)
+
+        if state['generation'] != cached.get('generation', 0):
+            # changed by a write, views were counted by touch_article
+            content = self._connector.get_content(
+                article_id, comments_size=comments_size, count_view=False
+            )
+            self._store(key, content)
+        else:
+            # cached content is shared by requests, do not modify it
+            content = dict(cached)
+
+        content['views'] = state['views']
+        return content
+
+    def invalidate(self, article_id):
+        """Drop cached content of article in every comments size
+
+        Writes in other processes are found by the generation.
+
+        :param article_id: article ID
+        """
+        self._cache.delete_matching(lambda key: key[0] == article_id)
+
+    @property
+    def cache(self):
+        """Get the cache of content
+
+        :return: LRUCache or SharedCache
+        """
+        return self._cache
+
+    def stats(self):
+        """Counters of the cache
+
+        :return: dict
+        """
+        return self._cache.stats()
+
+    def _store(self, key, content):
+        """Cache content
+
+        :param key: key
+        :param content: content
+        """
+        self._cache.set(key, dict(content), len(serializer.dumps(content)))
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Articles connector, kept in memory
+
+Same semantics as ArticlesConnector with embedded comments,
+for benchmarks and tests without MongoDB.
+Data lives in the process, workers of a prefork runner do not share it.
+"""
+
+import random
+import struct
+from bisect import bisect_right, insort
+from itertools import islice
+from threading import Lock
+
+from bson import ObjectId
+
+from marucat_app.database_helper.articles_mongodb import parse_list_cursor
+from marucat_app.database_helper.comments_mongodb import parse_cursor
+from marucat_app.utils.errors import NoSuchArticleError, NoSuchArticleOrCommentError
+from marucat_app.utils.utils import get_current_time_in_milliseconds
+
+# fields of articles in list, reviews is always there
+LIST_FIELDS = ('_id', 'title', 'author', 'peek', 'views', 'tags', 'timestamp', 'deleted')
+
+# fields of article content, besides reviews, generation, modified and comments
+CONTENT_FIELDS = ('_id', 'title', 'author', 'content', 'views', 'tags', 'timestamp')
+
+
+def _sort_key(article):
+    """Key of the order of list, newest first
+
+    Same as sorting by timestamp and ID descending.
+
+    :param article: article document
+    :return: tuple, ascending
+    """
+    return -article['timestamp'], -int.from_bytes(article['_id'].binary, 'big')
+
+
+def _key_id(key):
+    """Get the article ID from a sort key
+
+    :param key: sort key
+    :return: ObjectId
+    """
+    return ObjectId((-key[1]).to_bytes(12, 'big'))
+
+
+def _project(article, fields):
+    """Copy fields which the article has
+
+    :param article: article document
+    :param fields: fields
+    :return: dict
+    """
+    result = {k: article[k] for k in fields if k in article}
+    if 'tags' in result:
+        result['tags'] = list(result['tags'])
+    return result
+
+
+class MemoryArticlesConnector(object):
+    """Articles connector
+
+    Articles are kept in a dict by ID,
+    indexes of sort keys are kept sorted for the list:
+
+    - non-deleted articles
+    - all of articles, for fetch_deleted
+    - non-deleted articles by tag, for a tag
+    - non-deleted articles by tags array, for tags, MongoDB matches arrays equal to it
+
+    Every method holds one lock, so it is safe for concurrent requests.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._articles = {}
+        self._live = []
+        self._all = []
+        self._by_tag = {}
+        self._by_tags = {}
+
+    def insert_many(self, articles):
+        """Insert articles
+
+        Missing fields are filled like a new article:
+        ID, timestamp, views, reviews and deleted flag.
+        Indexes are sorted once for all of them.
+
+        :param articles: iterable of article documents
+        :return: list of IDs
+        """
+        ids = []
+        with self._lock:
+            for article in articles:
+                article = dict(article)
+                article.setdefault('_id', ObjectId())
+                article.setdefault('timestamp', get_current_time_in_milliseconds())
+                article.setdefault('views', 0)
+                article.setdefault('deleted', False)
+                article.setdefault('tags', [])
+                comments = [dict(c) for c in article.get('comments', [])]
+                article['comments'] = comments
+                article.setdefault('reviews', len([c for c in comments if not c['deleted']]))
+                self._articles[article['_id']] = article
+                ids.append(article['_id'])
+            self._reindex()
+        return ids
+
+    def _reindex(self):
+        """Rebuild indexes, lock is held"""
+        self._all = []
+        self._live = []
+        self._by_tag = {}
+        self._by_tags = {}
+        for article in self._articles.values():
+            self._index(article, insert=False)
+        self._all.sort()
+        self._live.sort()
+        for index in list(self._by_tag.values()) + list(self._by_tags.values()):
+            index.sort()
+
+    def _index(self, article, *, insert=True):
+        """Add article to indexes, lock is held
+
+        :param article: article document
+        :param insert: keep indexes sorted, or append to them
+        """
+        add = insort if insert else list.append
+        key = _sort_key(article)
+        add(self._all, key)
+        if article['deleted']:
+            return
+        add(self._live, key)
+        for tag in set(article['tags']):
+            add(self._by_tag.setdefault(tag, []), key)
+        add(self._by_tags.setdefault(tuple(article['tags']), []), key)
+
+    def _list_index(self, tags, fetch_deleted):
+        """Pick the index of list, lock is held
+
+        :param tags: tag or list of tags
+        :param fetch_deleted: fetch deleted object flag
+        :return: sorted list of keys, and a filter of articles or None
+        """
+        if not tags:
+            return (self._all if fetch_deleted else self._live), None
+
+        if fetch_deleted:
+            # deleted articles are not indexed by tags
+            if isinstance(tags, list):
+                return self._all, lambda x: x['tags'] == tags
+            return self._all, lambda x: tags in x['tags']
+
+        if isinstance(tags, list):
+            return self._by_tags.get(tuple(tags), []), None
+        return self._by_tag.get(tags, []), None
+
+    def _page(self, *, size, offset, tags, cursor, fetch_deleted):
+        """Articles of a page and one more, lock is held
+
+        :return: list of article documents
+        """
+        index, accept = self._list_index(tags, fetch_deleted)
+
+        start, offset = 0, offset or 0
+        if cursor is not None:
+            timestamp, article_id = parse_list_cursor(cursor)
+            start = bisect_right(index, (-timestamp, -int.from_bytes(article_id.binary, 'big')))
+            offset = 0
+
+        if accept is None:
+            # every key of the index matches, skip by position
+            keys = index[start + offset:start + offset + size + 1]
+            return [self._articles[_key_id(key)] for key in keys]
+
+        # keys are filtered, skip matched ones
+        result = []
+        for key in islice(index, start, None):
+            article = self._articles[_key_id(key)]
+            if not accept(article):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            result.append(article)
+            if len(result) > size:
+                break
+        return result
+
+    def get_list(self, *, size, offset, tags=None, cursor=None, fetch_deleted=False):
+        """Fetch articles' list
+
+        :param size: length of list
+        :param offset: counts of skips
+        :param tags: tags
+        :param cursor: sort key of the last fetched article, [timestamp, ID]
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: InvalidCursorError
+        :return: fetched list or None if nothing was fetched, next page flag
+        """
+        with self._lock:
+            page = self._page(size=size, offset=offset, tags=tags, cursor=cursor, fetch_deleted=fetch_deleted)
+            result = [self._list_item(x) for x in page]
+
+        if len(result) == 0:
+            return None, False
+        return result[:size], len(result) > size
+
+    def iter_list(self, *, size, offset, tags=None, cursor=None, batch_size=100, fetch_deleted=False):
+        """Fetch articles' list lazily
+
+        Articles of the page are decided when called, and formatted while iterated.
+
+        :param size: length of list
+        :param offset: counts of skips
+        :param tags: tags
+        :param cursor: sort key of the last fetched article, [timestamp, ID]
+        :param batch_size: unused, articles are in memory
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: InvalidCursorError
+        :return: iterator of articles or None if nothing was fetched,
+                next page flag, sort key of the last article
+        """
+        with self._lock:
+            page = self._page(size=size, offset=offset, tags=tags, cursor=cursor, fetch_deleted=fetch_deleted)
+
+        if len(page) == 0:
+            return None, False, None
+
+        next_page = len(page) > size
+        page = page[:size]
+        last = {'_id': page[-1]['_id'], 'timestamp': page[-1]['timestamp']}
+        return (self._list_item(x) for x in page), next_page, last
+
+    @staticmethod
+    def _list_item(article):
+        """Format an article of list
+
+        :param article: article document
+        :return: dict
+        """
+        item = _project(article, LIST_FIELDS)
+        item['reviews'] = article.get('reviews', 0)
+        return item
+
+    def ensure_indexes(self):
+        """Indexes are kept by writes, nothing to create"""
+        pass
+
+    def get_content(self, article_id, *, comments_size, count_view=True):
+        """Fetch article content
+
+        :param article_id: article ID
+        :param comments_size: fetch comments size
+        :param count_view: count this view, False if it was counted by touch_article
+        :raise: 404 NoSuchArticleError
+        """
+        aid = ObjectId(article_id)
+        with self._lock:
+            article = self._articles.get(aid)
+            if article is None or article['deleted']:
+                raise NoSuchArticleError('No such article.')
+            if count_view:
+                article['views'] = article.get('views', 0) + 1
+
+            content = _project(article, CONTENT_FIELDS)
+            content['reviews'] = article.get('reviews', 0)
+            content['generation'] = article.get('generation', 0)
+            content['modified'] = article.get('modified', article.get('timestamp'))
+            content['comments'] = [
+                dict(c) for c in article['comments'] if not c['deleted']
+            ][:comments_size]
+        return content
+
+    def update_views(self, article_id, n=1):
+        """Count views of article
+
+        :param article_id: article ID
+        :param n: counts of views
+        """
+        with self._lock:
+            article = self._articles.get(ObjectId(article_id))
+            if article is not None:
+                article['views'] = article.get('views', 0) + n
+
+    def touch_article(self, article_id, *, count_view=True):
+        """Count a view and read the version of article
+
+        :param article_id: article ID
+        :param count_view: count this view
+        :raise: 404 NoSuchArticleError
+        :return: dict, views, generation and modified time
+        """
+        with self._lock:
+            article = self._articles.get(ObjectId(article_id))
+            if article is None or article['deleted']:
+                raise NoSuchArticleError('No such article.')
+            if count_view:
+                article['views'] = article.get('views', 0) + 1
+            return {
+                'views': article.get('views', 0),
+                'generation': article.get('generation', 0),
+                'modified': article.get('modified', article.get('timestamp'))
+            }
+
+    def get_comments(self, article_id, *, size, offset, cursor=None, fetch_deleted=False):
+        """Get comments of article
+
+        :param article_id: article ID
+        :param size: fetch size
+        :param offset: skip
+        :param cursor: ID of the last fetched comment, [cid]
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: 404 NoSuchArticleError, InvalidCursorError
+        :return: array of comments, count, version of article, generation and modified time
+        """
+        aid = ObjectId(article_id)
+        after = parse_cursor(cursor) if cursor is not None else None
+        with self._lock:
+            article = self._articles.get(aid)
+            if article is None:
+                raise NoSuchArticleError('No such articles.')
+            matched = [c for c in article['comments'] if c['deleted'] == bool(fetch_deleted)]
+            version = {
+                'generation': article.get('generation', 0),
+                'modified': article.get('modified', article.get('timestamp'))
+            }
+
+        if after is None:
+            page = matched[offset:offset + size]
+        else:
+            page = [c for c in matched if c['cid'] > after][:size]
+        return [dict(c) for c in page], len(matched), version
+
+    def post_comment(self, article_id, *, data):
+        """Post new comment
+
+        :param article_id: article ID
+        :param data: comment data
+        :raise: 404 NoSuchArticleError
+        """
+        aid = ObjectId(article_id)
+        data['cid'] = ObjectId()
+        data['aid'] = aid
+        data['deleted'] = False
+
+        with self._lock:
+            article = self._articles.get(aid)
+            if article is None:
+                raise NoSuchArticleError('No such article.')
+            article['comments'].append(dict(data))
+            self._written(article, reviews=1)
+
+    def delete_comment(self, article_id, comment_id):
+        """Delete a comment
+
+        :param article_id: article ID
+        :param comment_id: comment ID
+        :raises:
+            - 404 NoSuchArticleOrCommentError
+        """
+        aid, cid = ObjectId(article_id), ObjectId(comment_id)
+        with self._lock:
+            article = self._articles.get(aid)
+            comment = None
+            if article is not None:
+                comment = next(
+                    (c for c in article['comments'] if c['cid'] == cid and not c['deleted']), None
+                )
+            if comment is None:
+                raise NoSuchArticleOrCommentError('No such article or comment.')
+
+            comment['deleted'] = True
+            comment['deleted_time'] = get_current_time_in_milliseconds()
+            self._written(article, reviews=-1)
+
+    @staticmethod
+    def _written(article, *, reviews):
+        """Count comments and bump the version, lock is held
+
+        :param article: article document
+        :param reviews: change of non-deleted comments
+        """
+        article['reviews'] = article.get('reviews', 0) + reviews
+        article['generation'] = article.get('generation', 0) + 1
+        article['modified'] = max(article.get('modified', 0), get_current_time_in_milliseconds())
+
+    def reconcile_reviews(self, *, batch_size=500):
+        """Recount reviews of all articles
+
+        :param batch_size: unused, articles are in memory
+        :return: counts of updated articles, counts of skipped articles
+        """
+        updated = 0
+        with self._lock:
+            for article in self._articles.values():
+                counted = len([c for c in article['comments'] if not c['deleted']])
+                if article.get('reviews') != counted:
+                    article['reviews'] = counted
+                    self._written(article, reviews=0)
+                    updated += 1
+        return updated, 0
+
+    def get_articles_counts(self, *, tags=None):
+        """Get articles count
+
+        :param tags: tags
+        :return: counts of articles
+        """
+        with self._lock:
+            return len(self._list_index(tags, False)[0])
+
+
+def generate_articles(count, *, comments=0, tags=(), seed=0, start=1500000000000):
+    """Generate articles for benchmarks
+
+    The same parameters generate the same articles and IDs,
+    so workers of a prefork runner are seeded alike.
+    Tags are picked by a Zipf-like skew, the first ones are the most common.
+
+    :param count: counts of articles
+    :param comments: counts of comments of an article
+    :param tags: tags to pick from
+    :param seed: random seed
+    :param start: timestamp of the first article in milliseconds
+    :return: generator of article documents
+    """
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(tags))]
+    for i in range(count):
+        timestamp = start + i * 60000
+        aid = ObjectId(struct.pack('>I', timestamp // 1000) + i.to_bytes(8, 'big'))
+        picked = sorted(set(rng.choices(tags, weights, k=2))) if tags else []
+        yield {
+            '_id': aid,
+            'title': 'Article {}'.format(i),
+            'author': 'author{}'.format(rng.randrange(10)),
+            'peek': 'Peek of article {}.'.format(i),
+            'content': 'Content of article {}. '.format(i) * 20,
+            'tags': picked,
+            'timestamp': timestamp,
+            'views': 0,
+            'reviews': comments,
+            'deleted': False,
+            'comments': [
+                {
+                    'cid': ObjectId(struct.pack('>I', timestamp // 1000 + j + 1) + (i * 65536 + j).to_bytes(8, 'big')),
+                    'aid': aid,
+                    'from': 'reader{}'.format(rng.randrange(100)),
+                    'body': 'Comment {} of article {}.'.format(j, i),
+                    'timestamp': timestamp + (j + 1) * 1000,
+                    'deleted': False
+                }
+                for j in range(comments)
+            ]
+        }
@@ -4,10 +4,50 @@
 """Articles connector, driven by MongoDB."""
 
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
 
 # from marucat_app.utils.errors import NoSuchArticleError, NoSuchCommentError
-from marucat_app.utils.utils import deal_with_object_id, get_current_time_in_milliseconds
-from marucat_app.utils.errors import NoSuchArticleOrCommentError, NoSuchArticleError
+from marucat_app.database_helper.comments_mongodb import EmbeddedCommentsConnector
+from marucat_app.database_helper.indexes import ensure_indexes
+from marucat_app.utils.errors import NoSuchArticleError, InvalidCursorError
+from marucat_app.utils.utils import get_current_time_in_milliseconds
+
+# expressions in projection of find commands, like in get_content, need it
+MIN_SERVER_VERSION = (4, 4)
+
+# order of articles' list, newest first
+LIST_SORT = {'timestamp': -1, '_id': -1}
+
+# format of articles in list
+LIST_PROJECTION = {
+    '_id': 1,
+    'title': 1,
+    'author': 1,
+    'peek': 1,
+    'views': 1,
+    'tags': 1,
+    'timestamp': 1,
+    'deleted': 1,
+    # counter maintained by comment writes
+    'reviews': {'$ifNull': ['$reviews', 0]}
+}
+
+
+def parse_list_cursor(cursor):
+    """Get the sort key from an articles cursor
+
+    The timestamp must be a number, anything else could be taken
+    as query operators or never match any article.
+
+    :param cursor: [timestamp, ID]
+    :raise: InvalidCursorError
+    :return: timestamp, ObjectId of article
+    """
+    if len(cursor) != 2 or not ObjectId.is_valid(cursor[1]):
+        raise InvalidCursorError('Cursor is broken.')
+    if not isinstance(cursor[0], (int, float)) or isinstance(cursor[0], bool):
+        raise InvalidCursorError('Cursor is broken.')
+    return cursor[0], ObjectId(cursor[1])
 
 
 class ArticlesConnector(object):
@@ -16,189 +56,318 @@ class ArticlesConnector(object):
     Driven by MongoDB.
     """
 
-    def __init__(self, collection):
+    # indexes for the queries
+    INDEXES = [
+        # list, sorted by timestamp and ID
+        IndexModel([('deleted', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)]),
+        # list filtered by tags
+        IndexModel([('tags', ASCENDING), ('deleted', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)]),
+    ]
+
+    def __init__(self, collection, comments=None, views=None):
         """Initial mongodb connector
 
         :param collection: database instance
+        :param comments: comments connector, comments are embedded in articles by default
+        :param views: views counter, views are written synchronously if it is None
         """
         self._collection = collection
+        self._comments = comments if comments is not None else EmbeddedCommentsConnector(collection)
+        self._views = views
 
-    def get_list(self, *, size, offset, tags=None, fetch_deleted=False):
+    def get_list(self, *, size, offset, tags=None, cursor=None, fetch_deleted=False):
         """Fetch articles' list
 
         When size is 0, mean fetch all of the rest articles.
 
+        Articles are sorted by timestamp and ID, newest first.
+        If cursor was provided, fetch the articles after it and ignore offset,
+        so the cost does not grow with the depth of page.
+
         :param size: length of list
         :param offset: counts of skips
         :param tags: tags
+        :param cursor: sort key of the last fetched article, [timestamp, ID]
         :param fetch_deleted: fetch deleted object flag, only admin can set to True
-        :return: fetched list, or None if nothing was fetched
+        :raise: InvalidCursorError
+        :return: fetched list or None if nothing was fetched, next page flag
         """
 
         # edit condition
-        condition = {'$match': {}}
-        if not fetch_deleted:
-            condition['$match']['deleted'] = False
-        if tags:
-            condition['$match']['tags'] = tags
+        condition = {'$match': self._list_condition(tags, fetch_deleted)}
+        if cursor is not None:
+            condition['$match']['$or'] = self._after_cursor(cursor)
 
         # fetch format
-        projection = {
-            '$project': {
-                '_id': 1,
-                'title': 1,
-                'author': 1,
-                'peek': 1,
-                'views': 1,
-                'tags': 1,
-                'timestamp': 1,
-                'deleted': 1,
-                'reviews': {
-                    '$size': {
-                        '$filter': {
-                            'input': '$comments',
-                            'as': 'c',
-                            'cond': {'$not': '$$c.deleted'}
-                        }
-                    }
-                }
-            }
-        }
+        projection = {'$project': LIST_PROJECTION}
 
-        # fetch list
-        cur = self._collection.aggregate([
+        pipeline = [
             condition,
-            projection,
-            # skip first
-            {'$skip': offset},
-            # keep order after skip
-            {'$limit': size}
-        ])
+            # stable order, backed by index
+            {'$sort': LIST_SORT},
+        ]
+        # skip first, keyset paging does not need it
+        if cursor is None and offset:
+            pipeline.append({'$skip': offset})
+        # keep order after skip,
+        # one more article tells whether there is a next page
+        pipeline.append({'$limit': size + 1})
+        # only format the fetched articles
+        pipeline.append(projection)
+
+        # fetch list
+        cur = self._collection.aggregate(pipeline)
 
         # convert to list
         result = [i for i in cur]
 
         # check if nothing was fetched
         if len(result) == 0:
-            return None
+            return None, False
+
+        next_page = len(result) > size
+
+        # ObjectId is converted by the serializer
+        return result[:size], next_page
+
+    def iter_list(self, *, size, offset, tags=None, cursor=None, batch_size=100, fetch_deleted=False):
+        """Fetch articles' list lazily
+
+        Same as get_list, but articles are read from MongoDB in batches
+        while they are iterated, so a large page is never held in memory.
+
+        Sort keys of the page are fetched first by a query covered by index,
+        they tell the next page and the boundaries of the page.
+        Then articles between the boundaries are fetched by a cursor.
+
+        :param size: length of list
+        :param offset: counts of skips
+        :param tags: tags
+        :param cursor: sort key of the last fetched article, [timestamp, ID]
+        :param batch_size: counts of articles in a batch
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: InvalidCursorError
+        :return: iterator of articles or None if nothing was fetched,
+                next page flag, sort key of the last article
+        """
+
+        # edit condition
+        condition = self._list_condition(tags, fetch_deleted)
+        if cursor is not None:
+            condition['$or'] = self._after_cursor(cursor)
+
+        pipeline = [{'$match': condition}, {'$sort': LIST_SORT}]
+        # skip first, keyset paging does not need it
+        if cursor is None and offset:
+            pipeline.append({'$skip': offset})
+        # one more article tells whether there is a next page
+        pipeline.append({'$limit': size + 1})
+        # only sort keys, they are in the index
+        pipeline.append({'$project': {'_id': 1, 'timestamp': 1}})
+
+        keys = [i for i in self._collection.aggregate(pipeline)]
+
+        # check if nothing was fetched
+        if len(keys) == 0:
+            return None, False, None
+
+        next_page = len(keys) > size
+        first, last = keys[0], keys[min(size, len(keys)) - 1]
+
+        # articles between the first and the last one, both included
+        condition = self._list_condition(tags, fetch_deleted)
+        condition['$and'] = [
+            {'$or': [
+                {'timestamp': {'$lt': first['timestamp']}},
+                {'timestamp': first['timestamp'], '_id': {'$lte': first['_id']}}
+            ]},
+            {'$or': [
+                {'timestamp': {'$gt': last['timestamp']}},
+                {'timestamp': last['timestamp'], '_id': {'$gte': last['_id']}}
+            ]}
+        ]
+
+        # fetched in batches while iterating
+        cur = self._collection.aggregate([
+            {'$match': condition},
+            {'$sort': LIST_SORT},
+            {'$limit': size},
+            {'$project': LIST_PROJECTION}
+        ], batchSize=batch_size)
+
+        return cur, next_page, last
+
+    @staticmethod
+    def _list_condition(tags, fetch_deleted):
+        """Create the condition to match articles of list
+
+        :param tags: tags
+        :param fetch_deleted: fetch deleted object flag
+        :return: dict for $match
+        """
+        condition = {}
+        if not fetch_deleted:
+            condition['deleted'] = False
+        if tags:
+            condition['tags'] = tags
+        return condition
+
+    @staticmethod
+    def _after_cursor(cursor):
+        """Create the condition to match articles after the cursor
+
+        :param cursor: [timestamp, ID]
+        :raise: InvalidCursorError
+        :return: list for $or
+        """
+        timestamp, article_id = parse_list_cursor(cursor)
+
+        # newest first, so articles after the cursor are older than it
+        return [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': article_id}}
+        ]
+
+    def ensure_indexes(self):
+        """Create declared indexes of articles and comments
 
-        # convert ObjectId to str and return
-        return deal_with_object_id(result)
+        It is safe to call it many times.
+        """
+        ensure_indexes(self._collection, self.INDEXES)
+        self._comments.ensure_indexes()
 
-    def get_content(self, article_id, *, comments_size):
+    def get_content(self, article_id, *, comments_size, count_view=True):
         """Fetch article content
 
         Every times fetch the content of article,
         update the counts of views.
+        Views are updated and the formatted document is fetched by one command.
+        If there is a views counter, views are buffered by it
+        and the buffered ones are added to the fetched views.
+
+        Expressions in projection of find command require MongoDB 4.4 or later,
+        the health probe never reports an older server ready.
+        It is one command if comments are embedded,
+        bucketed comments are fetched by two more queries.
 
         :param article_id: article ID
         :param comments_size: fetch comments size
+        :param count_view: count this view, False if it was counted by touch_article
         :raise: 404 NoSuchArticleError
         """
 
         # edit condition
-        condition = {'$match': {'_id': ObjectId(article_id), 'deleted': False}}
-
-        # update views first
-        updated = self._collection.update_one(
-            condition,
-            {'$inc': {'views': 1}}
-        )
-
-        # if no matched article
-        if updated.modified_count == 0:
-            raise NoSuchArticleError('No such article.')
+        condition = {'_id': ObjectId(article_id), 'deleted': False}
 
         # format
         projection = {
-            '$project': {
-                '_id': 1,
-                'title': 1,
-                'author': 1,
-                'content': 1,
-                'views': 1,
-                'tags': 1,
-                'timestamp': 1,
-                'reviews': {
-                    '$size': {
-                        '$filter': {
-                            'input': '$comments',
-                            'as': 'c',
-                            'cond': {'$not': '$$c.deleted'}
-                        }
-                    }
-                },
-                'comments': {
-                    '$slice': [
-                        {
-                            '$filter': {
-                                'input': '$comments',
-                                'as': 'c',
-                                'cond': {'$not': '$$c.deleted'}
-                            }
-                        },
-                        comments_size
-                    ]
-                }
-            }
+            '_id': 1,
+            'title': 1,
+            'author': 1,
+            'content': 1,
+            'views': 1,
+            'tags': 1,
+            'timestamp': 1,
+            # counter maintained by comment writes
+            'reviews': {'$ifNull': ['$reviews', 0]},
+            # bumped by every write of the article
+            'generation': {'$ifNull': ['$generation', 0]},
+            # time of the last write, or of creation if never written
+            'modified': {'$ifNull': ['$modified', '$timestamp']},
+            # first comments if they are in the document
+            **self._comments.content_projection(comments_size)
         }
 
-        # fetch document
-        data = self._collection.aggregate([condition, projection])
-
-        # put result into list, it should be only one element if succeed
-        result = [x for x in data]
+        if self._views is None and count_view:
+            # update views and fetch the updated document
+            result = self._collection.find_one_and_update(
+                condition,
+                {'$inc': {'views': 1}},
+                projection=projection,
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            # views are buffered, just fetch document
+            result = self._collection.find_one(condition, projection)
 
         # if nothing was fetched raise error
-        if len(result) == 0:
+        if result is None:
             raise NoSuchArticleError('No such article.')
 
-        # deal with ObjectId and return the first element
-        return deal_with_object_id(result)[0]
+        # ObjectId is converted by the serializer
+        article = result
+        # the article exists, count this view
+        if self._views is not None:
+            pending = self._views.add(article_id) if count_view else self._views.pending(article_id)
+            article['views'] = article.get('views', 0) + pending
+        # first comments if they are not in the document
+        self._comments.fill_content(article, comments_size)
+        return article
 
-    def get_comments(self, article_id, *, size, offset, fetch_deleted=False):
-        """Get article content
+    def update_views(self, article_id, n=1):
+        """Count views of article
 
         :param article_id: article ID
-        :param size: fetch size
-        :param offset: skip
-        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :param n: counts of views
+        """
+        if self._views is not None:
+            self._views.add(article_id, n)
+        else:
+            self._collection.update_one({'_id': ObjectId(article_id)}, {'$inc': {'views': n}})
+
+    def touch_article(self, article_id, *, count_view=True):
+        """Count a view and read the version of article
+
+        Only views, generation and times are read, neither content nor comments,
+        so a cached content or a conditional request can be validated cheaply.
+
+        :param article_id: article ID
+        :param count_view: count this view
         :raise: 404 NoSuchArticleError
-        :return: array of comments, count
+        :return: dict, views, generation and modified time
         """
 
-        data = self._collection.aggregate([
-            # unwind comment array
-            {'$unwind': '$comments'},
-            # match condition
-            {'$match': {
-                '_id': ObjectId(article_id),
-                'comments.deleted': False if not fetch_deleted else True
-            }},
-            # group date and calculate count
-            {'$group': {
-                '_id': '$_id',
-                'count': {'$sum': 1},
-                'comments': {
-                    '$push': '$comments'
-                }
-            }},
-            # only fetch comments
-            {'$project': {
-                'count': 1,
-                'comments': {'$slice': ['$comments', offset, size]},
-            }},
-        ])
-
-        # get result
-        result = [x for x in data]
-
-        # check result
-        if len(result) == 0:
-            raise NoSuchArticleError('No such articles.')
+        condition = {'_id': ObjectId(article_id), 'deleted': False}
+        projection = {'_id': 0, 'views': 1, 'generation': 1, 'timestamp': 1, 'modified': 1}
+
+        if self._views is None and count_view:
+            # update views and fetch them by one command
+            result = self._collection.find_one_and_update(
+                condition,
+                {'$inc': {'views': 1}},
+                projection=projection,
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            result = self._collection.find_one(condition, projection)
+
+        if result is None:
+            raise NoSuchArticleError('No such article.')
+
+        views = result.get('views', 0)
+        if self._views is not None:
+            views += self._views.add(article_id) if count_view else self._views.pending(article_id)
 
-        # deal with ObjectId and return
-        return deal_with_object_id(result[0]['comments']), result[0]['count']
+        return {
+            'views': views,
+            'generation': result.get('generation', 0),
+            'modified': result.get('modified', result.get('timestamp'))
+        }
+
+    def get_comments(self, article_id, *, size, offset, cursor=None, fetch_deleted=False):
+        """Get comments of article
+
+        :param article_id: article ID
+        :param size: fetch size
+        :param offset: skip
+        :param cursor: ID of the last fetched comment, offset is ignored if provided
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: 404 NoSuchArticleError, InvalidCursorError
+        :return: array of comments, count, version of article, generation and modified time
+        """
+        return self._comments.get_comments(
+            article_id, size=size, offset=offset, cursor=cursor, fetch_deleted=fetch_deleted
+        )
 
     def post_comment(self, article_id, *, data):
         """Post new comment
@@ -217,15 +386,7 @@ class ArticlesConnector(object):
         # initial deleted flag
         data['deleted'] = False
 
-        # execute update to push new comment
-        result = self._collection.update_one(
-            {'_id': ObjectId(article_id)},
-            {'$push': {'comments': data}}
-        )
-
-        # check result
-        if result.modified_count == 0:
-            raise NoSuchArticleError('No such article.')
+        self._comments.post_comment(article_id, data=data)
 
     def delete_comment(self, article_id, comment_id):
         """Delete a comment
@@ -235,34 +396,65 @@ class ArticlesConnector(object):
         :raises:
             - 404 NoSuchArticleOrCommentError
         """
-        # update
-        r = self._collection.update_one(
-            # match specified article and comment
-            {
-                '_id': ObjectId(article_id),
-                'comments': {
-                    '$elemMatch': {
-                        'cid': ObjectId(comment_id),
-                        'deleted': False
+        self._comments.delete_comment(article_id, comment_id)
+
+    def reconcile_reviews(self, *, batch_size=500):
+        """Recount reviews of all articles
+
+        The counter of non-deleted comments is maintained by comment writes,
+        use this to fill it for existing data or to repair it.
+        Articles are processed in batches ordered by ID.
+
+        An article is skipped if its counter was changed by a comment write
+        during the batch, run it again to fix the skipped ones.
+
+        :param batch_size: counts of articles in a batch
+        :return: counts of updated articles, counts of skipped articles
+        """
+        updated, skipped = 0, 0
+        last_id = None
+
+        while True:
+            condition = {} if last_id is None else {'_id': {'$gt': last_id}}
+            batch = [x for x in self._collection.find(
+                condition, {'reviews': 1}
+            ).sort('_id', ASCENDING).limit(batch_size)]
+
+            if len(batch) == 0:
+                break
+            last_id = batch[-1]['_id']
+
+            counted = self._comments.count_reviews([x['_id'] for x in batch])
+
+            requests = []
+            for x in batch:
+                if x.get('reviews') == counted[x['_id']]:
+                    continue
+                # only update if no comment was written since the recount
+                guard = {'$exists': False} if 'reviews' not in x else x['reviews']
+                requests.append(UpdateOne(
+                    {'_id': x['_id'], 'reviews': guard},
+                    {
+                        '$set': {'reviews': counted[x['_id']]},
+                        '$inc': {'generation': 1},
+                        '$max': {'modified': get_current_time_in_milliseconds()}
                     }
-                }
-            },
-            # soft delete
-            {
-                '$set': {
-                    'comments.$.deleted': True,
-                    'comments.$.deleted_time': get_current_time_in_milliseconds()
-                }
-            }
-        )
+                ))
+
+            if requests:
+                result = self._collection.bulk_write(requests, ordered=False)
+                updated += result.matched_count
+                skipped += len(requests) - result.matched_count
 
-        # if there is nothing matched
-        if r.matched_count == 0:
-            raise NoSuchArticleOrCommentError('No such article or comment.')
+        return updated, skipped
 
-    def get_articles_counts(self):
+    def get_articles_counts(self, *, tags=None):
         """Get articles count
 
+        :param tags: tags
         :return: counts of articles
         """
-        return self._collection.count({'deleted': False})
+        condition = {'deleted': False}
+        if tags:
+            condition['tags'] = tags
+        return self._collection.count_documents(condition)
@@ -0,0 +1,621 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Comments connectors, driven by MongoDB.
+
+Two kinds of storage are supported.
+
+- embedded: comments are pushed into an array inside the article document
+- bucketed: comments are kept in bucket documents of their own collection,
+  every bucket holds a fixed count of comments of one article
+"""
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument, ReplaceOne
+
+from marucat_app.database_helper.indexes import ensure_indexes
+from marucat_app.utils.utils import get_current_time_in_milliseconds
+from marucat_app.utils.errors import (
+    NoSuchArticleOrCommentError, NoSuchArticleError, InvalidCursorError, DatabaseNotExistError
+)
+
+# filter of non-deleted comments in an array
+NOT_DELETED = {'$not': '$$c.deleted'}
+
+
+def parse_cursor(cursor):
+    """Get the comment ID from a comments cursor
+
+    Comment IDs are generated when comments were posted,
+    so they are ordered by the time of posting.
+
+    :param cursor: [cid]
+    :raise: InvalidCursorError
+    :return: ObjectId of comment
+    """
+    if len(cursor) != 1 or not ObjectId.is_valid(cursor[0]):
+        raise InvalidCursorError('Cursor is broken.')
+    return ObjectId(cursor[0])
+
+
+def _version(article):
+    """Get the version of article
+
+    :param article: article document with generation, timestamp and modified
+    :return: dict, generation and modified time
+    """
+    return {
+        'generation': article.get('generation', 0),
+        'modified': article.get('modified', article.get('timestamp'))
+    }
+
+
+class EmbeddedCommentsConnector(object):
+    """Comments connector
+
+    Comments are embedded in the article document.
+    """
+
+    # indexes for the queries, comments are found by the ID of article
+    INDEXES = []
+
+    def __init__(self, collection):
+        """Initial connector
+
+        :param collection: articles collection
+        """
+        self._collection = collection
+
+    def content_projection(self, comments_size):
+        """Fields to project comments along with the article content
+
+        :param comments_size: fetch comments size
+        :return: dict, merge it to the $project stage
+        """
+        return {
+            'comments': {
+                '$slice': [
+                    {
+                        '$filter': {
+                            'input': '$comments',
+                            'as': 'c',
+                            'cond': NOT_DELETED
+                        }
+                    },
+                    comments_size
+                ]
+            }
+        }
+
+    def fill_content(self, article, comments_size):
+        """Put comments into the fetched article content
+
+        Comments were projected along with the content, nothing to do.
+
+        :param article: article content
+        :param comments_size: fetch comments size
+        """
+        pass
+
+    def get_comments(self, article_id, *, size, offset, cursor=None, fetch_deleted=False):
+        """Get comments of article
+
+        Match the article by ID first, then filter and slice its comments,
+        the array is never unwound.
+        Comments are counted by the reviews counter instead of the array.
+        The version of article is read along with them.
+
+        If cursor was provided, fetch the comments after it and ignore offset.
+
+        :param article_id: article ID
+        :param size: fetch size
+        :param offset: skip
+        :param cursor: ID of the last fetched comment, [cid]
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: 404 NoSuchArticleError, InvalidCursorError
+        :return: array of comments, count, version of article, generation and modified time
+        """
+
+        # deleted or non-deleted comments
+        matched = {'$eq': ['$$c.deleted', bool(fetch_deleted)]}
+        comments = {'$ifNull': ['$comments', []]}
+
+        # non-deleted comments are counted by writes,
+        # only count them in the array if the counter was never filled
+        reviews = {'$ifNull': ['$reviews', {'$size': {
+            '$filter': {'input': comments, 'as': 'c', 'cond': NOT_DELETED}
+        }}]}
+        count = {'$subtract': [{'$size': comments}, reviews]} if fetch_deleted else reviews
+
+        if cursor is None:
+            cond = matched
+            skip = [offset]
+        else:
+            # only comments after the cursor are filtered, offset is ignored
+            cond = {'$and': [matched, {'$gt': ['$$c.cid', parse_cursor(cursor)]}]}
+            skip = []
+
+        data = self._collection.aggregate([
+            # match article by ID, use the index of _id
+            {'$match': {'_id': ObjectId(article_id)}},
+            # only fetch the page, count by the counter
+            {'$project': {
+                '_id': 0,
+                'count': count,
+                'comments': {'$slice': [
+                    {'$filter': {'input': comments, 'as': 'c', 'cond': cond}},
+                    *skip,
+                    size
+                ]},
+                'generation': {'$ifNull': ['$generation', 0]},
+                'modified': {'$ifNull': ['$modified', '$timestamp']}
+            }}
+        ])
+
+        # get result
+        result = [x for x in data]
+
+        # check result
+        if len(result) == 0:
+            raise NoSuchArticleError('No such articles.')
+
+        # ObjectId is converted by the serializer
+        return result[0]['comments'], result[0]['count'], _version(result[0])
+
+    def post_comment(self, article_id, *, data):
+        """Post new comment
+
+        Post data should be checked before this method called.
+
+        :param article_id: article ID
+        :param data: comment data, with cid, aid and deleted flag
+        :raise: 404 NoSuchArticleError
+        """
+
+        # execute update to push new comment, count it and bump the generation
+        result = self._collection.update_one(
+            {'_id': ObjectId(article_id)},
+            {
+                '$push': {'comments': data},
+                '$inc': {'reviews': 1, 'generation': 1},
+                '$max': {'modified': get_current_time_in_milliseconds()}
+            }
+        )
+
+        # check result
+        if result.modified_count == 0:
+            raise NoSuchArticleError('No such article.')
+
+    def delete_comment(self, article_id, comment_id):
+        """Delete a comment
+
+        :param article_id: article ID
+        :param comment_id: comment ID
+        :raises:
+            - 404 NoSuchArticleOrCommentError
+        """
+        # update
+        r = self._collection.update_one(
+            # match specified article and comment
+            {
+                '_id': ObjectId(article_id),
+                'comments': {
+                    '$elemMatch': {
+                        'cid': ObjectId(comment_id),
+                        'deleted': False
+                    }
+                }
+            },
+            # soft delete, uncount it and bump the generation
+            {
+                '$set': {
+                    'comments.$.deleted': True,
+                    'comments.$.deleted_time': get_current_time_in_milliseconds()
+                },
+                '$inc': {'reviews': -1, 'generation': 1},
+                '$max': {'modified': get_current_time_in_milliseconds()}
+            }
+        )
+
+        # if there is nothing matched
+        if r.matched_count == 0:
+            raise NoSuchArticleOrCommentError('No such article or comment.')
+
+    def count_reviews(self, article_ids):
+        """Count non-deleted comments of articles
+
+        :param article_ids: list of article ID
+        :return: dict, article ID: counts
+        """
+        data = self._collection.aggregate([
+            {'$match': {'_id': {'$in': article_ids}}},
+            {'$project': {
+                'counted': {
+                    '$size': {
+                        '$filter': {
+                            'input': {'$ifNull': ['$comments', []]},
+                            'as': 'c',
+                            'cond': NOT_DELETED
+                        }
+                    }
+                }
+            }}
+        ])
+        return {x['_id']: x['counted'] for x in data}
+
+    def ensure_indexes(self):
+        """Create declared indexes
+
+        Comments are found by the ID of article, nothing to create.
+        """
+        ensure_indexes(self._collection, self.INDEXES)
+
+
+class BucketedCommentsConnector(object):
+    """Comments connector
+
+    Comments are kept in buckets, a bucket looks like below.
+
+        {
+            'aid': article ID,
+            'seq': sequence of bucket, start from 0,
+            'count': counts of comments in bucket,
+            'live': counts of non-deleted comments in bucket,
+            'last_cid': the greatest comment ID in bucket,
+            'comments': [comment, ...], sorted by comment ID
+        }
+
+    The article document keeps the counts of posted comments,
+    which decides the bucket of the next comment.
+    """
+
+    # indexes of buckets for the queries
+    INDEXES = [
+        # buckets of article, in order
+        IndexModel([('aid', ASCENDING), ('seq', ASCENDING)], unique=True),
+        # skip buckets before the cursor in index
+        IndexModel([('aid', ASCENDING), ('seq', ASCENDING), ('last_cid', ASCENDING)]),
+        # find the bucket of comment
+        IndexModel([('aid', ASCENDING), ('comments.cid', ASCENDING)]),
+    ]
+
+    def __init__(self, articles_collection, buckets_collection, *, bucket_size=100):
+        """Initial connector
+
+        :param articles_collection: articles collection
+        :param buckets_collection: comment buckets collection
+        :param bucket_size: counts of comments in a bucket
+        """
+        self._articles = articles_collection
+        self._buckets = buckets_collection
+        self._bucket_size = bucket_size
+
+    def content_projection(self, comments_size):
+        """Fields to project comments along with the article content
+
+        Comments are not in the article document, nothing to project.
+
+        :param comments_size: fetch comments size
+        :return: dict, merge it to the $project stage
+        """
+        return {}
+
+    def fill_content(self, article, comments_size):
+        """Put comments into the fetched article content
+
+        :param article: article content
+        :param comments_size: fetch comments size
+        """
+        article['comments'] = self._fetch(
+            ObjectId(article['_id']), size=comments_size, offset=0, deleted=False
+        )
+
+    def get_comments(self, article_id, *, size, offset, cursor=None, fetch_deleted=False):
+        """Get comments of article
+
+        If cursor was provided, fetch the comments after it and ignore offset.
+
+        :param article_id: article ID
+        :param size: fetch size
+        :param offset: skip
+        :param cursor: ID of the last fetched comment, [cid]
+        :param fetch_deleted: fetch deleted object flag, only admin can set to True
+        :raise: 404 NoSuchArticleError, InvalidCursorError
+        :return: array of comments, count, version of article, generation and modified time
+        """
+        aid = ObjectId(article_id)
+        after = parse_cursor(cursor) if cursor is not None else None
+
+        # counters and version in article
+        article = self._articles.find_one(
+            {'_id': aid},
+            {'reviews': 1, 'comments_posted': 1, 'generation': 1, 'timestamp': 1, 'modified': 1}
+        )
+        if article is None:
+            raise NoSuchArticleError('No such articles.')
+
+        # counts of matched comments are kept by the article, buckets are not summed up
+        reviews = article.get('reviews', 0)
+        count = article.get('comments_posted', 0) - reviews if fetch_deleted else reviews
+
+        if after is not None:
+            comments = self._fetch_after(aid, size=size, cursor=after, deleted=fetch_deleted)
+        else:
+            comments = self._fetch(aid, size=size, offset=offset, deleted=fetch_deleted)
+
+        return comments, count, _version(article)
+
+    def _fetch_after(self, article_id, *, size, cursor, deleted):
+        """Fetch comments after the cursor from buckets
+
+        Buckets before the cursor are skipped by the index,
+        so the cost does not grow with the depth of page.
+
+        Comments in a bucket are sorted by ID, but concurrent posts can put
+        a comment with a greater ID into an earlier bucket,
+        so one more bucket is read after the page is full and they are merged by ID.
+
+        :param article_id: ObjectId of article
+        :param size: fetch size
+        :param cursor: ObjectId of the last fetched comment
+        :param deleted: fetch deleted or non-deleted comments
+        :return: array of comments
+        """
+        buckets = self._buckets.find(
+            {'aid': article_id, 'last_cid': {'$gt': cursor}},
+            {'_id': 0, 'comments': 1}
+        ).sort('seq', ASCENDING).batch_size(size // self._bucket_size + 2)
+
+        comments = []
+        full = False
+        for b in buckets:
+            comments.extend(
+                c for c in b['comments'] if c['deleted'] == deleted and c['cid'] > cursor
+            )
+            if full:
+                break
+            full = len(comments) >= size
+
+        comments.sort(key=lambda c: c['cid'])
+
+        # ObjectId is converted by the serializer
+        return comments[:size]
+
+    def _fetch(self, article_id, *, size, offset, deleted):
+        """Fetch comments from buckets
+
+        Read the counters of buckets in order first,
+        only until the requested page is covered,
+        then only fetch the buckets contain the requested page.
+
+        :param article_id: ObjectId of article
+        :param size: fetch size
+        :param offset: skip
+        :param deleted: fetch deleted or non-deleted comments
+        :return: array of comments
+        """
+
+        # counters of buckets, in order of the index
+        summaries = self._buckets.find(
+            {'aid': article_id},
+            {'_id': 0, 'seq': 1, 'count': 1, 'live': 1}
+        ).sort('seq', ASCENDING).batch_size((offset + size) // self._bucket_size + 2)
+
+        count = 0
+        seqs = []
+        skip = None
+        for b in summaries:
+            n = b['count'] - b['live'] if deleted else b['live']
+            # bucket contains a part of the page
+            if n and count + n > offset:
+                if skip is None:
+                    skip = offset - count
+                seqs.append(b['seq'])
+            count += n
+            # the page is covered, later buckets are not read
+            if count >= offset + size:
+                break
+
+        if len(seqs) == 0:
+            return []
+
+        buckets = self._buckets.find(
+            {'aid': article_id, 'seq': {'$in': seqs}},
+            {'_id': 0, 'comments': 1}
+        ).sort('seq', ASCENDING)
+
+        comments = [
+            c for b in buckets for c in b['comments'] if c['deleted'] == deleted
+        ]
+
+        # ObjectId is converted by the serializer
+        return comments[skip:skip + size]
+
+    def post_comment(self, article_id, *, data):
+        """Post new comment
+
+        Post data should be checked before this method called.
+
+        :param article_id: article ID
+        :param data: comment data, with cid, aid and deleted flag
+        :raise: 404 NoSuchArticleError
+        """
+        aid = ObjectId(article_id)
+
+        # count it, take a position and bump the generation
+        article = self._articles.find_one_and_update(
+            {'_id': aid},
+            {
+                '$inc': {'reviews': 1, 'comments_posted': 1, 'generation': 1},
+                '$max': {'modified': get_current_time_in_milliseconds()}
+            },
+            projection={'comments_posted': 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+        # check result
+        if article is None:
+            raise NoSuchArticleError('No such article.')
+
+        # the position decides the bucket
+        seq = (article['comments_posted'] - 1) // self._bucket_size
+
+        # the ID is generated after the position was taken,
+        # so IDs follow positions except among concurrent posts
+        data['cid'] = ObjectId()
+
+        self._buckets.update_one(
+            {'aid': aid, 'seq': seq},
+            {
+                # keep comments of bucket sorted by ID, whatever order concurrent posts arrive in
+                '$push': {'comments': {'$each': [data], '$sort': {'cid': 1}}},
+                '$inc': {'count': 1, 'live': 1},
+                '$max': {'last_cid': data['cid']}
+            },
+            upsert=True
+        )
+
+    def delete_comment(self, article_id, comment_id):
+        """Delete a comment
+
+        :param article_id: article ID
+        :param comment_id: comment ID
+        :raises:
+            - 404 NoSuchArticleOrCommentError
+        """
+        aid = ObjectId(article_id)
+
+        # update
+        r = self._buckets.update_one(
+            # match specified article and comment
+            {
+                'aid': aid,
+                'comments': {
+                    '$elemMatch': {
+                        'cid': ObjectId(comment_id),
+                        'deleted': False
+                    }
+                }
+            },
+            # soft delete and uncount it
+            {
+                '$set': {
+                    'comments.$.deleted': True,
+                    'comments.$.deleted_time': get_current_time_in_milliseconds()
+                },
+                '$inc': {'live': -1}
+            }
+        )
+
+        # if there is nothing matched
+        if r.matched_count == 0:
+            raise NoSuchArticleOrCommentError('No such article or comment.')
+
+        self._articles.update_one({'_id': aid}, {
+            '$inc': {'reviews': -1, 'generation': 1},
+            '$max': {'modified': get_current_time_in_milliseconds()}
+        })
+
+    def count_reviews(self, article_ids):
+        """Count non-deleted comments of articles
+
+        :param article_ids: list of article ID
+        :return: dict, article ID: counts
+        """
+        data = self._buckets.aggregate([
+            {'$match': {'aid': {'$in': article_ids}}},
+            {'$group': {'_id': '$aid', 'counted': {'$sum': '$live'}}}
+        ])
+        counted = {x['_id']: x['counted'] for x in data}
+        # articles without buckets have no comments
+        return {x: counted.get(x, 0) for x in article_ids}
+
+    def migrate_from_embedded(self, *, batch_size=100):
+        """Move embedded comments to buckets
+
+        Articles whose comments were moved are not touched again,
+        so it is safe to run it many times.
+
+        :param batch_size: counts of articles in a batch
+        :return: counts of moved articles
+        """
+        moved = 0
+
+        while True:
+            batch = [x for x in self._articles.find(
+                {'comments': {'$type': 'array'}},
+                {'comments': 1}
+            ).limit(batch_size)]
+
+            if len(batch) == 0:
+                break
+
+            for article in batch:
+                # buckets keep comments sorted by ID
+                comments = sorted(article['comments'], key=lambda c: c['cid'])
+                requests = []
+                for seq, start in enumerate(range(0, len(comments), self._bucket_size)):
+                    part = comments[start:start + self._bucket_size]
+                    # replace the bucket left by an interrupted run
+                    requests.append(ReplaceOne(
+                        {'aid': article['_id'], 'seq': seq},
+                        {
+                            'aid': article['_id'],
+                            'seq': seq,
+                            'count': len(part),
+                            'live': len([c for c in part if not c['deleted']]),
+                            'last_cid': max(c['cid'] for c in part),
+                            'comments': part
+                        },
+                        upsert=True
+                    ))
+
+                if requests:
+                    self._buckets.bulk_write(requests)
+
+                self._articles.update_one(
+                    {'_id': article['_id']},
+                    {
+                        '$set': {'comments_posted': len(comments)},
+                        '$unset': {'comments': ''}
+                    }
+                )
+                moved += 1
+
+        return moved
+
+    def ensure_indexes(self):
+        """Create declared indexes
+
+        It is safe to call it many times.
+        """
+        ensure_indexes(self._buckets, self.INDEXES)
+
+
+def create_comments_connector(db, mongo_conf, *, storage=None):
+    """Create the comments connector of the storage in config.ini
+
+    :param db: database instance
+    :param mongo_conf: mongodb section of ini file
+    :param storage: embedded or bucketed, comments_storage of ini file by default
+    :raise: DatabaseNotExistError
+    :return: comments connector
+    """
+    if storage is None:
+        storage = mongo_conf['comments_storage']
+    articles_collection = db[mongo_conf['articles_collection']]
+
+    if storage == 'embedded':
+        # Comments: SCHEMA/articles.comments
+        return EmbeddedCommentsConnector(articles_collection)
+    if storage == 'bucketed':
+        # Comments: SCHEMA/comments
+        return BucketedCommentsConnector(
+            articles_collection,
+            db[mongo_conf['comments_collection']],
+            bucket_size=int(mongo_conf['comments_bucket_size'])
+        )
+    # Specific storage is not supported
+    raise DatabaseNotExistError(
+        'Specific comments storage do not exist: {}'.format(storage)
+    )
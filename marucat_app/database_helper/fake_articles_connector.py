@@ -3,7 +3,9 @@
 
 """A fake db connector just for testing"""
 
-from marucat_app.utils.errors import NoSuchArticleError, NoSuchArticleOrCommentError
+from marucat_app.utils.errors import (
+    NoSuchArticleError, NoSuchArticleOrCommentError, InvalidCursorError
+)
 
 
 def do_something(*obj):
@@ -19,7 +21,7 @@ class FakeArticlesConnector(object):
     """A fake API for testing"""
 
     @staticmethod
-    def get_list(*, size, offset, tags=None):
+    def get_list(*, size, offset, tags=None, cursor=None):
         """Fetch articles' list
 
         When size is equals to zero, it is mean fetch all of the articles.
@@ -27,24 +29,46 @@ class FakeArticlesConnector(object):
         :param size: length of list
         :param offset: counts of skips
         :param tags: tags
+        :param cursor: sort key of the last fetched article
         """
 
+        if cursor is not None and len(cursor) != 2:
+            raise InvalidCursorError('Cursor is broken.')
+
         fake_data = [
             {
                 'content': 'Fake contents'
             },
             {
+                '_id': 'TEST_ID',
+                'timestamp': 1,
                 'test_only': 'TESTING',
                 'size': size,
                 'offset': offset,
-                'tags': tags
+                'tags': tags,
+                'cursor': cursor
             }
         ]
 
-        return fake_data
+        return fake_data, offset + size < 100
 
     @staticmethod
-    def get_content(article_id, *, comments_size):
+    def iter_list(*, size, offset, tags=None, cursor=None, batch_size=100):
+        """Fetch articles' list lazily
+
+        :param size: length of list
+        :param offset: counts of skips
+        :param tags: tags
+        :param cursor: sort key of the last fetched article
+        :param batch_size: counts of articles in a batch
+        """
+        fake_data, next_page = FakeArticlesConnector.get_list(
+            size=size, offset=offset, tags=tags, cursor=cursor
+        )
+        return iter(fake_data), next_page, fake_data[-1]
+
+    @staticmethod
+    def get_content(article_id, *, comments_size, count_view=True):
         """Fetch article content
 
         Every times fetch the content of article,
@@ -52,35 +76,65 @@ class FakeArticlesConnector(object):
 
         :param article_id: article ID
         :param comments_size: fetch comments size
+        :param count_view: count this view
         """
         if article_id == 'TEST_NOT_FOUND':
             raise NoSuchArticleError('No such article.')
         return {
             'aid': article_id,
             'reviews': 99,
+            'views': 0,
+            'generation': 0,
+            'modified': 1531128386417,
             'comments_size': comments_size
         }
 
     @staticmethod
-    def get_comments(article_id, *, size, offset):
+    def update_views(article_id, n=1):
+        """Count views of article
+
+        :param article_id: article ID
+        :param n: counts of views
+        """
+        do_something(article_id, n)
+
+    @staticmethod
+    def touch_article(article_id, *, count_view=True):
+        """Count a view and read the generation of article
+
+        :param article_id: article ID
+        :param count_view: count this view
+        """
+        if article_id == 'TEST_NOT_FOUND':
+            raise NoSuchArticleError('No such article.')
+        return {'views': 0, 'generation': 0, 'modified': 1531128386417}
+
+    @staticmethod
+    def get_comments(article_id, *, size, offset, cursor=None):
         """get article content
 
         :param article_id: article ID
         :param size: fetch size
         :param offset: fetch start position
+        :param cursor: ID of the last fetched comment
+        :return: array of comments, count, version of article
         """
         if article_id == 'TEST_NOT_FOUND':
             raise NoSuchArticleError('No such article.')
+        if cursor is not None and len(cursor) != 1:
+            raise InvalidCursorError('Cursor is broken.')
         return [
             {
                 'content': 'Fake contents'
             },
             {
+                'cid': 'TEST_CID',
                 'test_only_aid': article_id,
                 'offset': offset,
-                'size': size
+                'size': size,
+                'cursor': cursor
             }
-        ], 99
+        ], 99, {'generation': 0, 'modified': 1531128386417}
 
     @staticmethod
     def post_comment(article_id, *, data):
@@ -109,9 +163,18 @@ class FakeArticlesConnector(object):
             raise NoSuchArticleOrCommentError('No such comment.')
 
     @staticmethod
-    def get_articles_counts():
+    def ensure_indexes():
+        """Create declared indexes
+
+        Nothing to create.
+        """
+        pass
+
+    @staticmethod
+    def get_articles_counts(*, tags=None):
         """Get articles count
 
+        :param tags: tags
         :return: counts of articles
         """
         return 100
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A fake settings connector just for testing"""
+
+
+class FakeSettingsConnector(object):
+    """A fake API for testing
+
+    Settings are kept in a dict.
+    """
+
+    def __init__(self):
+        self._settings = {
+            'max_size': {'name': 'max_size', 'value': 999},
+            'default_size': {'name': 'default_size', 'value': 10},
+        }
+        self._version = 0
+
+    def get_list(self, *, size, offset):
+        """Get settings list
+
+        :param size: paging size
+        :param offset: skip
+        :return: list of settings
+        """
+        return list(self._settings.values())[offset:offset + size]
+
+    def get_one(self, name):
+        """Get specified one of settings
+
+        :param name: name
+        :return: specified one, or None if not exist
+        """
+        return self._settings.get(name)
+
+    def update_one(self, name, data):
+        """Update settings
+
+        :param name: name
+        :param data: data
+        :return: updated object
+        """
+        self._settings[name] = {**data, 'name': name}
+        self._version += 1
+        return self._settings[name]
+
+    def delete_one(self, name):
+        """Delete specified one of settings
+
+        :param name: name
+        :return: True or False tell you
+        """
+        result = self._settings.pop(name, None)
+        self._version += 1
+        return result is not None
+
+    def get_version(self):
+        """Get the version stamp of settings
+
+        :return: int, version stamp
+        """
+        return self._version
+
+    def ensure_indexes(self):
+        """Create declared indexes
+
+        Nothing to create.
+        """
+        pass
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Probe the health of MongoDB in background"""
+
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+from pymongo.errors import PyMongoError
+
+from marucat_app.utils.utils import get_current_time_in_milliseconds
+
+logger = getLogger()
+
+
+class HealthProbe(object):
+    """Ping MongoDB periodically in a daemon thread
+
+    Once the first ping succeeded, the version of server is checked
+    and the connected callback is run, like leaving a connection log and creating indexes.
+    They are run again on next probe if they were failed,
+    a server older than required is never ready.
+    """
+
+    def __init__(self, client, *, interval=10, connected=None, min_version=None):
+        """Initial probe
+
+        :param client: MongoClient, created with connect=False
+        :param interval: seconds between two pings
+        :param connected: callable, run once after the first succeeded ping
+        :param min_version: tuple, like (4, 4), required version of server, None skips the check
+        """
+        self._client = client
+        self._interval = interval
+        self._connected = connected
+        self._min_version = min_version
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+        self._ready = False
+        self._initialized = connected is None and min_version is None
+        self._error = 'Not probed yet.'
+        self._checked_at = None
+
+    def start(self):
+        """Start probing in background"""
+        self._thread = Thread(target=self._run, name='mongodb-health-probe', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop probing"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def probe(self):
+        """Ping MongoDB once
+
+        :return: True if MongoDB is ready
+        """
+        try:
+            self._client.admin.command('ping')
+            if not self._initialized:
+                if not self._check_version():
+                    return False
+                if self._connected is not None:
+                    self._connected()
+                self._initialized = True
+        except PyMongoError as e:
+            logger.warning('MongoDB is not ready: {}'.format(e))
+            self._set_status(False, str(e))
+            return False
+
+        self._set_status(True, None)
+        return True
+
+    def _check_version(self):
+        """Check the version of server
+
+        :return: True if it is new enough
+        """
+        if self._min_version is None:
+            return True
+        version = tuple(self._client.admin.command('buildInfo')['versionArray'][:len(self._min_version)])
+        if version >= self._min_version:
+            return True
+
+        error = 'MongoDB {} or later is required, the server is {}.'.format(
+            '.'.join(str(x) for x in self._min_version), '.'.join(str(x) for x in version)
+        )
+        logger.error(error)
+        self._set_status(False, error)
+        return False
+
+    def status(self):
+        """Result of the last probe
+
+        :return: dict, ready flag, error and time of the last probe in milliseconds
+        """
+        with self._lock:
+            return {
+                'ready': self._ready,
+                'error': self._error,
+                'checked_at': self._checked_at
+            }
+
+    def _set_status(self, ready, error):
+        """Keep the result of probe
+
+        :param ready: ready flag
+        :param error: error message or None
+        """
+        with self._lock:
+            self._ready = ready
+            self._error = error
+            self._checked_at = get_current_time_in_milliseconds()
+
+    def _run(self):
+        """Probe until stopped"""
+        while not self._stopped.is_set():
+            self.probe()
+            self._wake.wait(self._interval)
+            self._wake.clear()
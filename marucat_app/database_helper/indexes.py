@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Index registry helpers
+
+Every connector declares the indexes its queries need in `INDEXES`,
+a list of pymongo.IndexModel, and applies them by `ensure_indexes()`.
+"""
+
+from logging import getLogger
+
+logger = getLogger()
+
+
+def ensure_indexes(collection, indexes):
+    """Create declared indexes of a collection
+
+    Existing indexes with the same keys and options are kept,
+    so it is safe to call it many times.
+
+    :param collection: collection
+    :param indexes: list of pymongo.IndexModel
+    :return: names of indexes
+    """
+    if not indexes:
+        return []
+
+    names = collection.create_indexes(indexes)
+    logger.info('Indexes of {} are ensured: {}'.format(collection.name, names))
+    return names
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Check query plans of connectors
+
+Run every method of the MongoDB connectors against sample data,
+record the commands they send, explain each of them
+and report the ones scanning a whole collection.
+
+Sample data is written to collections of the test schema
+prefixed with `query_plans_`, and they are dropped afterwards.
+
+Usage:
+    python -m marucat_app.database_helper.query_plans
+
+Exit with status 1 if any command reports COLLSCAN.
+"""
+
+import sys
+from copy import deepcopy
+
+from pymongo import MongoClient, monitoring
+
+from marucat_app.database_helper.articles_mongodb import ArticlesConnector
+from marucat_app.database_helper.comments_mongodb import (
+    EmbeddedCommentsConnector, BucketedCommentsConnector
+)
+from marucat_app.database_helper.settings_mogodb import SettingsConnector
+from marucat_app.database_helper.views_counter import ViewsCounter
+from marucat_app.utils.utils import get_initial_file, get_current_time_in_milliseconds
+
+# prefix of sample collections
+PREFIX = 'query_plans_'
+
+# commands can be explained
+EXPLAINABLE = ('find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify')
+
+# fields added by driver, explain does not accept them
+DRIVER_FIELDS = ('lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'writeConcern', 'ordered')
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Record explainable commands"""
+
+    def __init__(self):
+        self.commands = []
+        self.enabled = False
+
+    def started(self, event):
+        if self.enabled and event.command_name in EXPLAINABLE:
+            self.commands.append(deepcopy(dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def strip_command(command):
+    """Make the recorded command explainable
+
+    Remove fields added by driver,
+    only keep the first statement of update and delete.
+
+    :param command: recorded command
+    :return: command
+    """
+    result = {k: v for k, v in command.items() if k not in DRIVER_FIELDS}
+    for k in ('updates', 'deletes'):
+        if k in result:
+            result[k] = result[k][:1]
+    return result
+
+
+def find_stages(plan):
+    """Find all of stages in the explained plan
+
+    Rejected plans are not counted.
+
+    :param plan: explain result
+    :return: list of stage names
+    """
+    stages = []
+    if isinstance(plan, dict):
+        for k, v in plan.items():
+            if k == 'rejectedPlans':
+                continue
+            if k == 'stage' and isinstance(v, str):
+                stages.append(v)
+            else:
+                stages.extend(find_stages(v))
+    elif isinstance(plan, list):
+        for x in plan:
+            stages.extend(find_stages(x))
+    return stages
+
+
+def exercise(db):
+    """Call every method of connectors against sample data
+
+    :param db: database
+    """
+    articles = db[PREFIX + 'articles']
+    buckets = db[PREFIX + 'comments']
+    settings = SettingsConnector(db[PREFIX + 'settings'])
+
+    settings.ensure_indexes()
+    db[PREFIX + 'settings'].insert_many([
+        {'name': 'max_size', 'value': 999},
+        {'name': 'default_size', 'value': 10},
+    ])
+    settings.get_one('max_size')
+    settings.get_version()
+    settings.get_list(size=10, offset=0)
+    settings.update_one('max_size', {'$set': {'value': 100}})
+    settings.delete_one('default_size')
+
+    for comments in [EmbeddedCommentsConnector(articles), BucketedCommentsConnector(articles, buckets, bucket_size=2)]:
+        for views in [None, ViewsCounter(articles)]:
+            connector = ArticlesConnector(articles, comments, views)
+            connector.ensure_indexes()
+
+            ids = articles.insert_many([{
+                'title': 'Article {}'.format(i),
+                'content': 'Nothing here',
+                'views': 0,
+                'tags': ['OK', 'red'] if i % 2 else ['blue'],
+                'timestamp': get_current_time_in_milliseconds(),
+                'deleted': False
+            } for i in range(5)]).inserted_ids
+            aid = str(ids[0])
+
+            for i in range(3):
+                connector.post_comment(aid, data={'from': 'Mary', 'body': str(i), 'timestamp': i})
+
+            a_list, _ = connector.get_list(size=2, offset=1)
+            connector.get_list(size=2, offset=0, cursor=[a_list[-1]['timestamp'], str(a_list[-1]['_id'])])
+            connector.get_list(size=2, offset=0, tags=['OK', 'red'])
+            streamed, _, _ = connector.iter_list(size=2, offset=1, tags=['OK', 'red'])
+            list(streamed)
+            connector.get_articles_counts(tags=['OK', 'red'])
+
+            connector.get_content(aid, comments_size=2)
+            connector.touch_article(aid)
+            connector.update_views(aid, 2)
+            if views is not None:
+                views.flush()
+
+            comments_list, _, _ = connector.get_comments(aid, size=2, offset=0)
+            connector.get_comments(aid, size=2, offset=0, cursor=[str(comments_list[-1]['cid'])])
+            connector.delete_comment(aid, str(comments_list[0]['cid']))
+            connector.reconcile_reviews(batch_size=2)
+
+            articles.delete_many({'_id': {'$in': ids}})
+            buckets.delete_many({'aid': {'$in': ids}})
+
+
+def check_query_plans(db, recorder):
+    """Explain commands of connectors
+
+    :param db: database, its client should be created with the recorder
+    :param recorder: CommandRecorder
+    :return: list of dict, command, stages and collscan flag
+    """
+    for name in db.list_collection_names():
+        if name.startswith(PREFIX):
+            db.drop_collection(name)
+
+    recorder.enabled = True
+    try:
+        exercise(db)
+    finally:
+        recorder.enabled = False
+
+    results = []
+    for command in recorder.commands:
+        command = strip_command(command)
+        plan = db.command('explain', command, verbosity='queryPlanner')
+        stages = find_stages(plan)
+        results.append({
+            'command': command,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages
+        })
+
+    for name in db.list_collection_names():
+        if name.startswith(PREFIX):
+            db.drop_collection(name)
+
+    return results
+
+
+def create_database(recorder):
+    """Connect to the test schema in config.ini with the recorder
+
+    :param recorder: CommandRecorder
+    :return: database
+    """
+    mongo_conf = get_initial_file()['mongodb']
+    client = MongoClient(
+        mongo_conf['url'], int(mongo_conf['port']), event_listeners=[recorder]
+    )
+    return client[mongo_conf['test_schema']]
+
+
+if __name__ == '__main__':
+    r = CommandRecorder()
+    checked = check_query_plans(create_database(r), r)
+
+    failed = [x for x in checked if x['collscan']]
+    for x in checked:
+        print('{} {} {}'.format(
+            'COLLSCAN' if x['collscan'] else 'OK      ',
+            ' > '.join(x['stages']),
+            x['command']
+        ))
+    print('{} commands explained, {} collection scans.'.format(len(checked), len(failed)))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cache of settings' values"""
+
+from threading import Lock
+from time import monotonic
+
+from marucat_app.utils import serializer
+from marucat_app.utils.caches import LRUCache
+
+# budget of cached values in bytes, if no cache was provided
+DEFAULT_SIZE = 1048576
+
+
+class SettingsCache(object):
+    """Cache settings' values
+
+    Values are served from the cache, LRUCache of this process by default.
+    Once the TTL was expired, the version stamp of settings is read
+    and all of values are dropped only if it was changed by a write.
+    Values are stamped with the version they were read at,
+    values of other versions are ignored, like ones in a shared cache
+    written by a process which has not seen the write yet.
+    """
+
+    def __init__(self, settings, *, ttl=5, cache=None):
+        """Initial cache
+
+        :param settings: settings helper
+        :param ttl: seconds between two checks of the version stamp,
+                0 means check it on every lookup
+        :param cache: LRUCache or SharedCache, created by create_cache
+        """
+        self._settings = settings
+        self._ttl = ttl
+        self._lock = Lock()
+        self._values = cache if cache is not None else LRUCache(DEFAULT_SIZE)
+        self._version = None
+        # bumped whenever values are dropped, values read before it are not cached
+        self._epoch = 0
+        self._checked_at = None
+        self._checking = False
+        self.hits = 0
+        self.misses = 0
+
+    def get_value(self, name):
+        """Get the value of specified settings
+
+        :param name: name
+        :return: the value of settings, or None if not exist
+        """
+        self._validate()
+        with self._lock:
+            stamp = (self._version, self._epoch)
+
+        # values are wrapped with their version, so a missing settings is told from a miss
+        cached = self._values.get(name)
+        if cached is not None and cached[1] == stamp[0]:
+            with self._lock:
+                self.hits += 1
+            return cached[0]
+
+        with self._lock:
+            self.misses += 1
+
+        result = self._settings.get_one(name)
+        value = result['value'] if result else None
+
+        size = len(serializer.dumps(value))
+        with self._lock:
+            # a value read before the cache was dropped is not cached,
+            # dropping and setting are both under the lock
+            if stamp == (self._version, self._epoch):
+                # missing settings are cached too
+                self._values.set(name, (value, stamp[0]), size)
+        return value
+
+    def update_one(self, name, data):
+        """Update settings and drop cached values
+
+        :param name: name
+        :param data: data
+        :return: updated object
+        """
+        result = self._settings.update_one(name, data)
+        self.invalidate()
+        return result
+
+    def delete_one(self, name):
+        """Delete specified one of settings and drop cached values
+
+        :param name: name
+        :return: True or False tell you
+        """
+        result = self._settings.delete_one(name)
+        self.invalidate()
+        return result
+
+    def invalidate(self):
+        """Drop all of cached values"""
+        with self._lock:
+            self._epoch += 1
+            self._checked_at = None
+            self._values.clear()
+
+    @property
+    def cache(self):
+        """Get the cache of values
+
+        :return: LRUCache or SharedCache
+        """
+        return self._values
+
+    def stats(self):
+        """Counters of the cache
+
+        :return: dict, hits, misses, size and version
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': self._values.stats()['items'],
+                'version': self._version
+            }
+
+    def _validate(self):
+        """Check the version stamp if TTL was expired
+
+        The stamp is read without holding the lock,
+        only one thread reads it while the others go on with the current one.
+        The lock is only held to compare and swap it.
+        """
+        now = monotonic()
+        with self._lock:
+            if self._checking or (self._checked_at is not None and now - self._checked_at < self._ttl):
+                return
+            self._checking = True
+
+        try:
+            version = self._settings.get_version()
+        finally:
+            with self._lock:
+                self._checking = False
+
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._epoch += 1
+                self._values.clear()
+            self._checked_at = now
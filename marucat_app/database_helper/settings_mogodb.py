@@ -2,13 +2,22 @@
 # -*- coding: utf-8 -*-
 
 """Settings connector, driven by MongoDb."""
-from pymongo import ReturnDocument
+from pymongo import ASCENDING, IndexModel, ReturnDocument
 
-from marucat_app.utils.utils import deal_with_object_id
+from marucat_app.database_helper.indexes import ensure_indexes
+
+# ID of the version stamp document in settings collection
+VERSION_ID = '_version'
 
 
 class SettingsConnector(object):
 
+    # indexes for the queries
+    INDEXES = [
+        # settings are found by name
+        IndexModel([('name', ASCENDING)]),
+    ]
+
     def __init__(self, collection):
         """Initial connector
 
@@ -23,8 +32,9 @@ class SettingsConnector(object):
         :param offset: skip
         :return: list of settings
         """
-        li = self._collection.find({}).skip(offset).limit(size)
-        return deal_with_object_id(li)
+        # the version stamp does not have a name, skip it
+        li = self._collection.find({'name': {'$exists': True}}).skip(offset).limit(size)
+        return [x for x in li]
 
     def get_one(self, name):
         """Get specified one of settings
@@ -32,8 +42,7 @@ class SettingsConnector(object):
         :param name: name
         :return: specified one
         """
-        result = self._collection.find_one({'name': name})
-        return deal_with_object_id(result)
+        return self._collection.find_one({'name': name})
 
     def update_one(self, name, data):
         """Update settings
@@ -44,7 +53,8 @@ class SettingsConnector(object):
         """
         # TODO deal with data
         result = self._collection.find_one_and_update({'name': name}, data, return_document=ReturnDocument.AFTER)
-        return deal_with_object_id(result)
+        self._bump_version()
+        return result
 
     def delete_one(self, name):
         """Delete specified one of settings
@@ -53,4 +63,31 @@ class SettingsConnector(object):
         :return: True or False tell you
         """
         result = self._collection.delete_one({'name': name})
+        self._bump_version()
         return bool(result.deleted_count)
+
+    def get_version(self):
+        """Get the version stamp of settings
+
+        The stamp is increased by every write,
+        caches compare it to know whether their values are out of date.
+
+        :return: int, version stamp, 0 if nothing was written
+        """
+        result = self._collection.find_one({'_id': VERSION_ID}, {'version': 1})
+        return result['version'] if result else 0
+
+    def ensure_indexes(self):
+        """Create declared indexes
+
+        It is safe to call it many times.
+        """
+        ensure_indexes(self._collection, self.INDEXES)
+
+    def _bump_version(self):
+        """Increase the version stamp"""
+        self._collection.update_one(
+            {'_id': VERSION_ID},
+            {'$inc': {'version': 1}},
+            upsert=True
+        )
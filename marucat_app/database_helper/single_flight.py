@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Coalesce concurrent identical calls"""
+
+from threading import Event, Lock
+
+
+class _Call(object):
+    """A call in flight"""
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.finished = False
+
+
+class SingleFlight(object):
+    """Run only one of concurrent calls with the same key
+
+    The first caller of a key runs the function,
+    callers of the same key arriving before it returns wait for it
+    and share its result or its error.
+    A caller waits at most timeout seconds, then runs the function by itself.
+    """
+
+    def __init__(self, *, timeout=5):
+        """Initial single flight
+
+        :param timeout: seconds a caller waits for the call in flight
+        """
+        self._timeout = timeout
+        self._lock = Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.timeouts = 0
+
+    def do(self, key, func):
+        """Run the function or wait for the one in flight
+
+        :param key: hashable key, same key means same result
+        :param func: callable without parameters
+        :raise: the error raised by the function
+        :return: result, leader flag,
+                counts of callers who shared the result if it is the leader or 0
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                call.followers += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self._timeout):
+                with self._lock:
+                    timeout = not call.finished
+                    if timeout:
+                        # leave the call, the leader does not count it
+                        call.followers -= 1
+                        self.timeouts += 1
+
+                # the one in flight is too slow, do not wait any more
+                if timeout:
+                    return func(), False, 0
+                call.done.wait()
+
+            with self._lock:
+                self.collapsed += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, False, 0
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # callers arriving from now on start a new call
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.finished = True
+                followers = call.followers
+            call.done.set()
+
+        return call.result, True, followers
+
+    def forget(self):
+        """Let callers from now on start new calls
+
+        Called after writes, results read before them are not shared any more.
+        Callers already waiting still share the calls in flight.
+        """
+        with self._lock:
+            self._calls = {}
+
+    def stats(self):
+        """Counters of coalescing
+
+        :return: dict, calls run, calls collapsed, timeouts and calls in flight
+        """
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'collapsed': self.collapsed,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._calls)
+            }
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Slow-query log of MongoDB commands
+
+Commands are timed by command monitoring of pymongo.
+Commands slower than the threshold are logged with the shape of their filter or pipeline,
+values are redacted, so no data of users gets into logs.
+A sample of them is explained in a background thread,
+and the summary of plans is written to a rotating file of the process.
+"""
+
+import os
+import random
+from logging import getLogger, Formatter, Logger, INFO
+from logging.handlers import RotatingFileHandler
+from queue import Queue, Full, Empty
+from threading import Lock, Thread, Event
+
+from bson import json_util
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+from marucat_app.utils.metrics import REGISTRY, INSTRUMENTATION
+
+logger = getLogger()
+
+# commands which can be explained, and their parts worth logging
+EXPLAINABLE = {
+    'find': ('filter', 'sort', 'projection', 'limit', 'skip'),
+    'aggregate': ('pipeline',),
+    'count': ('query',),
+    'distinct': ('key', 'query'),
+    'findAndModify': ('query', 'sort', 'update'),
+    'update': ('updates',),
+    'delete': ('deletes',)
+}
+
+# fields added by the driver, not accepted inside explain
+DRIVER_FIELDS = ('lsid', '$db', '$clusterTime', 'txnNumber', '$readPreference', 'readConcern')
+
+# placeholder of redacted values
+REDACTED = '?'
+
+
+def redact(value):
+    """Keep the shape of a command argument and drop its values
+
+    Field names and operators are kept, scalars are replaced.
+
+    :param value: filter, pipeline, update or any part of them
+    :return: redacted copy
+    """
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(x) for x in value]
+    return REDACTED
+
+
+def pid_path(path, pid=None):
+    """Path of the file of a process
+
+    Processes never rotate a file under each other.
+
+    :param path: configured path, like slow_queries.log
+    :param pid: pid, the current one by default
+    :return: path with the pid before the extension, like slow_queries.1234.log
+    """
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, pid or os.getpid(), ext)
+
+
+def summarize_plan(explained):
+    """Summarize the output of explain
+
+    :param explained: output of explain with executionStats verbosity
+    :return: dict, stages of the winning plan from the top, indexes used,
+            keys examined, documents examined, documents returned and time in milliseconds
+    """
+    planner = _find(explained, 'queryPlanner') or {}
+    stats = _find(explained, 'executionStats') or {}
+
+    stages = []
+    indexes = []
+    plan = planner.get('winningPlan')
+    while isinstance(plan, dict):
+        # since 5.0, plans of slot-based engine are in queryPlan
+        plan = plan.get('queryPlan', plan)
+        stages.append(plan.get('stage'))
+        if 'indexName' in plan:
+            indexes.append(plan['indexName'])
+        inputs = plan.get('inputStages')
+        plan = plan.get('inputStage') or (inputs[0] if inputs else None)
+
+    return {
+        'stages': stages,
+        'indexes': indexes,
+        'keys_examined': stats.get('totalKeysExamined'),
+        'docs_examined': stats.get('totalDocsExamined'),
+        'returned': stats.get('nReturned'),
+        'ms': stats.get('executionTimeMillis')
+    }
+
+
+def _find(target, key):
+    """Find the first value of key in nested documents
+
+    Aggregations keep the plan in the $cursor stage or in shards.
+
+    :param target: document or list
+    :param key: key
+    :return: value, or None
+    """
+    if isinstance(target, dict):
+        if key in target:
+            return target[key]
+        values = target.values()
+    elif isinstance(target, list):
+        values = target
+    else:
+        return None
+
+    for value in values:
+        found = _find(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Time every command, log and explain slow ones
+
+    Latency of every command is recorded to metrics by command name.
+    Only explainable commands are remembered between started and finished events.
+    """
+
+    def __init__(self, *, threshold_ms=100, sample_rate=0.1, path=None,
+                 max_bytes=10485760, backup_count=5):
+        """Initial listener
+
+        :param threshold_ms: commands slower than it are slow
+        :param sample_rate: ratio of slow commands explained, 0 to 1
+        :param path: path of the rotating files, None disables them,
+                every process writes its own one, named by pid_path
+        :param max_bytes: size of the file before rotated
+        :param backup_count: counts of rotated files kept
+        """
+        self._threshold = threshold_ms * 1000
+        self._sample_rate = sample_rate
+        self._client = None
+        self._lock = Lock()
+        self._started = {}
+        self._latency = {}
+        self._queue = Queue(maxsize=100)
+        self._stopped = Event()
+        self._pid = None
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._file = None
+        self._file_pid = None
+        self.slow = 0
+        self.explained = 0
+
+    def attach(self, client):
+        """Set the client explain runs on
+
+        :param client: MongoClient the listener was registered to
+        """
+        self._client = client
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE:
+            return
+        with self._lock:
+            self._started[(event.request_id, event.connection_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finished(event, None)
+
+    def failed(self, event):
+        self._finished(event, event.failure)
+
+    def stop(self):
+        """Stop explaining, queued commands are dropped"""
+        self._stopped.set()
+
+    def _finished(self, event, failure):
+        """Record latency and check whether it was slow
+
+        :param event: succeeded or failed event
+        :param failure: failure document, or None
+        """
+        name = event.command_name
+        if INSTRUMENTATION.metrics:
+            latency = self._latency.get(name)
+            if latency is None:
+                latency = REGISTRY.histogram('mongodb_command_seconds', command=name)
+                self._latency[name] = latency
+            latency.observe(event.duration_micros / 1e6)
+
+        if name not in EXPLAINABLE:
+            return
+        with self._lock:
+            started = self._started.pop((event.request_id, event.connection_id), None)
+        if started is None or event.duration_micros < self._threshold:
+            return
+
+        database, command = started
+        collection = command.get(name)
+        record = {
+            'command': name,
+            'database': database,
+            'collection': collection,
+            'ms': round(event.duration_micros / 1000, 3),
+            'failure': failure,
+            'args': {k: redact(command[k]) for k in EXPLAINABLE[name] if k in command}
+        }
+        with self._lock:
+            self.slow += 1
+        logger.warning('Slow {} on {}.{} in {} ms: {}'.format(
+            name, database, collection, record['ms'], json_util.dumps(record['args'])
+        ))
+
+        if failure is None and self._client is not None and random.random() < self._sample_rate:
+            self._ensure_started()
+            try:
+                self._queue.put_nowait((record, command))
+                return
+            except Full:
+                # explaining can not keep up, skip it
+                pass
+        self._write(record)
+
+    def _ensure_started(self):
+        """Start the explaining thread in this process, if not yet"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            Thread(target=self._run, name='slow-query-explain', daemon=True).start()
+
+    def _run(self):
+        """Explain queued commands until stopped"""
+        while not self._stopped.is_set():
+            try:
+                record, command = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            record['plan'] = self._explain(record['database'], command)
+            self._write(record)
+
+    def _explain(self, database, command):
+        """Explain a command
+
+        :param database: database name
+        :param command: the command
+        :return: summary of plan, or the error
+        """
+        command = {k: v for k, v in command.items() if k not in DRIVER_FIELDS}
+        try:
+            explained = self._client[database].command(
+                {'explain': command, 'verbosity': 'executionStats'}
+            )
+        except PyMongoError as e:
+            return {'error': str(e)}
+        with self._lock:
+            self.explained += 1
+        return summarize_plan(explained)
+
+    def _write(self, record):
+        """Write a record to the file of this process
+
+        :param record: dict
+        """
+        if self._path is None:
+            return
+        if self._file_pid != os.getpid():
+            with self._lock:
+                if self._file_pid != os.getpid():
+                    handler = RotatingFileHandler(
+                        pid_path(self._path), maxBytes=self._max_bytes,
+                        backupCount=self._backup_count, delay=True
+                    )
+                    handler.setFormatter(Formatter('%(message)s'))
+                    # not registered in logging, records go to the file only
+                    logger_of_file = Logger('slow_queries', INFO)
+                    logger_of_file.addHandler(handler)
+                    self._file = logger_of_file
+                    self._file_pid = os.getpid()
+        self._file.info(json_util.dumps(record))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Write-behind counter of articles' views"""
+
+import atexit
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = getLogger()
+
+
+class ViewsCounter(object):
+    """Buffer views of articles in memory
+
+    Views are counted per article and written to MongoDB
+    by one bulk write in a background thread,
+    every interval or once the counts of buffered views reach the threshold.
+    Buffered views are written again when the process exits.
+    Views being written are still counted as buffered until the write succeeds.
+    """
+
+    def __init__(self, collection, *, interval=5, threshold=1000):
+        """Initial counter
+
+        :param collection: articles collection
+        :param interval: seconds between two flushes
+        :param threshold: counts of buffered views to flush immediately
+        """
+        self._collection = collection
+        self._interval = interval
+        self._threshold = threshold
+        self._lock = Lock()
+        self._pending = {}
+        self._in_flight = {}
+        self._total = 0
+        # one flush at a time, so the views being written are one batch
+        self._flush_lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread"""
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name='views-counter', daemon=True)
+        self._thread.start()
+        # registered once until stopped, a stopped counter can be collected
+        atexit.unregister(self.stop)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and write the buffered views"""
+        atexit.unregister(self.stop)
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, article_id, n=1):
+        """Count views of article
+
+        :param article_id: article ID
+        :param n: counts of views
+        :return: buffered views of article, includes these ones
+        """
+        aid = ObjectId(article_id)
+        with self._lock:
+            pending = self._pending.get(aid, 0) + n
+            self._pending[aid] = pending
+            self._total += n
+            full = self._total >= self._threshold
+            pending += self._in_flight.get(aid, 0)
+
+        if full:
+            self._wake.set()
+
+        return pending
+
+    def pending(self, article_id):
+        """Get buffered views of article
+
+        :param article_id: article ID
+        :return: buffered views which were not written yet
+        """
+        aid = ObjectId(article_id)
+        with self._lock:
+            return self._pending.get(aid, 0) + self._in_flight.get(aid, 0)
+
+    def flush(self):
+        """Write all of buffered views by one bulk write
+
+        Views are put back to buffer if the write was failed.
+
+        :return: counts of updated articles
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        """Write the buffered views, the flush lock is held
+
+        :return: counts of updated articles
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._in_flight = pending
+            self._total = 0
+
+        if not pending:
+            return 0
+
+        requests = [
+            UpdateOne({'_id': aid}, {'$inc': {'views': n}})
+            for aid, n in pending.items()
+        ]
+
+        try:
+            self._collection.bulk_write(requests, ordered=False)
+        except PyMongoError as e:
+            logger.error('Failed to write views: {}'.format(e))
+            # try again next time
+            with self._lock:
+                for aid, n in pending.items():
+                    self._pending[aid] = self._pending.get(aid, 0) + n
+                    self._total += n
+                self._in_flight = {}
+            return 0
+
+        with self._lock:
+            self._in_flight = {}
+
+        return len(requests)
+
+    def _run(self):
+        """Flush every interval or when waked up"""
+        while not self._stopped.is_set():
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self.flush()
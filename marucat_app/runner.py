@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Prefork runner
+
+The app is loaded once in the master process,
+then workers are forked and serve on the socket bound by the master.
+Every worker recreates its connectors and caches after fork,
+and serves requests by threads.
+
+Signals of the master
+    - SIGHUP: reload config.ini, start new workers then stop the old ones gracefully
+    - SIGTERM, SIGINT: stop workers gracefully and exit
+
+Crashed workers are restarted.
+Workers write their metrics to a directory, /metrics of any worker merges them,
+a temporary directory is used if none was configured.
+
+Usage:
+    python -m marucat_app.runner [--host 127.0.0.1] [--port 5000] [--workers N] [--db mongodb]
+"""
+
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from logging import getLogger, getLevelName
+from threading import Thread
+
+from werkzeug.serving import make_server
+
+from marucat_app import create_app, reset_app
+from marucat_app.utils.utils import CONNECTOR_FACTORY, METRICS, get_initial_file
+
+logger = getLogger()
+
+# seconds a worker should live, or it is restarted after a pause
+MIN_WORKER_LIFETIME = 1
+
+# seconds to wait for workers to finish requests when stopping
+GRACEFUL_TIMEOUT = 30
+
+
+class Arbiter(object):
+    """Master process of prefork workers"""
+
+    def __init__(self, *, host='127.0.0.1', port=5000, workers=None, db='mongodb', test=False, level='ERROR'):
+        """Initial master
+
+        :param host: host to bind
+        :param port: port to bind, 0 picks a free one
+        :param workers: counts of workers, counts of CPU by default
+        :param db: db parameter of create_app
+        :param test: use the test schema of MongoDB
+        :param level: logging level
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.db = db
+        self.test = test
+        self.level = level
+        self._socket = None
+        self._app = None
+        # pid: started time
+        self._workers = {}
+        self._stopping = False
+        self._reloading = False
+        self._metrics_dir = None
+        self._own_metrics_dir = False
+
+    def run(self):
+        """Bind, fork workers and watch them until stopped
+
+        :return: exit status
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(2048)
+        self.port = self._socket.getsockname()[1]
+
+        # metrics of former runs are dropped
+        self._metrics_dir = get_initial_file()['metrics']['directory']
+        if not self._metrics_dir:
+            self._metrics_dir = tempfile.mkdtemp(prefix='marucat-metrics-')
+            self._own_metrics_dir = True
+        self._app = self._load()
+        self._app.config[METRICS].reset()
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        logger.info('Listening at {}:{}, master {}'.format(self.host, self.port, os.getpid()))
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self._stopping:
+            self._reap()
+            if self._reloading:
+                self._reloading = False
+                self._reload()
+            time.sleep(0.1)
+
+        self._stop_workers(list(self._workers))
+        self._socket.close()
+        if self._own_metrics_dir:
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+        logger.info('Master {} exited'.format(os.getpid()))
+        return 0
+
+    def _load(self):
+        """Load the app in master
+
+        Connectors are closed, so no thread or connection is inherited by workers.
+
+        :return: app
+        """
+        app = create_app(level=self.level, db=self.db, test_flag=self.test, metrics_dir=self._metrics_dir)
+        app.config[CONNECTOR_FACTORY].close()
+        return app
+
+    def _spawn(self):
+        """Fork a worker"""
+        pid = os.fork()
+        if pid != 0:
+            self._workers[pid] = time.monotonic()
+            logger.info('Booted worker {}'.format(pid))
+            return
+
+        # worker never returns
+        status = 1
+        try:
+            status = self._serve()
+        except Exception as e:
+            logger.exception('Worker {} failed: {}'.format(os.getpid(), e))
+        finally:
+            # skip handlers inherited from master, like atexit
+            os._exit(status)
+
+    def _serve(self):
+        """Serve requests in worker until SIGTERM
+
+        :return: exit status
+        """
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # master stops workers on Ctrl-C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        reset_app(self._app)
+        server = make_server(self.host, self.port, self._app, threaded=True, fd=self._socket.fileno())
+        # finish requests in flight when stopping
+        server.daemon_threads = False
+        server.block_on_close = True
+
+        def shutdown(signum, frame):
+            # shutdown() waits for serve_forever(), call it from another thread
+            Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self._app.config[CONNECTOR_FACTORY].close()
+            # counters of this worker are kept after it exited
+            self._app.config[METRICS].stop()
+
+        return 0
+
+    def _reap(self):
+        """Collect exited workers and restart the crashed ones"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            self._app.config[METRICS].retire(pid)
+            started = self._workers.pop(pid, None)
+            if started is None:
+                # a retired worker
+                continue
+
+            logger.warning('Worker {} exited unexpectedly, status {}'.format(pid, status))
+            if self._stopping:
+                continue
+
+            # do not restart in a tight loop
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self._spawn()
+
+    def _reload(self):
+        """Start workers with new config.ini and stop the old ones"""
+        logger.info('Reloading')
+        old = list(self._workers)
+
+        self._app = self._load()
+        for _ in range(self.workers):
+            self._spawn()
+
+        # retired workers are not restarted
+        for pid in old:
+            self._workers.pop(pid, None)
+        self._stop_workers(old)
+
+    def _stop_workers(self, pids):
+        """Stop workers gracefully, kill them after GRACEFUL_TIMEOUT
+
+        :param pids: pid of workers
+        """
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self._workers.pop(pid, None)
+                    self._app.config[METRICS].retire(pid)
+            time.sleep(0.05)
+
+        for pid in remaining:
+            logger.warning('Worker {} was killed'.format(pid))
+            self._kill(pid, signal.SIGKILL)
+            self._workers.pop(pid, None)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            self._app.config[METRICS].retire(pid)
+
+    @staticmethod
+    def _kill(pid, sig):
+        """Send a signal, ignore exited process"""
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_reload(self, signum, frame):
+        self._reloading = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Prefork runner of MaruCat.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=None, help='counts of CPU by default')
+    parser.add_argument('--db', default='mongodb')
+    parser.add_argument('--test', action='store_true', help='use the test schema of MongoDB')
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+
+    sys.exit(Arbiter(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        db=args.db,
+        test=args.test,
+        level=getLevelName(args.log_level.upper())
+    ).run())
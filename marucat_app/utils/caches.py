@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Caches bounded by bytes"""
+
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from marucat_app.utils.errors import CacheBackendNotExistError
+
+
+class LRUCache(object):
+    """Least recently used cache with a byte budget
+
+    The size of every value is told by the caller,
+    the least recently used values are evicted
+    when the sum of sizes exceeds the budget.
+    Values larger than the whole budget are not cached.
+    If TTL was provided, values expire after it.
+    """
+
+    # values are in this process
+    shared = False
+
+    def __init__(self, max_bytes, *, ttl=None):
+        """Initial cache
+
+        :param max_bytes: budget of the sum of sizes, 0 disables the cache
+        :param ttl: seconds a value lives, None means forever
+        """
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = Lock()
+        self._values = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get cached value
+
+        :param key: key
+        :return: value, or None if not cached
+        """
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None and item[2] is not None and item[2] <= monotonic():
+                # expired
+                del self._values[key]
+                self._bytes -= item[1]
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            # the most recently used one is moved to the end
+            self._values.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, size):
+        """Cache a value
+
+        :param key: key
+        :param value: value
+        :param size: size of the value in bytes
+        :return: True if cached or False if it is too large
+        """
+        if size > self._max_bytes:
+            return False
+
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            expires = monotonic() + self._ttl if self._ttl is not None else None
+            self._values[key] = (value, size, expires)
+            self._bytes += size
+
+            # evict the least recently used ones
+            while self._bytes > self._max_bytes:
+                _, item = self._values.popitem(last=False)
+                self._bytes -= item[1]
+                self.evictions += 1
+
+        return True
+
+    def delete(self, key):
+        """Drop a cached value
+
+        :param key: key
+        """
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def delete_matching(self, predicate):
+        """Drop cached values whose key matches
+
+        :param predicate: callable, called with key
+        """
+        with self._lock:
+            for key in [k for k in self._values if predicate(k)]:
+                self._bytes -= self._values.pop(key)[1]
+
+    def clear(self):
+        """Drop all of cached values"""
+        with self._lock:
+            self._values.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters of the cache
+
+        :return: dict, hits, misses, hit ratio, evictions, items, bytes and budget
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'items': len(self._values),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes
+            }
+
+
+def create_cache(name, max_bytes, *, conf, ttl=None):
+    """Create a cache by the backend in config.ini
+
+    - local: LRUCache of this process
+    - shared: SharedCache in a memory-mapped file, shared by processes of the host
+
+    :param name: name of the cache, shared caches of the same name share values
+    :param max_bytes: budget in bytes, 0 disables the cache
+    :param conf: cache section of ini file
+    :param ttl: seconds a value lives, None means forever
+    :raise: CacheBackendNotExistError
+    :return: cache
+    """
+    backend = conf['backend']
+    if backend == 'local':
+        return LRUCache(max_bytes, ttl=ttl)
+
+    if backend == 'shared':
+        # fcntl is not available on every platform, import it on demand
+        from marucat_app.utils.shared_cache import SharedCache
+
+        directory = conf['shared_dir']
+        if not directory:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        slot_size = int(conf['shared_slot_size'])
+        # layout is a part of the name, a cache resized by reload gets a new file
+        path = os.path.join(directory, 'marucat-{}-{}-{}.cache'.format(name, slot_size, max_bytes))
+        return SharedCache(path, max_bytes, slot_size=slot_size, ttl=ttl)
+
+    raise CacheBackendNotExistError('Specific cache backend do not exist: {}'.format(backend))
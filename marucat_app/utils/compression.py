@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compress responses by gzip or deflate
+
+Registered as an after_request handler of the app.
+Compressed bodies of GET responses are cached by their digest,
+so the same body is compressed only once.
+"""
+
+import zlib
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic, perf_counter
+
+from flask import request
+
+from marucat_app.utils.caches import LRUCache
+
+# supported encodings, preferred first, and wbits of zlib for them
+ENCODINGS = {
+    'gzip': 31,
+    'deflate': 15
+}
+
+# compressible MIME types
+MIMETYPES = ('application/json', 'text/plain', 'text/html')
+
+
+def compress(data, encoding, level):
+    """Compress bytes
+
+    :param data: bytes
+    :param encoding: gzip or deflate
+    :param level: compression level, 1 to 9
+    :return: compressed bytes
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return c.compress(data) + c.flush()
+
+
+def compress_chunks(chunks, encoding, level, spend=None):
+    """Compress chunks of a streamed body
+
+    Every chunk is flushed, so the client receives it without waiting.
+
+    :param chunks: iterable of bytes
+    :param encoding: gzip or deflate
+    :param level: compression level, 1 to 9
+    :param spend: called with seconds spent on every chunk if provided
+    :return: generator of compressed bytes
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    for chunk in chunks:
+        start = perf_counter()
+        data = c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH)
+        if spend is not None:
+            spend(perf_counter() - start)
+        if data:
+            yield data
+    yield c.flush()
+
+
+class Compression(object):
+    """Compress responses which the client accepts
+
+    - Bodies under min_size are sent as they are
+    - Vary: Accept-Encoding is set on every compressible response
+    - Time spent on compressing is limited by cpu_budget,
+      seconds of compressing per second,
+      responses are sent uncompressed once it was used up
+    - Compressed bodies of GET responses are cached
+    """
+
+    def __init__(self, *, level=6, min_size=1024, cpu_budget=0, cache=None):
+        """Initial compression
+
+        :param level: compression level, 1 to 9
+        :param min_size: bodies smaller than it are not compressed
+        :param cpu_budget: seconds of compressing per second, 0 means unlimited
+        :param cache: cache of compressed bodies created by create_cache, None disables it
+        """
+        self.level = level
+        self.min_size = min_size
+        self.cpu_budget = cpu_budget
+        self.cache = cache if cache is not None else LRUCache(0)
+        self._lock = Lock()
+        self._window = monotonic()
+        self._spent = 0.0
+        self.skipped = 0
+
+    def after_request(self, response):
+        """Compress the response if possible
+
+        :param response: response
+        :return: response
+        """
+        if response.mimetype not in MIMETYPES:
+            return response
+
+        # the body depends on the Accept-Encoding header
+        response.vary.add('Accept-Encoding')
+
+        if 'Content-Encoding' in response.headers or not 200 <= response.status_code < 300:
+            return response
+
+        encoding = request.accept_encodings.best_match(list(ENCODINGS))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # the size is unknown, compress chunks while sending
+            if not self._has_budget():
+                return response
+            response.response = compress_chunks(response.response, encoding, self.level, self._spend)
+            response.headers.pop('Content-Length', None)
+            self._set_encoding(response, encoding)
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        # compressed body of the same body can be reused
+        key = None
+        compressed = None
+        if request.method == 'GET':
+            key = (encoding, self.level, blake2b(data, digest_size=16).digest())
+            compressed = self.cache.get(key)
+
+        if compressed is None:
+            if not self._has_budget():
+                return response
+
+            start = perf_counter()
+            compressed = compress(data, encoding, self.level)
+            self._spend(perf_counter() - start)
+
+            if key is not None:
+                self.cache.set(key, compressed, len(compressed))
+
+        response.set_data(compressed)
+        self._set_encoding(response, encoding)
+        return response
+
+    def stats(self):
+        """Counters of compression
+
+        :return: dict, skipped responses for budget and stats of the cache
+        """
+        return {
+            'skipped': self.skipped,
+            'cache': self.cache.stats()
+        }
+
+    @staticmethod
+    def _set_encoding(response, encoding):
+        """Mark the response as compressed
+
+        A strong ETag belongs to a body, the compressed one gets its own.
+
+        :param response: response
+        :param encoding: gzip or deflate
+        """
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag('{}-{}'.format(etag, encoding))
+
+    def _has_budget(self):
+        """Check whether there is budget left in current second
+
+        :return: True or False
+        """
+        if not self.cpu_budget:
+            return True
+
+        now = monotonic()
+        with self._lock:
+            # start a new window
+            if now - self._window >= 1:
+                self._window = now
+                self._spent = 0.0
+
+            if self._spent < self.cpu_budget:
+                return True
+
+            self.skipped += 1
+            return False
+
+    def _spend(self, seconds):
+        """Record the time spent on compressing
+
+        :param seconds: seconds
+        """
+        with self._lock:
+            self._spent += seconds
@@ -18,3 +18,15 @@ class DatabaseNotExistError(RuntimeError):
 
 class NotANumberError(RuntimeError):
     pass
+
+
+class InvalidCursorError(RuntimeError):
+    pass
+
+
+class CacheBackendNotExistError(RuntimeError):
+    pass
+
+
+class UnsafeCacheFileError(RuntimeError):
+    pass
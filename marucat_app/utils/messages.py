@@ -97,6 +97,17 @@ def invalid_post_data(keys):
     )
 
 
+def invalid_cursor():
+    """Create a error message describe the cursor is invalid.
+
+    Message
+        Invalid query parameters. cursor is invalid or expired.
+
+    :return: error message dict
+    """
+    return create_error_message('Invalid query parameters. cursor is invalid or expired.')
+
+
 def articles_list_not_found(tags, offset):
     """Create a error message describe the articles list is None.
 
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Metrics of the process
+
+Counters and histograms are registered once with their labels,
+callers keep them and update them without any lookup.
+Updates are spread over striped locks by thread,
+so concurrent requests rarely wait for each other.
+
+In a prefork deployment, every worker writes its metrics to a directory
+and the worker serving /metrics merges them.
+"""
+
+import json
+import os
+from bisect import bisect_left
+from itertools import count
+from threading import Lock, Thread, Event, local
+from time import time_ns
+
+# upper bounds of latency buckets in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# counts of lock stripes of a metric
+STRIPES = 8
+
+# file of samples of exited workers, in the directory of MetricsExporter
+RETIRED = 'retired.json'
+
+# stripe of the current thread, assigned in turn
+_thread = local()
+_next_stripe = count()
+
+
+def _stripe():
+    """Stripe index of the current thread
+
+    :return: int
+    """
+    try:
+        return _thread.stripe
+    except AttributeError:
+        _thread.stripe = next(_next_stripe) % STRIPES
+        return _thread.stripe
+
+
+class _Stripe(object):
+    """A lock and the values it guards"""
+
+    __slots__ = ('lock', 'values', 'sum')
+
+    def __init__(self, size):
+        self.lock = Lock()
+        self.values = [0] * size
+        self.sum = 0.0
+
+
+class Counter(object):
+    """A counter which only goes up"""
+
+    kind = 'counter'
+
+    def __init__(self):
+        self._stripes = [_Stripe(1) for _ in range(STRIPES)]
+
+    def inc(self, n=1):
+        """Add to the counter
+
+        :param n: amount
+        """
+        stripe = self._stripes[_stripe()]
+        with stripe.lock:
+            stripe.values[0] += n
+
+    def snapshot(self):
+        """Current value
+
+        :return: int
+        """
+        total = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                total += stripe.values[0]
+        return total
+
+
+class Gauge(Counter):
+    """A value which goes up and down, like requests in flight"""
+
+    kind = 'gauge'
+
+    def dec(self, n=1):
+        """Subtract from the gauge
+
+        :param n: amount
+        """
+        self.inc(-n)
+
+
+class Histogram(object):
+    """Counts of observations in buckets, with their sum"""
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Initial histogram
+
+        :param buckets: sorted upper bounds of buckets
+        """
+        self._buckets = tuple(buckets)
+        # the last one is +Inf
+        self._stripes = [_Stripe(len(self._buckets) + 1) for _ in range(STRIPES)]
+
+    def observe(self, value):
+        """Record an observation
+
+        :param value: value, seconds for latency
+        """
+        i = bisect_left(self._buckets, value)
+        stripe = self._stripes[_stripe()]
+        with stripe.lock:
+            stripe.values[i] += 1
+            stripe.sum += value
+
+    def snapshot(self):
+        """Current state
+
+        :return: dict, upper bounds, count of each bucket (not cumulative), count and sum
+        """
+        counts = [0] * (len(self._buckets) + 1)
+        total = 0.0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for i, n in enumerate(stripe.values):
+                    counts[i] += n
+                total += stripe.sum
+        return {
+            'buckets': list(self._buckets),
+            'counts': counts,
+            'count': sum(counts),
+            'sum': total
+        }
+
+
+class Registry(object):
+    """Metrics by name and labels"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+
+    def counter(self, name, **labels):
+        """Get or register a counter
+
+        :param name: metric name
+        :param labels: labels
+        :return: Counter
+        """
+        return self._get(name, labels, Counter)
+
+    def gauge(self, name, **labels):
+        """Get or register a gauge
+
+        :param name: metric name
+        :param labels: labels
+        :return: Gauge
+        """
+        return self._get(name, labels, Gauge)
+
+    def histogram(self, name, **labels):
+        """Get or register a histogram
+
+        :param name: metric name
+        :param labels: labels
+        :return: Histogram
+        """
+        return self._get(name, labels, Histogram)
+
+    def snapshot(self):
+        """Current state of all metrics
+
+        :return: dict, name: list of (labels, state)
+        """
+        result = {}
+        for name, _, labels, state in self.collect():
+            result.setdefault(name, []).append((labels, state))
+        return result
+
+    def collect(self):
+        """Current state of all metrics as samples
+
+        :return: list of (name, kind, labels, state), sorted by name and labels
+        """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda x: x[0])
+        return [(name, metric.kind, dict(labels), metric.snapshot()) for (name, labels), metric in items]
+
+    def _get(self, name, labels, cls):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = cls()
+                self._metrics[key] = metric
+            elif type(metric) is not cls:
+                raise TypeError('{} was registered as {}'.format(name, type(metric).__name__))
+            return metric
+
+
+# metrics of this process
+REGISTRY = Registry()
+
+
+class RouteMetrics(object):
+    """Latency and statuses of a route
+
+    Counters of statuses are registered on first use of each status,
+    no label is built on later requests.
+    """
+
+    def __init__(self, **labels):
+        """Initial metrics of route
+
+        :param labels: labels of route
+        """
+        self._labels = labels
+        self._latency = REGISTRY.histogram('http_request_duration_seconds', **labels)
+        self._statuses = {}
+
+    def observe(self, elapsed, status):
+        """Record a request
+
+        :param elapsed: seconds until the response was created
+        :param status: status code
+        """
+        self._latency.observe(elapsed)
+        counter = self._statuses.get(status)
+        if counter is None:
+            # the registry returns the same counter if two threads get here
+            counter = REGISTRY.counter('http_requests_total', status=str(status), **self._labels)
+            self._statuses[status] = counter
+        counter.inc()
+
+
+class Instrumentation(object):
+    """Switches of instrumentation
+
+    Instrumented calls read enabled first, and do nothing else if it is False.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = False
+        self.logs = False
+
+    def configure(self, *, metrics, logs):
+        """Turn instrumentation on or off
+
+        :param metrics: record latency and errors to REGISTRY
+        :param logs: log every call at INFO
+        """
+        self.metrics = metrics
+        self.logs = logs
+        self.enabled = metrics or logs
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def merge(samples_of_processes):
+    """Merge samples of processes
+
+    Samples of the same name and labels are added up,
+    histograms by buckets.
+
+    :param samples_of_processes: list of lists of samples, (name, kind, labels, state)
+    :return: list of samples, sorted by name and labels
+    """
+    merged = {}
+    for samples in samples_of_processes:
+        for name, kind, labels, state in samples:
+            key = (name, tuple(sorted(labels.items())))
+            existing = merged.get(key)
+            if existing is None:
+                if kind == 'histogram':
+                    state = dict(state, counts=list(state['counts']))
+                merged[key] = (name, kind, labels, state)
+            elif kind == 'histogram':
+                for i, n in enumerate(state['counts']):
+                    existing[3]['counts'][i] += n
+                existing[3]['count'] += state['count']
+                existing[3]['sum'] += state['sum']
+            else:
+                merged[key] = (name, kind, labels, existing[3] + state)
+    return [merged[key] for key in sorted(merged)]
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    ))
+
+
+def render(samples, *, prefix='marucat_'):
+    """Render samples in the text format of Prometheus
+
+    :param samples: list of (name, kind, labels, state), sorted by name
+    :param prefix: prefix of metric names
+    :return: str
+    """
+    lines = []
+    last = None
+    for name, kind, labels, state in samples:
+        name = prefix + name
+        if name != last:
+            lines.append('# TYPE {} {}'.format(name, kind))
+            last = name
+
+        if kind != 'histogram':
+            lines.append('{}{} {}'.format(name, _format_labels(labels), state))
+            continue
+
+        cumulative = 0
+        for bound, n in zip(state['buckets'] + ['+Inf'], state['counts']):
+            cumulative += n
+            lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, ('le', bound)), cumulative))
+        lines.append('{}_sum{} {}'.format(name, _format_labels(labels), state['sum']))
+        lines.append('{}_count{} {}'.format(name, _format_labels(labels), state['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """Write metrics of this process to a directory shared by workers
+
+    A daemon thread writes samples to <directory>/<pid>-<start>.json every interval,
+    it is started in the process which serves requests, so after fork.
+    The start time tells a worker from an exited one which had the same pid.
+
+    When a worker exited, the master folds its file into retired.json and removes it,
+    so counters do not go back and the directory does not grow,
+    gauges of exited workers are dropped.
+    """
+
+    def __init__(self, directory, *, interval=1, collectors=()):
+        """Initial exporter
+
+        :param directory: directory of files, None exports nothing
+        :param interval: seconds between two writes
+        :param collectors: callables returning samples besides REGISTRY, like counters of caches
+        """
+        self.directory = directory
+        self._interval = interval
+        self._collectors = list(collectors)
+        self._lock = Lock()
+        self._pid = None
+        self._filename = None
+        self._stopped = Event()
+
+    def add_collector(self, collector):
+        """Add a collector
+
+        :param collector: callable returning list of samples
+        """
+        self._collectors.append(collector)
+
+    def collect(self):
+        """Samples of this process
+
+        :return: list of (name, kind, labels, state)
+        """
+        samples = REGISTRY.collect()
+        for collector in self._collectors:
+            samples.extend(collector())
+        return samples
+
+    def ensure_started(self):
+        """Start writing in this process, if not yet"""
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._filename = '{}-{}.json'.format(self._pid, time_ns())
+            os.makedirs(self.directory, exist_ok=True)
+            Thread(target=self._run, name='metrics-exporter', daemon=True).start()
+
+    def stop(self):
+        """Stop writing, the last samples are written"""
+        self._stopped.set()
+        if self._pid == os.getpid():
+            self._write()
+
+    def collect_all(self):
+        """Samples of all workers
+
+        Samples of this process are taken directly, of the others from their files.
+
+        :return: list of samples, merged
+        """
+        processes = [self.collect()]
+        if self.directory is None:
+            return merge(processes)
+
+        filenames = os.listdir(self.directory)
+        retired, folded = self._read_retired()
+        workers = {}
+        for filename in filenames:
+            if not filename.endswith('.json') or filename in (RETIRED, self._filename) or filename in folded:
+                continue
+            pid = int(filename[:-len('.json')].split('-')[0])
+            if pid == os.getpid():
+                continue
+            samples = self._read(filename)
+            if samples is None:
+                # folded just now, it is in the retired file
+                retired, folded = self._read_retired()
+                continue
+            alive = _is_alive(pid)
+            workers[filename] = [
+                (name, kind, labels, state) for name, kind, labels, state in samples
+                if alive or kind != 'gauge'
+            ]
+
+        processes.append(retired)
+        # files folded while reading are counted by the retired file only
+        processes.extend(samples for filename, samples in workers.items() if filename not in folded)
+        return merge(processes)
+
+    def retire(self, pid):
+        """Fold files of an exited worker into the retired file
+
+        Only the master calls it, after the worker was reaped,
+        and before the pid could be used by a new worker.
+        The retired file is replaced before the files are removed,
+        and it names the folded files, so readers never count them twice.
+
+        :param pid: pid of the exited worker
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        prefix = '{}-'.format(pid)
+        filenames = [
+            x for x in os.listdir(self.directory)
+            if x.endswith('.json') and (x.startswith(prefix) or x == '{}.json'.format(pid))
+        ]
+        if not filenames:
+            return
+
+        retired, folded = self._read_retired()
+        for filename in filenames:
+            samples = self._read(filename)
+            if samples is not None:
+                retired = merge([retired, [x for x in samples if x[1] != 'gauge']])
+
+        # names of removed files are not needed any more
+        existing = set(os.listdir(self.directory))
+        folded = [x for x in folded if x in existing] + filenames
+        self._replace(RETIRED, {'samples': retired, 'folded': folded})
+
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def reset(self):
+        """Remove files of all workers"""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _read(self, filename):
+        """Read a file of the directory
+
+        :param filename: name of file
+        :return: content, or None if it was removed
+        """
+        try:
+            with open(os.path.join(self.directory, filename), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # removed, files are replaced atomically
+            return None
+
+    def _read_retired(self):
+        """Read the retired file
+
+        :return: samples of exited workers, names of folded files
+        """
+        content = self._read(RETIRED) or {'samples': [], 'folded': []}
+        return [tuple(x) for x in content['samples']], content['folded']
+
+    def _replace(self, filename, content):
+        """Write a file of the directory, replaced atomically
+
+        :param filename: name of file
+        :param content: JSON serializable
+        """
+        path = os.path.join(self.directory, filename)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp, path)
+
+    def _write(self):
+        """Write samples of this process"""
+        self._replace(self._filename, self.collect())
+
+    def _run(self):
+        """Write until stopped"""
+        while not self._stopped.wait(self._interval):
+            self._write()
+
+
+def _is_alive(pid):
+    """Tell whether the process exists
+
+    :param pid: pid
+    :return: bool
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
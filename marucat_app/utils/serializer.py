@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""JSON serializer
+
+Pick the fastest available encoder when imported,
+orjson first, then ujson, stdlib json at last.
+All of backends dump data to bytes,
+convert ObjectId to str and datetime to ISO 8601 str,
+so documents of MongoDB can be dumped as they are fetched.
+"""
+
+import json
+from datetime import date, datetime
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+    # default hook is required to convert ObjectId
+    ujson.dumps(ObjectId(), default=str)
+except (ImportError, TypeError):
+    ujson = None
+
+
+def _default(obj):
+    """Convert types which JSON does not support
+
+    :param obj: target
+    :return: converted result
+    :raise: TypeError if the type is not supported
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+class _Encoder(json.JSONEncoder):
+    """Stdlib encoder with the default hook"""
+
+    def default(self, o):
+        return _default(o)
+
+
+def _dumps_orjson(data, pretty=False):
+    """Dump by orjson"""
+    if pretty:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(data, default=_default, option=option) + b'\n'
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _dumps_ujson(data, pretty=False):
+    """Dump by ujson"""
+    if pretty:
+        return (ujson.dumps(data, default=_default, indent=2, sort_keys=True) + '\n').encode('utf-8')
+    return ujson.dumps(data, default=_default).encode('utf-8')
+
+
+_ENCODER = _Encoder()
+_PRETTY_ENCODER = _Encoder(sort_keys=True, indent=2)
+
+
+def _dumps_json(data, pretty=False):
+    """Dump by stdlib json"""
+    if pretty:
+        return (_PRETTY_ENCODER.encode(data) + '\n').encode('utf-8')
+    return _ENCODER.encode(data).encode('utf-8')
+
+
+# available backends, the fastest first
+BACKENDS = {}
+if orjson is not None:
+    BACKENDS['orjson'] = _dumps_orjson
+if ujson is not None:
+    BACKENDS['ujson'] = _dumps_ujson
+BACKENDS['json'] = _dumps_json
+
+# name of the picked backend
+BACKEND = next(iter(BACKENDS))
+
+
+def dumps(data, pretty=False):
+    """Dump data to JSON bytes by the picked backend
+
+    :param data: target
+    :param pretty: indent 2 and sort keys, end with a newline
+    :return: bytes
+    """
+    return BACKENDS[BACKEND](data, pretty)
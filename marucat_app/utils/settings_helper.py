@@ -9,6 +9,9 @@ from marucat_app.utils.utils import get_db_helper
 def get_settings(name, app):
     """Get specified settings' value
 
+    Values are served by the settings cache,
+    the database is only reached when the cache missed.
+
     :param name: name
     :param app: current instance of app
     :return: the value of settings
@@ -16,10 +19,6 @@ def get_settings(name, app):
     if not isinstance(name, str):
         return
 
-    helper = get_db_helper(app, 'settings_helper')
-    result = helper.get_one(name)
-
-    if not result:
-        return
+    cache = get_db_helper(app, 'settings_cache')
+    return cache.get_value(name)
 
-    return result['value']
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cache shared by processes of a host in a memory-mapped file
+
+Layout of the file
+    - header: magic, slot size, counts of slots, ways, stripes and generation
+    - counters of every stripe: hits, misses, evictions
+    - clock hand of every set
+    - slots of fixed size, grouped into sets of WAYS slots
+
+A key is hashed to a set, values are evicted by the clock algorithm in the set.
+Sets are guarded by striped locks,
+a fcntl record lock between processes and a thread lock in process.
+Clearing the cache bumps the generation, slots of older generations are free.
+
+Values are unpickled, so a file is only used if it is a regular file
+owned by the effective user and only readable and writable by it,
+symbolic links are not followed.
+"""
+
+import fcntl
+import mmap
+import os
+import pickle
+import stat
+import struct
+from hashlib import blake2b
+from threading import Lock
+from time import time
+
+from marucat_app.utils.errors import UnsafeCacheFileError
+
+MAGIC = b'MRCCACH1'
+
+# magic, slot size, slots, ways, stripes, generation
+HEADER = struct.Struct('<8sIIIIq')
+HEADER_SIZE = 64
+
+# hits, misses, evictions
+COUNTERS = struct.Struct('<qqq')
+
+# used, referenced, key size, value size, generation, expires, digest of key
+SLOT_HEADER = struct.Struct('<BBxxIIqd16s')
+
+# slots in a set
+WAYS = 8
+
+# most counts of stripes
+STRIPES = 64
+
+# byte offset of the record lock of whole file, stripes follow it
+GLOBAL_LOCK = 0
+
+# mappings opened by this process, by path
+# closing any descriptor of a file releases every record lock of it in the process,
+# so a file is opened once per process and never closed
+_mappings = {}
+_mappings_lock = Lock()
+
+
+class _Mapping(object):
+    """A cache file mapped in this process"""
+
+    def __init__(self, path, slot_size, slots):
+        self.slot_size = slot_size
+        self.slots = slots
+        self.sets = slots // WAYS
+        self.stripes = min(STRIPES, self.sets)
+        self.counters_offset = HEADER_SIZE
+        self.hands_offset = self.counters_offset + COUNTERS.size * self.stripes
+        self.slots_offset = _align(self.hands_offset + self.sets, 64)
+        size = self.slots_offset + slot_size * slots
+
+        self.locks = [Lock() for _ in range(self.stripes)]
+        self.global_lock = Lock()
+        self.fd = _open_file(path)
+
+        # initialize the file once, the first process does it
+        header = HEADER.pack(MAGIC, slot_size, slots, WAYS, self.stripes, 0)
+        with self.global_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, GLOBAL_LOCK)
+            try:
+                existing = os.pread(self.fd, HEADER.size, 0)
+                if os.fstat(self.fd).st_size != size or existing[:-8] != header[:-8]:
+                    # zero filled
+                    os.ftruncate(self.fd, 0)
+                    os.ftruncate(self.fd, size)
+                    os.pwrite(self.fd, header, 0)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, GLOBAL_LOCK)
+
+        self.memory = mmap.mmap(self.fd, size)
+
+
+def _open_file(path):
+    """Open a cache file, create it if it does not exist
+
+    Other users could plant a file with pickled payloads or a symbolic link,
+    the file is refused unless only the effective user can access it.
+
+    :param path: path of the cache file
+    :raise: UnsafeCacheFileError
+    :return: file descriptor
+    """
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError as e:
+        # ELOOP if it is a symbolic link
+        raise UnsafeCacheFileError('Cache file can not be opened: {}: {}'.format(path, e))
+
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.geteuid() or stat.S_IMODE(st.st_mode) != 0o600:
+        os.close(fd)
+        raise UnsafeCacheFileError(
+            'Cache file must be a regular file of uid {} with mode 0600: {}'.format(os.geteuid(), path)
+        )
+    return fd
+
+
+def _align(n, alignment):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def _open(path, slot_size, slots):
+    """Open a cache file, once per process
+
+    :return: _Mapping
+    """
+    key = (os.getpid(), path)
+    with _mappings_lock:
+        mapping = _mappings.get(key)
+        if mapping is None:
+            mapping = _Mapping(path, slot_size, slots)
+            _mappings[key] = mapping
+        return mapping
+
+
+class SharedCache(object):
+    """Cache of fixed-size slots shared by processes
+
+    It has the interface of LRUCache.
+    Keys and values are pickled, values must be picklable,
+    and cached values are copies.
+    A value whose pickled key and value do not fit in a slot is not cached.
+    """
+
+    # values and counters are shared by processes
+    shared = True
+
+    def __init__(self, path, max_bytes, *, slot_size=65536, ttl=None):
+        """Initial cache
+
+        Caches with the same path and layout share values.
+
+        :param path: path of the cache file, /dev/shm keeps it in memory
+        :param max_bytes: budget of slots in bytes, less than WAYS slots disables the cache
+        :param slot_size: size of a slot in bytes
+        :param ttl: seconds a value lives, None means forever
+        """
+        self._ttl = ttl
+        self._slot_size = slot_size
+        self._payload = slot_size - SLOT_HEADER.size
+        self._map = None
+        slots = max_bytes // slot_size // WAYS * WAYS
+        if slots:
+            self._map = _open(path, slot_size, slots)
+
+    def get(self, key):
+        """Get cached value
+
+        :param key: key
+        :return: value, or None if not cached
+        """
+        if self._map is None:
+            return None
+
+        key_bytes, digest, set_index, stripe = self._locate(key)
+        memory = self._map.memory
+        with self._locked(stripe):
+            slot = self._find(set_index, key_bytes, digest)
+            if slot is None:
+                self._count(stripe, misses=1)
+                return None
+
+            _, _, key_size, value_size, generation, expires, _ = SLOT_HEADER.unpack_from(memory, slot)
+            start = slot + SLOT_HEADER.size + key_size
+            value = memory[start:start + value_size]
+            # referenced recently, the clock skips it once
+            memory[slot + 1] = 1
+            self._count(stripe, hits=1)
+
+        return pickle.loads(value)
+
+    def set(self, key, value, size):
+        """Cache a value
+
+        :param key: key
+        :param value: value
+        :param size: ignored, size of the pickled value is used
+        :return: True if cached or False if it does not fit in a slot
+        """
+        if self._map is None:
+            return False
+
+        key_bytes, digest, set_index, stripe = self._locate(key)
+        value_bytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(key_bytes) + len(value_bytes) > self._payload:
+            return False
+
+        expires = time() + self._ttl if self._ttl is not None else 0.0
+        memory = self._map.memory
+        with self._locked(stripe):
+            slot = self._find(set_index, key_bytes, digest, expired=True)
+            if slot is None:
+                slot = self._victim(set_index, stripe)
+
+            start = slot + SLOT_HEADER.size
+            memory[start:start + len(key_bytes)] = key_bytes
+            start += len(key_bytes)
+            memory[start:start + len(value_bytes)] = value_bytes
+            SLOT_HEADER.pack_into(
+                memory, slot, 1, 1, len(key_bytes), len(value_bytes),
+                self._generation(), expires, digest
+            )
+
+        return True
+
+    def delete(self, key):
+        """Drop a cached value
+
+        :param key: key
+        """
+        if self._map is None:
+            return
+
+        key_bytes, digest, set_index, stripe = self._locate(key)
+        with self._locked(stripe):
+            slot = self._find(set_index, key_bytes, digest, expired=True)
+            if slot is not None:
+                self._map.memory[slot] = 0
+
+    def delete_matching(self, predicate):
+        """Drop cached values whose key matches
+
+        Every slot is scanned, keep it for rare invalidations.
+
+        :param predicate: callable, called with key
+        """
+        if self._map is None:
+            return
+
+        memory = self._map.memory
+        for stripe in range(self._map.stripes):
+            with self._locked(stripe):
+                generation = self._generation()
+                for set_index in range(stripe, self._map.sets, self._map.stripes):
+                    for slot in self._slots_of(set_index):
+                        used, _, key_size, _, slot_generation, _, _ = SLOT_HEADER.unpack_from(memory, slot)
+                        if not used or slot_generation != generation:
+                            continue
+                        start = slot + SLOT_HEADER.size
+                        if predicate(pickle.loads(memory[start:start + key_size])):
+                            memory[slot] = 0
+
+    def clear(self):
+        """Drop all of cached values in every process"""
+        if self._map is None:
+            return
+
+        with self._map.global_lock:
+            fcntl.lockf(self._map.fd, fcntl.LOCK_EX, 1, GLOBAL_LOCK)
+            try:
+                struct.pack_into('<q', self._map.memory, HEADER.size - 8, self._generation() + 1)
+            finally:
+                fcntl.lockf(self._map.fd, fcntl.LOCK_UN, 1, GLOBAL_LOCK)
+
+    def stats(self):
+        """Counters of the cache, of all processes
+
+        Items and bytes are counted without locks, they are approximate.
+
+        :return: dict, hits, misses, hit ratio, evictions, items, bytes and budget
+        """
+        if self._map is None:
+            return {
+                'hits': 0, 'misses': 0, 'hit_ratio': 0.0, 'evictions': 0,
+                'items': 0, 'bytes': 0, 'max_bytes': 0, 'slot_size': self._slot_size
+            }
+
+        memory = self._map.memory
+        hits = misses = evictions = 0
+        for stripe in range(self._map.stripes):
+            h, m, e = COUNTERS.unpack_from(memory, self._map.counters_offset + COUNTERS.size * stripe)
+            hits += h
+            misses += m
+            evictions += e
+
+        items = 0
+        size = 0
+        generation = self._generation()
+        now = time()
+        for set_index in range(self._map.sets):
+            for slot in self._slots_of(set_index):
+                used, _, key_size, value_size, slot_generation, expires, _ = SLOT_HEADER.unpack_from(memory, slot)
+                if used and slot_generation == generation and (not expires or expires > now):
+                    items += 1
+                    size += key_size + value_size
+
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'evictions': evictions,
+            'items': items,
+            'bytes': size,
+            'max_bytes': self._map.slots * self._slot_size,
+            'slot_size': self._slot_size
+        }
+
+    def _locate(self, key):
+        """Hash the key
+
+        :param key: key
+        :return: pickled key, digest, set index and stripe
+        """
+        key_bytes = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        digest = blake2b(key_bytes, digest_size=16).digest()
+        set_index = int.from_bytes(digest[:8], 'little') % self._map.sets
+        return key_bytes, digest, set_index, set_index % self._map.stripes
+
+    def _locked(self, stripe):
+        return _StripeLock(self._map, stripe)
+
+    def _generation(self):
+        return struct.unpack_from('<q', self._map.memory, HEADER.size - 8)[0]
+
+    def _slots_of(self, set_index):
+        """Offsets of slots in a set"""
+        first = self._map.slots_offset + set_index * WAYS * self._slot_size
+        return range(first, first + WAYS * self._slot_size, self._slot_size)
+
+    def _find(self, set_index, key_bytes, digest, *, expired=False):
+        """Find the slot of key, lock of the stripe is held
+
+        Expired slots are freed when found.
+
+        :param set_index: set of key
+        :param key_bytes: pickled key
+        :param digest: digest of key
+        :param expired: return the slot of key even if it was expired
+        :return: offset of slot, or None
+        """
+        memory = self._map.memory
+        generation = self._generation()
+        for slot in self._slots_of(set_index):
+            used, _, key_size, _, slot_generation, expires, slot_digest = SLOT_HEADER.unpack_from(memory, slot)
+            if not used or slot_digest != digest or slot_generation != generation:
+                continue
+            start = slot + SLOT_HEADER.size
+            if memory[start:start + key_size] != key_bytes:
+                continue
+            if expires and expires <= time():
+                memory[slot] = 0
+                if not expired:
+                    return None
+            return slot
+        return None
+
+    def _victim(self, set_index, stripe):
+        """Pick a slot for a new value, lock of the stripe is held
+
+        Free slots are used first,
+        or the clock hand sweeps the set and evicts the first slot not referenced.
+
+        :param set_index: set of key
+        :param stripe: stripe of set
+        :return: offset of slot
+        """
+        memory = self._map.memory
+        generation = self._generation()
+        now = time()
+        slots = self._slots_of(set_index)
+        for slot in slots:
+            used, _, _, _, slot_generation, expires, _ = SLOT_HEADER.unpack_from(memory, slot)
+            if not used or slot_generation != generation or (expires and expires <= now):
+                return slot
+
+        hand_offset = self._map.hands_offset + set_index
+        hand = memory[hand_offset]
+        while memory[slots[hand] + 1]:
+            # give a referenced slot a second chance
+            memory[slots[hand] + 1] = 0
+            hand = (hand + 1) % WAYS
+        memory[hand_offset] = (hand + 1) % WAYS
+        self._count(stripe, evictions=1)
+        return slots[hand]
+
+    def _count(self, stripe, *, hits=0, misses=0, evictions=0):
+        """Add counters of the stripe, lock of the stripe is held"""
+        offset = self._map.counters_offset + COUNTERS.size * stripe
+        h, m, e = COUNTERS.unpack_from(self._map.memory, offset)
+        COUNTERS.pack_into(self._map.memory, offset, h + hits, m + misses, e + evictions)
+
+
+class _StripeLock(object):
+    """Lock a stripe in this process and between processes"""
+
+    def __init__(self, mapping, stripe):
+        self._mapping = mapping
+        self._stripe = stripe
+
+    def __enter__(self):
+        self._mapping.locks[self._stripe].acquire()
+        try:
+            fcntl.lockf(self._mapping.fd, fcntl.LOCK_EX, 1, GLOBAL_LOCK + 1 + self._stripe)
+        except OSError:
+            self._mapping.locks[self._stripe].release()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            fcntl.lockf(self._mapping.fd, fcntl.LOCK_UN, 1, GLOBAL_LOCK + 1 + self._stripe)
+        finally:
+            self._mapping.locks[self._stripe].release()
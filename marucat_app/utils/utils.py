@@ -5,19 +5,35 @@
 
 import re
 import time
+from calendar import timegm
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as BinasciiError
 from os import path
 from configparser import ConfigParser
-from json import dumps
+from hashlib import blake2b
+from json import dumps, loads
 
 from bson import ObjectId
-from flask import make_response
+from flask import make_response, request, Response, stream_with_context
+from werkzeug.http import http_date
 
-from marucat_app.utils.errors import NotANumberError
+from marucat_app.utils import serializer
+from marucat_app.utils.errors import NotANumberError, InvalidCursorError
 
 # App name
 APP_NAME = 'marucat_app'
 # Connector factory key
 CONNECTOR_FACTORY = 'connector_factory'
+# Page size from which responses are streamed
+STREAM_THRESHOLD = 'stream_threshold'
+# Counts of items in a chunk of streamed responses
+STREAM_CHUNK_SIZE = 'stream_chunk_size'
+# Response compression key
+COMPRESSION = 'compression'
+# Articles list cache key
+LIST_CACHE = 'list_cache'
+# Metrics exporter key
+METRICS = 'metrics'
 
 
 def get_db_helper(app, name):
@@ -150,6 +166,15 @@ def is_contained(target, keys):
     return True
 
 
+def is_true(target):
+    """Check whether the query parameter means true or not.
+
+    :param target: query parameter, 'true' or '1' means true
+    :return: True or False
+    """
+    return target is not None and target.lower() in ('true', '1')
+
+
 def get_initial_file():
     """Get initial file's content
 
@@ -178,7 +203,10 @@ def deal_with_object_id(target):
 
     Convert ObjectId to str.
 
-    :param target: target list or dict
+    Connectors do not use it any more,
+    ObjectId is converted when the result is dumped by the serializer.
+
+    :param target: target ObjectId, list, dict or iterable like pymongo Cursor
     :return: result without ObjectId
     """
 
@@ -194,7 +222,7 @@ def deal_with_object_id(target):
         # check tar's type
         t = type(tar)
         if t == ObjectId:
-            return str(t)
+            return str(tar)
         elif t != dict:
             return tar
 
@@ -203,22 +231,25 @@ def deal_with_object_id(target):
             # if the attribute is ObjectId convert it to str
             if isinstance(tar[k], ObjectId):
                 tar[k] = str(tar[k])
-            # if the attribute is a list, travel the dict and check all attributes
-            elif isinstance(tar[k], list):
+            # if the attribute is a list or dict, travel it and check all attributes
+            elif isinstance(tar[k], (list, dict)):
                 tar[k] = deal_with_object_id(tar[k])
 
         return tar
 
-    if isinstance(target, dict):
+    if isinstance(target, (dict, ObjectId)):
         return convert_object_id(target)
-    elif isinstance(target, list):
+    elif hasattr(target, '__iter__') and not isinstance(target, (str, bytes)):
         result = []
 
+        # list or other iterable
         for n in target:
             result.append(convert_object_id(n))
 
         return result
 
+    return target
+
 
 def get_current_time_in_milliseconds():
     """Get current time in milliseconds.
@@ -247,16 +278,141 @@ def create_response(headers, data, code, pretty_flag):
     # set JSON MIME
     headers['Content-Type'] = 'application/json'
 
-    # check if needs pretty print
-    if pretty_flag:
-        data = dumps(data, sort_keys=True, indent=2) + '\n'
-    else:
-        data = dumps(data)
+    # dump to bytes, pretty print if needs
+    data = serializer.dumps(data, pretty_flag)
 
     # return response
     return make_response(data, code, headers)
 
 
+def dump_array_in_chunks(items, pretty_flag, chunk_size):
+    """Dump items to a JSON array chunk by chunk.
+
+    The joined chunks are the same as dumping the whole list at once.
+
+    :param items: iterable of items
+    :param pretty_flag: control pretty print or not
+    :param chunk_size: counts of items in a chunk
+    :return: generator of bytes
+    """
+    if pretty_flag:
+        # items are indented by the array
+        def dump(x):
+            return b'  ' + serializer.dumps(x, True).rstrip(b'\n').replace(b'\n', b'\n  ')
+        separator, head, tail, empty = b',\n', b'[\n', b'\n]\n', b'[]\n'
+    else:
+        def dump(x):
+            return serializer.dumps(x)
+        separator, head, tail, empty = b',', b'[', b']', b'[]'
+
+    chunk = []
+    started = False
+    for x in items:
+        chunk.append(dump(x))
+        if len(chunk) >= chunk_size:
+            yield (separator if started else head) + separator.join(chunk)
+            started = True
+            chunk = []
+
+    # the rest of items
+    if chunk:
+        yield (separator if started else head) + separator.join(chunk)
+        started = True
+
+    yield tail if started else empty
+
+
+def create_stream_response(headers, items, code, pretty_flag, chunk_size):
+    """Create a response which dumps items to a JSON array while sending.
+
+    Headers are sent before the body, so they should be completed here.
+
+    :param headers: dict, setting headers
+    :param items: iterable of items, read while sending
+    :param code: int, status code
+    :param pretty_flag: control pretty print or not
+    :param chunk_size: counts of items in a chunk
+    :return: response
+    """
+    if not headers:
+        headers = {}
+
+    # set JSON MIME
+    headers['Content-Type'] = 'application/json'
+
+    # keep request context while reading items
+    body = stream_with_context(dump_array_in_chunks(items, pretty_flag, chunk_size))
+
+    return Response(body, code, headers)
+
+
+def make_etag(*parts):
+    """Make a strong ETag from the version of a resource
+
+    :param parts: things decide the body, like ID, generation and query parameters
+    :return: ETag without quotes
+    """
+    return blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def make_body_etag(data):
+    """Make a strong ETag from the body
+
+    :param data: bytes
+    :return: ETag without quotes
+    """
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+def set_validators(headers, etag, modified=None):
+    """Set ETag and Last-Modified to headers
+
+    :param headers: dict, setting headers
+    :param etag: ETag without quotes
+    :param modified: timestamp in milliseconds or None
+    :return: headers
+    """
+    headers['ETag'] = '"{}"'.format(etag)
+    if modified is not None:
+        headers['Last-Modified'] = http_date(modified / 1000)
+    return headers
+
+
+def is_not_modified(etag, modified=None):
+    """Check conditional headers of current request
+
+    If-None-Match is checked first, If-Modified-Since is checked only without it.
+    ETags of compressed bodies are matched too.
+
+    :param etag: ETag without quotes
+    :param modified: timestamp in milliseconds, or None if If-Modified-Since is ignored
+    :return: True if the client has the same one
+    """
+    if request.if_none_match:
+        # compressed bodies have the encoding appended
+        return any(
+            request.if_none_match.contains_weak(x)
+            for x in (etag, etag + '-gzip', etag + '-deflate')
+        )
+
+    since = request.if_modified_since
+    if since is not None and modified is not None:
+        # HTTP date has a resolution of second
+        return int(modified / 1000) <= timegm(since.utctimetuple())
+
+    return False
+
+
+def create_not_modified_response(etag, modified=None):
+    """Create a 304 response without body
+
+    :param etag: ETag without quotes
+    :param modified: timestamp in milliseconds or None
+    :return: response
+    """
+    return Response(status=304, headers=set_validators({}, etag, modified))
+
+
 def isinstance_all(ins, *tar):
     """Apply isinstance() to all elements of target
 
@@ -271,28 +427,63 @@ def isinstance_all(ins, *tar):
     return True
 
 
-def set_next_page_and_data(counts, size, offset, data, pretty_flag):
-    """Deal with json data and headers
+def encode_cursor(values):
+    """Encode the sort key of the last item to an opaque cursor.
+
+    :param values: list of numbers or strings
+    :return: cursor string, safe to put in url
+    """
+    raw = dumps(values, separators=(',', ':')).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(target):
+    """Decode a cursor made by encode_cursor.
+
+    :param target: cursor string
+    :return: list of numbers or strings
+    :raise: InvalidCursorError if the cursor is broken
+    """
+    try:
+        # padding was stripped when encoding
+        raw = urlsafe_b64decode(target + '=' * (-len(target) % 4))
+        values = loads(raw.decode('utf-8'))
+    except (BinasciiError, UnicodeError, ValueError):
+        raise InvalidCursorError('Cursor is broken.')
+
+    if not isinstance(values, list) or len(values) == 0:
+        raise InvalidCursorError('Cursor is broken.')
+
+    for v in values:
+        if isinstance(v, bool) or not isinstance(v, (int, float, str)):
+            raise InvalidCursorError('Cursor is broken.')
+
+    return values
+
+
+def set_next_page(counts, size, offset, *, next_cursor=None):
+    """Create paging headers
 
     - Calculate next-page and set to header
+    - Set next-cursor to header if provided
     - Set MIME to JSON type
-    - Dump data and format it if necessary
 
-    :param counts: counts
+    :param counts: counts, or None if next-page was decided by the fetch,
+            there is a next page only if next_cursor was provided
     :param size: size
     :param offset: offset
-    :param data: pass to jsonify method
-    :param pretty_flag: control pretty print or not
-    :return: header, data
+    :param next_cursor: cursor of next page
+    :return: header
     """
 
-    if not isinstance_all(int, size, offset, counts):
-        raise ValueError('Headers should be a dict.')
-
-    next_page = False
+    if counts is None:
+        # decided by the fetch, only a cursor can point to the next page
+        next_page = next_cursor is not None
+    else:
+        if not isinstance_all(int, size, offset, counts):
+            raise ValueError('Headers should be a dict.')
 
-    if (counts - size - offset) > 0:
-        next_page = True
+        next_page = (counts - size - offset) > 0
 
     # set JSON MIME
     headers = {
@@ -300,11 +491,32 @@ def set_next_page_and_data(counts, size, offset, data, pretty_flag):
         'next-page': next_page
     }
 
-    # check if needs pretty print
-    if pretty_flag:
-        data = dumps(data, sort_keys=True, indent=2) + '\n'
-    else:
-        data = dumps(data)
+    if next_page and next_cursor is not None:
+        headers['next-cursor'] = next_cursor
+
+    return headers
+
+
+def set_next_page_and_data(counts, size, offset, data, pretty_flag, *, next_cursor=None):
+    """Deal with json data and headers
+
+    - Create paging headers by set_next_page
+    - Dump data and format it if necessary
+
+    :param counts: counts, or None if next-page was decided by the fetch,
+            there is a next page only if next_cursor was provided
+    :param size: size
+    :param offset: offset
+    :param data: pass to jsonify method
+    :param pretty_flag: control pretty print or not
+    :param next_cursor: cursor of next page
+    :return: header, data
+    """
+
+    headers = set_next_page(counts, size, offset, next_cursor=next_cursor)
+
+    # dump to bytes, pretty print if needs
+    data = serializer.dumps(data, pretty_flag)
 
     # return response
     return headers, data
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Move embedded comments to buckets.
+
+Run it before setting comments_storage to bucketed in config.ini.
+
+Usage:
+    python others/migrate_comments_to_buckets.py [--batch-size 100] [--test]
+"""
+
+from argparse import ArgumentParser
+
+from pymongo import MongoClient
+
+from marucat_app.database_helper.comments_mongodb import create_comments_connector
+from marucat_app.utils.utils import get_initial_file
+
+
+def get_connector(test_flag):
+    conf = get_initial_file()
+    mongo_conf = conf['mongodb']
+    url = mongo_conf['url']
+    port = int(mongo_conf['port'])
+    schema = mongo_conf['test_schema'] if test_flag else mongo_conf['schema']
+    db = MongoClient(url, port)[schema]
+    # comments_storage may still be embedded before the migration
+    return create_comments_connector(db, mongo_conf, storage='bucketed')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Move embedded comments to buckets.')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='counts of articles in a batch')
+    parser.add_argument('--test', action='store_true',
+                        help='use the test schema')
+    args = parser.parse_args()
+
+    connector = get_connector(args.test)
+    connector.ensure_indexes()
+    moved = connector.migrate_from_embedded(batch_size=args.batch_size)
+    print('Moved comments of {} articles.'.format(moved))
@@ -115,7 +115,8 @@ if __name__ == '__main__':
         rid.inserted_id, ObjectId(), 'Just comment for {}'.format(x),
         get_current_time_in_milliseconds(), False if x % 3 != 1 else True), range(8)))
 
-    re = articles.update({'_id': rid.inserted_id}, {'$set': {'comments': comments}})
+    reviews = len([x for x in comments if not x['deleted']])
+    re = articles.update({'_id': rid.inserted_id}, {'$set': {'comments': comments, 'reviews': reviews}})
 
     settings = get_settings_collection(c)
     settings.delete_many({})
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Recount reviews of all articles.
+
+Fill the counter of non-deleted comments for existing data,
+or repair it. Run it once after upgrading.
+Comments are counted in the comments_storage of config.ini.
+
+Usage:
+    python others/reconcile_reviews.py [--batch-size 500] [--test]
+"""
+
+from argparse import ArgumentParser
+
+from pymongo import MongoClient
+
+from marucat_app.database_helper.articles_mongodb import ArticlesConnector
+from marucat_app.database_helper.comments_mongodb import create_comments_connector
+from marucat_app.utils.utils import get_initial_file
+
+
+def get_connector(test_flag):
+    conf = get_initial_file()
+    mongo_conf = conf['mongodb']
+    url = mongo_conf['url']
+    port = int(mongo_conf['port'])
+    schema = mongo_conf['test_schema'] if test_flag else mongo_conf['schema']
+    db = MongoClient(url, port)[schema]
+    # count comments where the configured storage keeps them
+    return ArticlesConnector(
+        db[mongo_conf['articles_collection']],
+        create_comments_connector(db, mongo_conf)
+    )
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Recount reviews of all articles.')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='counts of articles in a batch')
+    parser.add_argument('--test', action='store_true',
+                        help='use the test schema')
+    args = parser.parse_args()
+
+    connector = get_connector(args.test)
+    updated, skipped = connector.reconcile_reviews(batch_size=args.batch_size)
+    print('Updated: {}, skipped: {}'.format(updated, skipped))
+    if skipped:
+        print('Some articles were written during the recount, run it again.')
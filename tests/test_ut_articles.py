@@ -56,10 +56,13 @@ def test_get_list(client):
             assert 'application/json' == r.content_type
             # check data
             fake_data = {
+                '_id': 'TEST_ID',
+                'timestamp': 1,
                 'test_only': 'TESTING',
                 'size': e_size,
                 'offset': e_offset,
-                'tags': tags
+                'tags': tags,
+                'cursor': None
             }
             assert fake_data == r.get_json()[1]
         elif 400 == code:
@@ -104,6 +107,84 @@ def test_get_list(client):
     assert 405 == rv.status_code
 
 
+def test_get_list_with_cursor(client):
+    """Test fetch list by cursor"""
+
+    # a full page points to the next page
+    r = client.get('/articles?size=2')
+    assert 200 == r.status_code
+    assert 'True' == r.headers['next-page']
+    next_cursor = r.headers['next-cursor']
+
+    # fetch next page by cursor, offset is ignored
+    r = client.get('/articles?size=2&offset=5&cursor={}'.format(next_cursor))
+    assert 200 == r.status_code
+    assert [1, 'TEST_ID'] == r.get_json()[1]['cursor']
+    assert 'next-cursor' in r.headers
+
+    # last page, no more pages
+    r = client.get('/articles?size=3&offset=98')
+    assert 200 == r.status_code
+    assert 'False' == r.headers['next-page']
+    assert 'next-cursor' not in r.headers
+
+    # broken cursor
+    for cursor in ['abc', 'W10', 'eyJhIjoxfQ', 'WzFd']:
+        r = client.get('/articles?cursor={}'.format(cursor))
+        assert 400 == r.status_code
+        assert r.get_json()['error'] is not None
+
+
+def test_get_list_with_count(client):
+    """Test fetch list with counts of articles"""
+
+    # counts of articles is not required by default
+    r = client.get('/articles')
+    assert 200 == r.status_code
+    assert 'total-count' not in r.headers
+
+    for flag in ['true', 'True', '1']:
+        r = client.get('/articles?count={}'.format(flag))
+        assert 200 == r.status_code
+        assert '100' == r.headers['total-count']
+
+    r = client.get('/articles?count=0')
+    assert 'total-count' not in r.headers
+
+
+def test_streamed_pages(client):
+    """Large pages are streamed with the same body and headers"""
+
+    # list
+    r = client.get('/articles?size=500&count=true')
+    assert 200 == r.status_code
+    assert 'Content-Length' not in r.headers
+    assert 'application/json' == r.content_type
+    assert 'False' == r.headers['next-page']
+    assert '100' == r.headers['total-count']
+    assert 500 == r.get_json()[1]['size']
+
+    # fetch by cursor
+    r = client.get('/articles?size=500&cursor=WzEsIlRFU1RfSUQiXQ')
+    assert 200 == r.status_code
+    assert [1, 'TEST_ID'] == r.get_json()[1]['cursor']
+
+    # broken cursor
+    r = client.get('/articles?size=500&cursor=WzFd')
+    assert 400 == r.status_code
+
+    # comments
+    r = client.get('/articles/aid1234/comments?size=500')
+    assert 200 == r.status_code
+    assert 'Content-Length' not in r.headers
+    assert 'False' == r.headers['next-page']
+    assert 500 == r.get_json()[1]['size']
+
+    # small pages are not streamed
+    r = client.get('/articles?size=10')
+    assert 'Content-Length' in r.headers
+
+
 def test_get_content(client):
     """Test fetch content"""
 
@@ -155,6 +236,69 @@ def test_get_content(client):
     assert 405 == rv.status_code
 
 
+def test_conditional_requests(client):
+    """ETag and Last-Modified are checked and 304 is returned"""
+
+    for url in ['/articles?size=10', '/articles/T1234', '/articles/T1234/comments']:
+        r = client.get(url)
+        assert 200 == r.status_code
+        etag = r.headers['ETag']
+        assert etag.startswith('"')
+        last_modified = r.headers['Last-Modified']
+
+        # same version
+        r = client.get(url, headers={'If-None-Match': etag})
+        assert 304 == r.status_code
+        assert not r.data
+        assert etag == r.headers['ETag']
+
+        # compressed one
+        r = client.get(url, headers={'If-None-Match': '{}-gzip"'.format(etag[:-1])})
+        assert 304 == r.status_code
+
+        # different version
+        r = client.get(url, headers={'If-None-Match': '"other"'})
+        assert 200 == r.status_code
+        assert r.data
+
+        # If-Modified-Since is ignored if If-None-Match was provided
+        r = client.get(url, headers={'If-None-Match': '"other"', 'If-Modified-Since': last_modified})
+        assert 200 == r.status_code
+
+    # not modified since
+    for url in ['/articles/T1234', '/articles/T1234/comments']:
+        r = client.get(url, headers={'If-Modified-Since': 'Mon, 09 Jul 2018 09:26:26 GMT'})
+        assert 304 == r.status_code
+        r = client.get(url, headers={'If-Modified-Since': 'Mon, 09 Jul 2018 09:26:25 GMT'})
+        assert 200 == r.status_code
+
+    # the list ignores If-Modified-Since
+    r = client.get('/articles?size=10', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert 200 == r.status_code
+
+    # not found
+    r = client.get('/articles/TEST_NOT_FOUND', headers={'If-None-Match': '"other"'})
+    assert 404 == r.status_code
+
+
+def test_comments_without_validators(client, monkeypatch):
+    """The version of article is only read first if the request has validators"""
+    from marucat_app.database_helper.fake_articles_connector import FakeArticlesConnector
+
+    touched = []
+    touch = FakeArticlesConnector.touch_article
+    monkeypatch.setattr(
+        FakeArticlesConnector, 'touch_article',
+        staticmethod(lambda *args, **kwargs: touched.append(args) or touch(*args, **kwargs))
+    )
+
+    r = client.get('/articles/T1234/comments')
+    assert 200 == r.status_code and not touched
+
+    r = client.get('/articles/T1234/comments', headers={'If-None-Match': r.headers['ETag']})
+    assert 304 == r.status_code and len(touched) == 1
+
+
 def test_get_comments(client):
     """Test fetch comments"""
 
@@ -193,9 +337,11 @@ def test_get_comments(client):
             assert 'application/json' == r.content_type
             # check data
             data = {
+                'cid': 'TEST_CID',
                 'test_only_aid': aid,
                 'size': e_size,
-                'offset': e_page
+                'offset': e_page,
+                'cursor': None
             }
             assert data == r.get_json()[1]
         elif code == 400 or code == 404:
@@ -243,6 +389,27 @@ def test_get_comments(client):
     assert 405 == rv.status_code
 
 
+def test_get_comments_with_cursor(client):
+    """Test fetch comments by cursor"""
+
+    # a full page points to the next page
+    r = client.get('/articles/T123/comments?size=2')
+    assert 200 == r.status_code
+    assert 'True' == r.headers['next-page']
+    next_cursor = r.headers['next-cursor']
+
+    # fetch next page by cursor, offset is ignored
+    r = client.get('/articles/T123/comments?size=2&offset=9&cursor={}'.format(next_cursor))
+    assert 200 == r.status_code
+    assert ['TEST_CID'] == r.get_json()[1]['cursor']
+
+    # broken cursor
+    for cursor in ['abc', 'W10', 'WzEsMl0']:
+        r = client.get('/articles/T123/comments?cursor={}'.format(cursor))
+        assert 400 == r.status_code
+        assert r.get_json()['error'] is not None
+
+
 def test_post_comments(client):
 
     def perform_post_comments(article_id, data, code=201):
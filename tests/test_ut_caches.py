@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about caches"""
+
+from time import sleep
+
+import pytest
+
+from marucat_app import create_app
+from marucat_app.database_helper.article_cache import ArticleCache
+from marucat_app.utils.caches import LRUCache
+from marucat_app.utils.utils import LIST_CACHE
+
+
+class CountingConnector(object):
+    """Articles connector which records calls"""
+
+    def __init__(self):
+        self.views = 0
+        self.generation = 0
+        self.calls = []
+
+    def get_content(self, article_id, *, comments_size, count_view=True):
+        self.calls.append(('get_content', count_view))
+        if count_view:
+            self.views += 1
+        return {
+            '_id': article_id,
+            'content': 'Nothing here',
+            'views': self.views,
+            'generation': self.generation,
+            'comments': ['c'] * comments_size
+        }
+
+    def touch_article(self, article_id, *, count_view=True):
+        self.calls.append(('touch_article', count_view))
+        if count_view:
+            self.views += 1
+        return {'views': self.views, 'generation': self.generation}
+
+
+@pytest.fixture
+def app():
+    app = create_app(db='test')
+    app.testing = True
+    return app
+
+
+def test_lru_cache():
+    """Least recently used values are evicted by bytes"""
+    cache = LRUCache(10)
+
+    assert cache.set('a', 'A', 4)
+    assert cache.set('b', 'B', 4)
+    assert 'A' == cache.get('a')
+    assert cache.set('c', 'C', 4)
+
+    # b was the least recently used one
+    assert cache.get('b') is None
+    assert 'C' == cache.get('c')
+    assert not cache.set('d', 'D', 11)
+
+    stats = cache.stats()
+    assert 8 == stats['bytes']
+    assert 1 == stats['evictions']
+    assert 2 / 3 == stats['hit_ratio']
+
+
+def test_lru_cache_ttl():
+    """Values expire after TTL"""
+    cache = LRUCache(10, ttl=0.05)
+
+    cache.set('a', 'A', 4)
+    assert 'A' == cache.get('a')
+    sleep(0.1)
+    assert cache.get('a') is None
+    assert 0 == cache.stats()['bytes']
+
+
+def test_list_cache(app):
+    """Pages of articles list are cached and dropped by writes"""
+    client = app.test_client()
+    list_cache = app.config[LIST_CACHE]
+
+    first = client.get('/articles?size=10&count=1')
+    second = client.get('/articles?size=10&count=1')
+    assert first.data == second.data
+    assert '100' == second.headers['total-count']
+    assert 'True' == second.headers['next-page']
+    assert 1 == list_cache.stats()['hits']
+
+    # different pages
+    client.get('/articles?size=10&offset=10')
+    client.get('/articles?size=10&tags=[OK,red]')
+    assert 3 == list_cache.stats()['items']
+
+    # a write drops all of pages
+    r = client.post('/articles/aid1234/comments', json={'from': 'Mary', 'body': 'Hi', 'timestamp': 1})
+    assert 201 == r.status_code
+    assert 0 == list_cache.stats()['items']
+
+    stats = client.get('/stats').get_json()
+    assert 1 == stats['list_cache']['hits']
+
+
+def test_article_cache():
+    """Content is validated by generation and views are counted once"""
+    connector = CountingConnector()
+    cache = ArticleCache(connector, cache=LRUCache(1024))
+
+    # miss
+    assert 1 == cache.get_content('a', comments_size=2)['views']
+    # hit, only views and generation are read
+    content = cache.get_content('a', comments_size=2)
+    assert 2 == content['views']
+    assert ['c', 'c'] == content['comments']
+    assert [('get_content', True), ('touch_article', True)] == connector.calls
+
+    # changed by a write of another process
+    connector.generation += 1
+    connector.calls = []
+    assert 3 == cache.get_content('a', comments_size=2)['views']
+    assert [('touch_article', True), ('get_content', False)] == connector.calls
+
+    # changed by a write of this process
+    cache.invalidate('a')
+    connector.calls = []
+    assert 4 == cache.get_content('a', comments_size=2)['views']
+    assert [('get_content', True)] == connector.calls
+
+    stats = cache.stats()
+    assert 2 == stats['hits']
+    assert 2 == stats['misses']
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about response compression"""
+
+import gzip
+import json
+import zlib
+
+import pytest
+
+from marucat_app import create_app
+from marucat_app.utils.utils import COMPRESSION
+
+
+@pytest.fixture
+def app():
+    app = create_app(db='test')
+    app.testing = True
+    # fake responses are small
+    app.config[COMPRESSION].min_size = 0
+    return app
+
+
+def test_gzip(app):
+    """Bodies are compressed and compressed bodies are reused"""
+    client = app.test_client()
+    compression = app.config[COMPRESSION]
+
+    plain = client.get('/articles?size=10')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    for _ in range(3):
+        r = client.get('/articles?size=10', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert 200 == r.status_code
+        assert 'gzip' == r.headers['Content-Encoding']
+        assert 'Accept-Encoding' in r.headers['Vary']
+        assert '{}-gzip"'.format(plain.headers['ETag'][:-1]) == r.headers['ETag']
+        assert plain.data == gzip.decompress(r.data)
+
+    stats = compression.stats()['cache']
+    assert 1 == stats['misses']
+    assert 2 == stats['hits']
+
+
+def test_deflate_and_refused(app):
+    """Encoding follows Accept-Encoding"""
+    client = app.test_client()
+    plain = client.get('/articles?size=10')
+
+    r = client.get('/articles?size=10', headers={'Accept-Encoding': 'deflate'})
+    assert 'deflate' == r.headers['Content-Encoding']
+    assert plain.data == zlib.decompress(r.data)
+
+    r = client.get('/articles?size=10', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in r.headers
+
+
+def test_threshold(app):
+    """Small bodies are sent as they are"""
+    app.config[COMPRESSION].min_size = 1024 * 1024
+    r = app.test_client().get('/articles?size=10', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in r.headers
+    assert 'Accept-Encoding' in r.headers['Vary']
+
+
+def test_streamed(app):
+    """Streamed bodies are compressed chunk by chunk"""
+    r = app.test_client().get('/articles?size=500', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'gzip' == r.headers['Content-Encoding']
+    assert 'Content-Length' not in r.headers
+    assert 500 == json.loads(gzip.decompress(r.data).decode('utf-8'))[1]['size']
+
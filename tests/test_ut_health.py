@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about health probe and readiness"""
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+from marucat_app import create_app
+from marucat_app.database_helper.health import HealthProbe
+
+
+class FakeAdmin(object):
+    """Admin database fails until it is up"""
+
+    def __init__(self):
+        self.up = False
+        self.version = [4, 4, 0, 0]
+
+    def command(self, name):
+        if not self.up:
+            raise ServerSelectionTimeoutError('No servers.')
+        if name == 'buildInfo':
+            return {'versionArray': self.version, 'ok': 1}
+        return {'ok': 1}
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.admin = FakeAdmin()
+
+
+def test_probe():
+    """Connected callback runs once after the database was reached"""
+    client = FakeClient()
+    connected = []
+    probe = HealthProbe(client, connected=lambda: connected.append(1))
+
+    assert not probe.status()['ready']
+    assert not probe.probe()
+    assert 'No servers.' == probe.status()['error']
+    assert [] == connected
+
+    client.admin.up = True
+    assert probe.probe()
+    assert probe.probe()
+    assert [1] == connected
+    assert probe.status()['ready']
+    assert probe.status()['error'] is None
+
+    # down again
+    client.admin.up = False
+    assert not probe.probe()
+    assert not probe.status()['ready']
+
+
+def test_server_version():
+    """A server older than required is never ready"""
+    client = FakeClient()
+    client.admin.up = True
+    client.admin.version = [4, 2, 8, 0]
+    connected = []
+    probe = HealthProbe(client, connected=lambda: connected.append(1), min_version=(4, 4))
+
+    assert not probe.probe()
+    assert 'MongoDB 4.4 or later is required, the server is 4.2.' == probe.status()['error']
+    assert [] == connected
+
+    # upgraded
+    client.admin.version = [5, 0, 0, 0]
+    assert probe.probe()
+    assert [1] == connected
+
+
+def test_ready():
+    """Fake connectors are always ready"""
+    client = create_app(db='test').test_client()
+    r = client.get('/ready')
+
+    assert 200 == r.status_code
+    assert r.get_json()['ready']
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about the in-memory articles connector"""
+
+from threading import Thread
+
+import pytest
+from bson import ObjectId
+
+from marucat_app.database_helper import ConnectorCreator
+from marucat_app.database_helper.articles_memory import MemoryArticlesConnector, generate_articles
+from marucat_app.utils.errors import (
+    NoSuchArticleError, NoSuchArticleOrCommentError, InvalidCursorError, DatabaseNotExistError
+)
+
+
+@pytest.fixture
+def connector():
+    c = MemoryArticlesConnector()
+    c.insert_many(generate_articles(30, comments=3, tags=['a', 'b', 'c'], seed=1))
+    return c
+
+
+def test_list(connector):
+    """Newest first, paged by offset or cursor, deleted ones and tags are filtered"""
+    first, next_page = connector.get_list(size=10, offset=0)
+    assert len(first) == 10 and next_page
+    assert [x['timestamp'] for x in first] == sorted([x['timestamp'] for x in first], reverse=True)
+    assert first[0]['reviews'] == 3 and 'content' not in first[0]
+
+    second, _ = connector.get_list(size=10, offset=10)
+    last = first[-1]
+    by_cursor, _ = connector.get_list(size=10, offset=0, cursor=[last['timestamp'], str(last['_id'])])
+    assert second == by_cursor
+
+    rest, next_page = connector.get_list(size=10, offset=20)
+    assert len(rest) == 10 and not next_page
+    assert connector.get_list(size=10, offset=30) == (None, False)
+
+    # a tag matches arrays containing it, tags match the same array
+    tagged, _ = connector.get_list(size=100, offset=0, tags='a')
+    assert tagged and all('a' in x['tags'] for x in tagged)
+    assert connector.get_articles_counts(tags='a') == len(tagged)
+    tags = tagged[0]['tags']
+    exact, _ = connector.get_list(size=100, offset=0, tags=tags)
+    assert all(x['tags'] == tags for x in exact)
+
+    with pytest.raises(InvalidCursorError):
+        connector.get_list(size=10, offset=0, cursor=[1])
+    # the timestamp must be a number, like the mongodb backend
+    for timestamp in ['x', {'$gt': 0}, True]:
+        with pytest.raises(InvalidCursorError):
+            connector.get_list(size=10, offset=0, cursor=[timestamp, str(last['_id'])])
+
+    # deleted articles are only fetched by admin
+    deleted = first[0]['_id']
+    connector.insert_many([{'_id': deleted, 'timestamp': first[0]['timestamp'], 'deleted': True}])
+    assert connector.get_articles_counts() == 29
+    assert connector.get_list(size=1, offset=0)[0][0]['_id'] == first[1]['_id']
+    assert connector.get_list(size=1, offset=0, fetch_deleted=True)[0][0]['_id'] == deleted
+    with pytest.raises(NoSuchArticleError):
+        connector.get_content(str(deleted), comments_size=1)
+
+    articles, next_page, last = connector.iter_list(size=5, offset=0, tags='b')
+    articles = list(articles)
+    assert len(articles) <= 5 and last['_id'] == articles[-1]['_id']
+
+
+def test_content_and_comments(connector):
+    """Views are counted, comments are counted, sliced and soft deleted"""
+    aid = str(connector.get_list(size=1, offset=0)[0][0]['_id'])
+
+    content = connector.get_content(aid, comments_size=2)
+    assert content['views'] == 1 and len(content['comments']) == 2
+    assert content['generation'] == 0 and content['modified'] == content['timestamp']
+    connector.update_views(aid, 3)
+    assert connector.touch_article(aid, count_view=False)['views'] == 4
+
+    connector.post_comment(aid, data={'from': 'x', 'body': 'y'})
+    comments, count, version = connector.get_comments(aid, size=10, offset=0)
+    assert count == 4 and comments[-1]['body'] == 'y' and version['generation'] == 1
+
+    connector.delete_comment(aid, str(comments[0]['cid']))
+    with pytest.raises(NoSuchArticleOrCommentError):
+        connector.delete_comment(aid, str(comments[0]['cid']))
+
+    comments, count, _ = connector.get_comments(aid, size=2, offset=0)
+    assert count == 3 and len(comments) == 2
+    after, _, _ = connector.get_comments(aid, size=2, offset=0, cursor=[str(comments[-1]['cid'])])
+    assert len(after) == 1 and after[0]['body'] == 'y'
+    assert connector.get_comments(aid, size=10, offset=0, fetch_deleted=True)[1] == 1
+
+    content = connector.get_content(aid, comments_size=10)
+    assert content['reviews'] == 3 and content['generation'] == 2
+    assert connector.reconcile_reviews() == (0, 0)
+
+    with pytest.raises(NoSuchArticleError):
+        connector.post_comment(str(ObjectId()), data={})
+
+
+def test_concurrent_views(connector):
+    """Views counted by threads are not lost"""
+    aid = str(connector.get_list(size=1, offset=0)[0][0]['_id'])
+
+    def view():
+        for _ in range(200):
+            connector.get_content(aid, comments_size=0)
+
+    threads = [Thread(target=view) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert connector.touch_article(aid, count_view=False)['views'] == 800
+
+
+def test_generated_articles():
+    """The same seed generates the same articles, and the connector is created by name"""
+    assert list(generate_articles(5, tags=['a'], seed=3)) == list(generate_articles(5, tags=['a'], seed=3))
+
+    factory = ConnectorCreator('memory')
+    assert factory.namespace == 'memory'
+    factory.seed(3, comments=1, seed=3)
+    assert factory.articles_helper.get_articles_counts() == 3
+    factory.close()
+
+    with pytest.raises(DatabaseNotExistError):
+        ConnectorCreator('test').seed(3)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about metrics and instrumentation"""
+
+import json
+import os
+from logging import INFO
+from multiprocessing import get_context
+
+import pytest
+
+from marucat_app import create_app
+from marucat_app.database_helper import Articles
+from marucat_app.database_helper.fake_articles_connector import FakeArticlesConnector
+from marucat_app.utils.errors import NoSuchArticleError
+from marucat_app.utils.metrics import (
+    Histogram, MetricsExporter, Registry, INSTRUMENTATION, REGISTRY, merge, render
+)
+
+
+@pytest.fixture
+def instrumentation():
+    yield INSTRUMENTATION
+    INSTRUMENTATION.configure(metrics=False, logs=False)
+
+
+def latency_of(method):
+    return REGISTRY.histogram('database_call_seconds', method=method).snapshot()
+
+
+def errors_of(method):
+    return REGISTRY.counter('database_call_errors_total', method=method).snapshot()
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    snapshot = histogram.snapshot()
+    assert [2, 1, 1] == snapshot['counts']
+    assert 4 == snapshot['count']
+    assert 3.65 == pytest.approx(snapshot['sum'])
+
+
+def test_registry():
+    registry = Registry()
+    assert registry.counter('c', a='1') is registry.counter('c', a='1')
+    assert registry.counter('c', a='1') is not registry.counter('c', a='2')
+    registry.counter('c', a='1').inc(2)
+
+    assert [({'a': '1'}, 2), ({'a': '2'}, 0)] == registry.snapshot()['c']
+    with pytest.raises(TypeError):
+        registry.histogram('c', a='1')
+
+
+def test_disabled(instrumentation):
+    """Nothing is recorded when disabled"""
+    instrumentation.configure(metrics=False, logs=False)
+    before = latency_of('Articles.get_articles_counts')['count']
+
+    Articles(FakeArticlesConnector()).get_articles_counts(tags=['a'])
+    assert before == latency_of('Articles.get_articles_counts')['count']
+
+
+def test_enabled(instrumentation, caplog):
+    """Latency, errors and logs of calls"""
+    instrumentation.configure(metrics=True, logs=True)
+    articles = Articles(FakeArticlesConnector())
+    before = latency_of('Articles.get_content')['count']
+    errors = errors_of('Articles.get_content')
+
+    with caplog.at_level(INFO):
+        articles.get_content('aid1234', comments_size=10)
+        with pytest.raises(NoSuchArticleError):
+            articles.get_content('TEST_NOT_FOUND', comments_size=10)
+
+    assert before + 2 == latency_of('Articles.get_content')['count']
+    assert errors + 1 == errors_of('Articles.get_content')
+
+    calls = [x.call for x in caplog.records if hasattr(x, 'call')]
+    assert 2 == len(calls)
+    assert 'Articles.get_content' == calls[0]['method']
+    assert ['aid1234'] == calls[0]['args']
+    assert {'comments_size': 10} == calls[0]['kwargs']
+    assert calls[0]['error'] is None
+    assert 'NoSuchArticleError' == calls[1]['error']
+
+
+def test_merge_and_render():
+    histogram = Histogram((0.1, 1))
+    histogram.observe(0.05)
+    samples = [
+        ('requests_total', 'counter', {'route': '/'}, 2),
+        ('latency_seconds', 'histogram', {}, histogram.snapshot())
+    ]
+    merged = merge([samples, samples])
+
+    assert ('requests_total', 'counter', {'route': '/'}, 4) in merged
+    text = render(merged)
+    assert '# TYPE marucat_requests_total counter' in text
+    assert 'marucat_requests_total{route="/"} 4' in text
+    assert 'marucat_latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'marucat_latency_seconds_bucket{le="+Inf"} 2' in text
+    assert 'marucat_latency_seconds_count 2' in text
+
+
+def test_exporter(tmp_path):
+    """Files of other workers are merged, gauges of exited ones are dropped"""
+    exporter = MetricsExporter(str(tmp_path), collectors=[lambda: [('own_total', 'counter', {}, 1)]])
+    # pid of an exited worker
+    process = get_context('fork').Process(target=lambda: None)
+    process.start()
+    process.join()
+    with open(str(tmp_path / '{}.json'.format(process.pid)), 'w') as f:
+        json.dump([
+            ('own_total', 'counter', {}, 2),
+            ('in_flight', 'gauge', {}, 5)
+        ], f)
+
+    samples = exporter.collect_all()
+    assert ('own_total', 'counter', {}, 3) in samples
+    assert 'in_flight' not in [x[0] for x in samples]
+
+    exporter.reset()
+    assert [] == os.listdir(str(tmp_path))
+
+
+def test_retire(tmp_path):
+    """Files of exited workers are folded, a reused pid does not overwrite their counters"""
+    exporter = MetricsExporter(str(tmp_path))
+    process = get_context('fork').Process(target=lambda: None)
+    process.start()
+    process.join()
+
+    def write(start, value):
+        with open(str(tmp_path / '{}-{}.json'.format(process.pid, start)), 'w') as f:
+            json.dump([('worker_total', 'counter', {}, value), ('in_flight', 'gauge', {}, 5)], f)
+
+    def worker_total():
+        return [x[3] for x in exporter.collect_all() if x[0] == 'worker_total']
+
+    write(1, 2)
+    exporter.retire(process.pid)
+    assert ['retired.json'] == os.listdir(str(tmp_path))
+    assert [2] == worker_total()
+
+    # the pid was used again by a new worker
+    write(2, 3)
+    assert [5] == worker_total()
+    exporter.retire(process.pid)
+    assert ['retired.json'] == os.listdir(str(tmp_path))
+    assert [5] == worker_total()
+    assert 'in_flight' not in [x[0] for x in exporter.collect_all()]
+
+
+def test_metrics_route():
+    client = create_app(db='test').test_client()
+    client.get('/articles/aid1234')
+
+    r = client.get('/metrics')
+    assert 200 == r.status_code
+    assert r.content_type.startswith('text/plain')
+    text = r.get_data(as_text=True)
+    assert 'route="/articles/<article_id>",status="200"' in text
+    assert 'marucat_cache_misses_total{cache="content"}' in text
+    assert 'marucat_http_requests_in_flight' in text
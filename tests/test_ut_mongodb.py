@@ -2,10 +2,290 @@
 # -*- coding: utf-8 -*-
 
 """Description here"""
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+
 from marucat_app.database_helper import ConnectorCreator
+from marucat_app.database_helper.articles_mongodb import ArticlesConnector
+from marucat_app.database_helper.comments_mongodb import (
+    EmbeddedCommentsConnector, BucketedCommentsConnector, create_comments_connector
+)
+from marucat_app.database_helper.query_plans import (
+    CommandRecorder, check_query_plans, create_database
+)
+from marucat_app.utils.errors import (
+    InvalidCursorError, DatabaseNotExistError, NoSuchArticleOrCommentError
+)
+from marucat_app.utils.utils import get_initial_file
+
+
+# prefix of collections written by tests
+PREFIX = 'unit_'
+
+
+@pytest.fixture
+def database():
+    """Test schema in config.ini, collections of tests are dropped afterwards"""
+    mongo_conf = get_initial_file()['mongodb']
+    client = MongoClient(mongo_conf['url'], int(mongo_conf['port']))
+    db = client[mongo_conf['test_schema']]
+
+    def drop():
+        for name in db.list_collection_names():
+            if name.startswith(PREFIX):
+                db.drop_collection(name)
+
+    # left by an interrupted run
+    drop()
+    yield db
+    drop()
+    client.close()
+
+
+def insert_article(collection, **fields):
+    """Insert an article
+
+    :param collection: articles collection
+    :param fields: fields to override
+    :return: article ID
+    """
+    article = {
+        'title': 'Article', 'content': 'Nothing here', 'views': 0,
+        'tags': [], 'timestamp': 1531128386417, 'deleted': False
+    }
+    article.update(fields)
+    return str(collection.insert_one(article).inserted_id)
+
+
+def bodies(comments):
+    return [int(c['body']) for c in comments]
 
 
 def test_connection():
 
     c = ConnectorCreator('mongodb')
 
+
+def test_query_plans():
+    """No query of connectors scans a whole collection"""
+
+    recorder = CommandRecorder()
+    checked = check_query_plans(create_database(recorder), recorder)
+
+    assert checked
+    assert [] == [x['command'] for x in checked if x['collscan']]
+
+
+def test_list_cursor():
+    """Timestamps of cursors must be numbers"""
+    aid = '5f5f5f5f5f5f5f5f5f5f5f5f'
+    assert 2 == len(ArticlesConnector._after_cursor([1531128386417, aid]))
+    for timestamp in ['x', {'$gt': 0}, [1], True, None]:
+        with pytest.raises(InvalidCursorError):
+            ArticlesConnector._after_cursor([timestamp, aid])
+
+
+def test_comments_connector():
+    """Comments connector is created by the storage in config.ini"""
+    mongo_conf = dict(get_initial_file()['mongodb'])
+    db = MongoClient(connect=False)['test']
+
+    mongo_conf['comments_storage'] = 'embedded'
+    assert isinstance(create_comments_connector(db, mongo_conf), EmbeddedCommentsConnector)
+    assert isinstance(create_comments_connector(db, mongo_conf, storage='bucketed'), BucketedCommentsConnector)
+    mongo_conf['comments_storage'] = 'bucketed'
+    assert isinstance(create_comments_connector(db, mongo_conf), BucketedCommentsConnector)
+    with pytest.raises(DatabaseNotExistError):
+        create_comments_connector(db, mongo_conf, storage='test')
+
+
+def test_bucketed_comments(database):
+    """Comments are paged over buckets by offset and cursor, counters follow writes"""
+    articles, buckets = database[PREFIX + 'articles'], database[PREFIX + 'comments']
+    comments = BucketedCommentsConnector(articles, buckets, bucket_size=3)
+    comments.ensure_indexes()
+    connector = ArticlesConnector(articles, comments)
+    aid = insert_article(articles)
+
+    for i in range(10):
+        connector.post_comment(aid, data={'from': 'Mary', 'body': str(i), 'timestamp': i})
+    assert 4 == buckets.count_documents({'aid': ObjectId(aid)})
+    cids = [c['cid'] for c in connector.get_comments(aid, size=10, offset=0)[0]]
+    assert cids == sorted(cids)
+
+    # the second bucket has only deleted comments
+    for i in [3, 4, 5, 7]:
+        connector.delete_comment(aid, str(cids[i]))
+    with pytest.raises(NoSuchArticleOrCommentError):
+        connector.delete_comment(aid, str(cids[3]))
+
+    article = articles.find_one({'_id': ObjectId(aid)})
+    assert (6, 10, 14) == (article['reviews'], article['comments_posted'], article['generation'])
+    assert {ObjectId(aid): 6} == comments.count_reviews([ObjectId(aid)])
+
+    # live comments are 0, 1, 2, 6, 8, 9
+    def page(size, offset=0, after=None, deleted=False):
+        cursor = None if after is None else [str(cids[after])]
+        result, count, _ = connector.get_comments(
+            aid, size=size, offset=offset, cursor=cursor, fetch_deleted=deleted
+        )
+        return bodies(result), count
+
+    assert ([0, 1, 2, 6], 6) == page(4)
+    assert ([2, 6], 6) == page(2, offset=2)
+    assert ([8, 9], 6) == page(10, offset=4)
+    assert ([], 6) == page(2, offset=6)
+    assert ([6, 8], 6) == page(2, after=2)
+    assert ([9], 6) == page(2, after=8)
+    assert ([], 6) == page(2, after=9)
+
+    # deleted comments are 3, 4, 5, 7
+    assert ([4, 5], 4) == page(2, offset=1, deleted=True)
+    assert ([4, 5, 7], 4) == page(10, after=3, deleted=True)
+
+    content = connector.get_content(aid, comments_size=2)
+    assert 6 == content['reviews'] and [0, 1] == bodies(content['comments'])
+
+    # a concurrent post put a greater ID into an earlier bucket
+    late = {'cid': ObjectId(), 'aid': ObjectId(aid), 'body': '10', 'deleted': False}
+    buckets.update_one(
+        {'aid': ObjectId(aid), 'seq': 0},
+        {
+            '$push': {'comments': {'$each': [late], '$sort': {'cid': 1}}},
+            '$inc': {'count': 1, 'live': 1},
+            '$max': {'last_cid': late['cid']}
+        }
+    )
+    assert ([9], 6) == page(1, after=8)
+    assert ([9, 10], 6) == page(5, after=8)
+
+
+def test_migrate_comments(database):
+    """Embedded comments are moved to buckets once"""
+    articles, buckets = database[PREFIX + 'articles'], database[PREFIX + 'comments']
+    comments = BucketedCommentsConnector(articles, buckets, bucket_size=2)
+    comments.ensure_indexes()
+    connector = ArticlesConnector(articles, comments)
+
+    embedded = [
+        {'cid': ObjectId(), 'body': str(i), 'deleted': i == 1, 'timestamp': i}
+        for i in range(5)
+    ]
+    aid = insert_article(articles, comments=embedded[::-1], reviews=4)
+    empty = insert_article(articles, comments=[])
+
+    assert 2 == comments.migrate_from_embedded(batch_size=1)
+    article = articles.find_one({'_id': ObjectId(aid)})
+    assert 'comments' not in article and 5 == article['comments_posted']
+    assert [2, 2, 1] == [b['count'] for b in buckets.find({'aid': ObjectId(aid)}).sort('seq', 1)]
+    assert 0 == buckets.count_documents({'aid': ObjectId(empty)})
+
+    assert ([0, 2, 3, 4], 4) == (bodies(connector.get_comments(aid, size=10, offset=0)[0]), 4)
+    assert [1] == bodies(connector.get_comments(aid, size=10, offset=0, fetch_deleted=True)[0])
+    assert {ObjectId(aid): 4, ObjectId(empty): 0} == comments.count_reviews([ObjectId(aid), ObjectId(empty)])
+
+    # nothing left to move, buckets are not touched
+    snapshot = list(buckets.find({}, {'_id': 0}).sort([('aid', 1), ('seq', 1)]))
+    assert 0 == comments.migrate_from_embedded(batch_size=1)
+    assert snapshot == list(buckets.find({}, {'_id': 0}).sort([('aid', 1), ('seq', 1)]))
+
+    # new comments go after the moved ones
+    connector.post_comment(aid, data={'from': 'Mary', 'body': '5', 'timestamp': 5})
+    assert [3, 4, 5] == bodies(connector.get_comments(aid, size=10, offset=2)[0])
+
+
+def test_namespace(monkeypatch):
+    """Shared caches of the same schema on other servers do not share values"""
+    import marucat_app.database_helper as database_helper
+
+    conf = get_initial_file()
+    namespaces = []
+    for port in ['27017', '27018']:
+        conf['mongodb']['port'] = port
+        monkeypatch.setattr(database_helper, 'get_initial_file', lambda: conf)
+        factory = ConnectorCreator('mongodb', test=True)
+        namespaces.append(factory.namespace)
+        factory.close()
+
+    assert all(x.startswith(conf['mongodb']['test_schema'] + '-') for x in namespaces)
+    assert namespaces[0] != namespaces[1]
+
+
+def test_reviews(database):
+    """Reviews follow comment writes and are repaired by reconciliation"""
+    articles = database[PREFIX + 'articles']
+    connector = ArticlesConnector(articles)
+    connector.ensure_indexes()
+    ids = [insert_article(articles, timestamp=i) for i in range(5)]
+    aid = ids[0]
+
+    for i in range(3):
+        connector.post_comment(aid, data={'from': 'Mary', 'body': str(i), 'timestamp': i})
+    first = connector.get_comments(aid, size=1, offset=0)[0][0]
+    connector.delete_comment(aid, str(first['cid']))
+
+    listed = {str(x['_id']): x['reviews'] for x in connector.get_list(size=10, offset=0)[0]}
+    assert {aid: 2, ids[1]: 0} == {x: listed[x] for x in ids[:2]}
+    assert 2 == connector.get_content(aid, comments_size=10)['reviews']
+
+    # articles without comments have no counter yet, one is corrupted
+    articles.update_one({'_id': ObjectId(aid)}, {'$set': {'reviews': 9}})
+    assert (5, 0) == connector.reconcile_reviews(batch_size=2)
+    assert [2, 0, 0, 0, 0] == [articles.find_one({'_id': ObjectId(x)})['reviews'] for x in ids]
+    assert (0, 0) == connector.reconcile_reviews(batch_size=2)
+
+    class Racing(EmbeddedCommentsConnector):
+        """A comment is written between the recount and the update"""
+
+        def count_reviews(self, article_ids):
+            counted = super().count_reviews(article_ids)
+            if ObjectId(ids[2]) in article_ids:
+                articles.update_one({'_id': ObjectId(ids[2])}, {'$inc': {'reviews': 1}})
+            return counted
+
+    articles.update_many({'_id': {'$in': [ObjectId(ids[2]), ObjectId(ids[3])]}}, {'$set': {'reviews': 7}})
+    generation = articles.find_one({'_id': ObjectId(ids[3])}).get('generation', 0)
+    assert (1, 1) == ArticlesConnector(articles, Racing(articles)).reconcile_reviews(batch_size=2)
+    assert 8 == articles.find_one({'_id': ObjectId(ids[2])})['reviews']
+    restored = articles.find_one({'_id': ObjectId(ids[3])})
+    assert 0 == restored['reviews'] and generation + 1 == restored['generation']
+
+    # the skipped one is fixed by running it again
+    assert (1, 0) == connector.reconcile_reviews(batch_size=2)
+    assert 0 == articles.find_one({'_id': ObjectId(ids[2])})['reviews']
+
+
+def test_embedded_comments(database):
+    """Embedded comments are paged by offset and cursor, counted by the counter"""
+    articles = database[PREFIX + 'articles']
+    connector = ArticlesConnector(articles)
+    aid = insert_article(articles)
+
+    for i in range(6):
+        connector.post_comment(aid, data={'from': 'Mary', 'body': str(i), 'timestamp': i})
+    cids = [c['cid'] for c in connector.get_comments(aid, size=10, offset=0)[0]]
+    for i in [1, 4]:
+        connector.delete_comment(aid, str(cids[i]))
+
+    def page(size, offset=0, after=None, deleted=False):
+        cursor = None if after is None else [str(cids[after])]
+        result, count, _ = connector.get_comments(
+            aid, size=size, offset=offset, cursor=cursor, fetch_deleted=deleted
+        )
+        return bodies(result), count
+
+    assert ([2, 3], 4) == page(2, offset=1)
+    assert ([3, 5], 4) == page(2, after=2)
+    assert ([], 4) == page(2, after=5)
+    assert ([4], 2) == page(2, offset=1, deleted=True)
+    assert ([4], 2) == page(2, after=1, deleted=True)
+
+    # the counter is read instead of counting the array
+    articles.update_one({'_id': ObjectId(aid)}, {'$set': {'reviews': 5}})
+    assert ([0, 2], 5) == page(2)
+    assert ([1, 4], 1) == page(2, deleted=True)
+    # the array is counted if the counter was never filled
+    articles.update_one({'_id': ObjectId(aid)}, {'$unset': {'reviews': ''}})
+    assert ([0, 2], 4) == page(2)
+    assert ([1, 4], 2) == page(2, deleted=True)
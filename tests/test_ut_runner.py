@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about prefork runner"""
+
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from threading import Thread
+from urllib.request import urlopen
+
+import pytest
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def runner():
+    """Start the runner with 2 workers, collect its log lines"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'marucat_app.runner', '--port', str(port),
+         '--workers', '2', '--db', 'test', '--log-level', 'INFO'],
+        stderr=subprocess.PIPE
+    )
+    lines = []
+
+    def collect():
+        for line in process.stderr:
+            lines.append(line.decode('utf-8'))
+
+    Thread(target=collect, daemon=True).start()
+
+    def booted():
+        return [int(x) for line in lines for x in re.findall(r'Booted worker (\d+)', line)]
+
+    yield process, port, booted
+
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def get(port, path):
+    with urlopen('http://127.0.0.1:{}{}'.format(port, path), timeout=10) as r:
+        return r.status
+
+
+def test_runner(runner):
+    """Serve by workers, restart crashed workers, reload and stop gracefully"""
+    process, port, booted = runner
+
+    assert wait_for(lambda: len(booted()) == 2)
+    assert 200 == get(port, '/articles/aid1234')
+    assert 200 == get(port, '/ready')
+
+    # crashed worker is restarted
+    os.kill(booted()[0], signal.SIGKILL)
+    assert wait_for(lambda: len(booted()) == 3)
+    assert 200 == get(port, '/articles/aid1234')
+
+    # reload starts 2 new workers
+    process.send_signal(signal.SIGHUP)
+    assert wait_for(lambda: len(booted()) == 5)
+    assert 200 == get(port, '/articles/aid1234')
+
+    process.send_signal(signal.SIGTERM)
+    assert 0 == process.wait(timeout=30)
+
+
+def test_metrics_of_workers(runner):
+    """/metrics of any worker counts requests of all workers"""
+    process, port, booted = runner
+    assert wait_for(lambda: len(booted()) == 2)
+
+    for _ in range(20):
+        assert 200 == get(port, '/articles/aid1234')
+
+    def counted():
+        with urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=10) as r:
+            text = r.read().decode('utf-8')
+        match = re.search(r'marucat_http_requests_total\{[^}]*endpoint="articles.article_content"[^}]*status="200"\} (\d+)', text)
+        return match is not None and int(match.group(1)) == 20
+
+    # workers write their metrics every second
+    assert wait_for(counted, timeout=10)
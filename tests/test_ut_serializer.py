@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about JSON serializer"""
+
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from marucat_app.utils import serializer
+from marucat_app.utils.utils import deal_with_object_id, dump_array_in_chunks
+
+
+@pytest.fixture(params=list(serializer.BACKENDS))
+def dumps(request):
+    return serializer.BACKENDS[request.param]
+
+
+def test_dumps(dumps):
+    """All of backends dump the same JSON"""
+    aid = ObjectId()
+    data = [{
+        '_id': aid,
+        'title': 'The article title',
+        'views': 998,
+        'timestamp': 1531128386417.8281,
+        'deleted': False,
+        'tags': ['OK', '中文'],
+        'comments': [{'cid': ObjectId(), 'aid': aid, 'body': None}]
+    }]
+
+    result = dumps(data)
+    assert isinstance(result, bytes)
+
+    loaded = json.loads(result.decode('utf-8'))
+    assert str(aid) == loaded[0]['_id']
+    assert str(aid) == loaded[0]['comments'][0]['aid']
+    assert data[0]['timestamp'] == loaded[0]['timestamp']
+    assert data[0]['tags'] == loaded[0]['tags']
+
+
+def test_pretty(dumps):
+    """Pretty print sorts keys and ends with a newline"""
+    result = dumps({'b': 1, 'a': [1, 2]}, True)
+
+    assert result.endswith(b'\n')
+    assert json.loads(result.decode('utf-8')) == {'a': [1, 2], 'b': 1}
+    assert result.index(b'"a"') < result.index(b'"b"')
+    assert b'\n  "a"' in result
+
+
+def test_unsupported(dumps):
+    """Unsupported types raise TypeError"""
+    with pytest.raises(TypeError):
+        dumps({'a': object()})
+
+
+def test_datetime(dumps):
+    """datetime is dumped as ISO 8601 str"""
+    result = dumps({'time': datetime(2018, 7, 9, 17, 26, 26, 417000)})
+
+    loaded = json.loads(result.decode('utf-8'))
+    assert loaded['time'].startswith('2018-07-09T17:26:26.417')
+
+
+def test_deal_with_object_id():
+    """ObjectId anywhere is converted to str"""
+    aid = ObjectId()
+
+    assert str(aid) == deal_with_object_id(aid)
+    assert [{'_id': str(aid), 'c': [str(aid)]}] == deal_with_object_id(iter([{'_id': aid, 'c': [aid]}]))
+    assert {'_id': str(aid), 'd': {'aid': str(aid)}} == deal_with_object_id({'_id': aid, 'd': {'aid': aid}})
+    assert deal_with_object_id(None) is None
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_dump_array_in_chunks(pretty):
+    """Joined chunks are the same as dumping the whole array"""
+    data = [{'_id': ObjectId(), 'i': i, 'tags': ['a', 'b']} for i in range(7)]
+
+    for chunk_size in [1, 3, 7, 100]:
+        chunks = list(dump_array_in_chunks(iter(data), pretty, chunk_size))
+        assert serializer.dumps(data, pretty) == b''.join(chunks)
+
+    assert serializer.dumps([], pretty) == b''.join(dump_array_in_chunks([], pretty, 3))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about settings cache"""
+
+import pytest
+
+from marucat_app.database_helper import Settings
+from marucat_app.database_helper.fake_settings_connector import FakeSettingsConnector
+from marucat_app.database_helper.settings_cache import SettingsCache
+
+
+class CountingSettings(Settings):
+    """Settings helper which counts the reads"""
+
+    def __init__(self, connector):
+        super().__init__(connector)
+        self.reads = 0
+        self.version_reads = 0
+
+    def get_one(self, name):
+        self.reads += 1
+        return super().get_one(name)
+
+    def get_version(self):
+        self.version_reads += 1
+        return super().get_version()
+
+
+@pytest.fixture
+def settings():
+    return CountingSettings(FakeSettingsConnector())
+
+
+def test_hit_and_miss(settings):
+    """Values are read once and then served from memory"""
+    cache = SettingsCache(settings, ttl=60)
+
+    assert 10 == cache.get_value('default_size')
+    assert 10 == cache.get_value('default_size')
+    assert 999 == cache.get_value('max_size')
+    # missing settings are cached too
+    assert cache.get_value('not_exist') is None
+    assert cache.get_value('not_exist') is None
+
+    assert 3 == settings.reads
+    assert 1 == settings.version_reads
+
+    stats = cache.stats()
+    assert 2 == stats['hits']
+    assert 3 == stats['misses']
+    assert 3 == stats['size']
+
+
+def test_version_invalidation(settings):
+    """A write from anywhere drops the values once the TTL was expired"""
+    cache = SettingsCache(settings, ttl=0)
+
+    assert 10 == cache.get_value('default_size')
+    # unchanged version keeps the values
+    assert 10 == cache.get_value('default_size')
+    assert 1 == settings.reads
+
+    # write through the connector, as another process does
+    settings.update_one('default_size', {'value': 20})
+    assert 20 == cache.get_value('default_size')
+    assert 2 == settings.reads
+
+    settings.delete_one('default_size')
+    assert cache.get_value('default_size') is None
+
+
+def test_local_write_invalidation(settings):
+    """Writes through the cache drop the values immediately"""
+    cache = SettingsCache(settings, ttl=60)
+
+    assert 999 == cache.get_value('max_size')
+    cache.update_one('max_size', {'value': 50})
+    assert 50 == cache.get_value('max_size')
+
+    assert cache.delete_one('max_size')
+    assert cache.get_value('max_size') is None
+
+
+def test_stale_value_is_not_cached(settings):
+    """A value read before the cache was dropped does not land after it"""
+    cache = SettingsCache(settings, ttl=60)
+    read = settings.get_one
+
+    def get_one(name):
+        result = read(name)
+        # written while the value was read
+        cache.update_one('max_size', {'value': 50})
+        return result
+
+    settings.get_one = get_one
+    assert 999 == cache.get_value('max_size')
+    assert cache.cache.get('max_size') is None
+    settings.get_one = read
+    assert 50 == cache.get_value('max_size')
+
+
+def test_values_of_other_versions(settings):
+    """Values stamped with another version are ignored, like ones set by another process"""
+    cache = SettingsCache(settings, ttl=60)
+    assert 999 == cache.get_value('max_size')
+    cache.cache.set('max_size', (1, 'other version'), 1)
+    assert 999 == cache.get_value('max_size')
+
+
+def test_version_is_read_without_lock(settings):
+    """Reading the version stamp does not hold the lock of the cache"""
+    cache = SettingsCache(settings, ttl=0)
+    get_version = settings.get_version
+    held = []
+
+    def check():
+        held.append(cache._lock.locked())
+        return get_version()
+
+    settings.get_version = check
+    cache.get_value('max_size')
+    assert held == [False]
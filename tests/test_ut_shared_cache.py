@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about the cache shared by processes"""
+
+import os
+from multiprocessing import get_context
+from time import sleep
+
+import pytest
+
+from marucat_app.utils.caches import LRUCache, create_cache
+from marucat_app.utils.errors import CacheBackendNotExistError, UnsafeCacheFileError
+from marucat_app.utils.shared_cache import SharedCache, WAYS
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'test.cache')
+
+
+def _set_in_child(path):
+    cache = SharedCache(path, 1024 * 64, slot_size=1024)
+    cache.set(('child', 1), {'from': os.getpid()}, 0)
+
+
+def test_shared_cache(path):
+    """Values are pickled copies and dropped by delete, delete_matching and clear"""
+    cache = SharedCache(path, 1024 * 64, slot_size=1024)
+
+    assert cache.get('a') is None
+    value = {'content': 'Nothing here', 'comments': [1, 2]}
+    assert cache.set(('a', 2), value, 0)
+    assert value == cache.get(('a', 2))
+    assert value is not cache.get(('a', 2))
+    # overwrite
+    assert cache.set(('a', 2), 'new', 0)
+    assert 'new' == cache.get(('a', 2))
+
+    # too large for a slot
+    assert not cache.set('large', 'x' * 1024, 0)
+    assert cache.get('large') is None
+
+    cache.set(('a', 3), 3, 0)
+    cache.set(('b', 2), 4, 0)
+    cache.delete(('b', 2))
+    assert cache.get(('b', 2)) is None
+    cache.set(('b', 2), 4, 0)
+    cache.delete_matching(lambda key: key[0] == 'a')
+    assert cache.get(('a', 2)) is None
+    assert cache.get(('a', 3)) is None
+    assert 4 == cache.get(('b', 2))
+
+    stats = cache.stats()
+    assert 1 == stats['items']
+    assert 64 * 1024 == stats['max_bytes']
+
+    cache.clear()
+    assert cache.get(('b', 2)) is None
+    assert 0 == cache.stats()['items']
+
+
+def test_shared_between_processes(path):
+    """A value set by another process is seen, and so are the counters"""
+    cache = SharedCache(path, 1024 * 64, slot_size=1024)
+
+    process = get_context('fork').Process(target=_set_in_child, args=(path,))
+    process.start()
+    process.join()
+    assert 0 == process.exitcode
+
+    assert process.pid == cache.get(('child', 1))['from']
+    assert 1 == SharedCache(path, 1024 * 64, slot_size=1024).stats()['hits']
+
+
+def test_clock_eviction(path):
+    """A full set evicts values not referenced since the last sweep"""
+    # a single set
+    cache = SharedCache(path, 1024 * WAYS, slot_size=1024)
+
+    for i in range(WAYS):
+        cache.set(i, i, 0)
+    assert WAYS == cache.stats()['items']
+
+    cache.set('new', 'new', 0)
+    assert 'new' == cache.get('new')
+    assert WAYS == cache.stats()['items']
+    assert 1 == cache.stats()['evictions']
+
+
+def test_ttl(path):
+    cache = SharedCache(path, 1024 * 64, slot_size=1024, ttl=0.05)
+
+    cache.set('a', 1, 0)
+    assert 1 == cache.get('a')
+    sleep(0.1)
+    assert cache.get('a') is None
+
+
+def test_disabled(path):
+    cache = SharedCache(path, 0)
+
+    assert not cache.set('a', 1, 0)
+    assert cache.get('a') is None
+    assert 0 == cache.stats()['max_bytes']
+    assert not os.path.exists(path)
+
+
+def test_unsafe_file(path, tmp_path):
+    """Files other users could write and symbolic links are refused"""
+    target = str(tmp_path / 'target')
+    with open(target, 'wb') as f:
+        f.write(b'keep')
+    os.symlink(target, path)
+    with pytest.raises(UnsafeCacheFileError):
+        SharedCache(path, 1024 * 64, slot_size=1024)
+    with open(target, 'rb') as f:
+        assert b'keep' == f.read()
+
+    os.remove(path)
+    with open(path, 'wb'):
+        pass
+    os.chmod(path, 0o644)
+    with pytest.raises(UnsafeCacheFileError):
+        SharedCache(path, 1024 * 64, slot_size=1024)
+
+    if os.geteuid() == 0:
+        os.chmod(path, 0o600)
+        os.chown(path, 12345, -1)
+        with pytest.raises(UnsafeCacheFileError):
+            SharedCache(path, 1024 * 64, slot_size=1024)
+
+
+def test_create_cache(tmp_path):
+    conf = {'backend': 'local', 'shared_dir': str(tmp_path), 'shared_slot_size': '1024'}
+    assert isinstance(create_cache('test', 1024, conf=conf), LRUCache)
+
+    conf['backend'] = 'shared'
+    cache = create_cache('test', 1024 * 64, conf=conf)
+    assert isinstance(cache, SharedCache)
+    cache.set('a', 1, 0)
+    # same name, same values
+    assert 1 == create_cache('test', 1024 * 64, conf=conf).get('a')
+
+    conf['backend'] = 'other'
+    with pytest.raises(CacheBackendNotExistError):
+        create_cache('test', 1024, conf=conf)
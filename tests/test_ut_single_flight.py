@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about coalescing reads"""
+
+from threading import Event, Thread
+
+from marucat_app.database_helper import Articles
+from marucat_app.database_helper.single_flight import SingleFlight
+
+
+def run_concurrently(single_flight, key, func, n):
+    """Call do() from n threads while the first call is blocked
+
+    :return: list of results or errors
+    """
+    results = [None] * n
+
+    def target(i):
+        try:
+            results[i] = single_flight.do(key, func)
+        except Exception as e:
+            results[i] = e
+
+    threads = [Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def wait_for_followers(single_flight, n):
+    """Wait until n callers are waiting"""
+    for _ in range(500):
+        calls = list(single_flight._calls.values())
+        if calls and calls[0].followers == n:
+            return
+        Event().wait(0.01)
+    raise AssertionError('Followers did not arrive.')
+
+
+def test_collapsed():
+    """Concurrent callers share one call"""
+    single_flight = SingleFlight(timeout=5)
+    release = Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return {'a': 1}
+
+    threads, results = run_concurrently(single_flight, 'k', func, 5)
+    wait_for_followers(single_flight, 4)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert 1 == len(calls)
+    assert all({'a': 1} == r[0] for r in results)
+    leaders = [r for r in results if r[1]]
+    assert 1 == len(leaders)
+    assert 4 == leaders[0][2]
+
+    stats = single_flight.stats()
+    assert 1 == stats['leaders']
+    assert 4 == stats['collapsed']
+    assert 0 == stats['in_flight']
+
+
+def test_error():
+    """Followers get the error of the call"""
+    single_flight = SingleFlight(timeout=5)
+    release = Event()
+
+    def func():
+        release.wait(5)
+        raise KeyError('Failed.')
+
+    threads, results = run_concurrently(single_flight, 'k', func, 3)
+    wait_for_followers(single_flight, 2)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert all(isinstance(r, KeyError) for r in results)
+
+    # next call starts again
+    assert (1, True, 0) == single_flight.do('k', lambda: 1)
+
+
+def test_timeout():
+    """Followers run by themselves if the call is too slow"""
+    single_flight = SingleFlight(timeout=0.05)
+    release = Event()
+
+    def slow():
+        release.wait(5)
+        return 'slow'
+
+    threads, results = run_concurrently(single_flight, 'k', slow, 1)
+    wait_for_followers(single_flight, 0)
+
+    assert ('fast', False, 0) == single_flight.do('k', lambda: 'fast')
+    release.set()
+    threads[0].join()
+
+    # the timed out one is not counted
+    assert ('slow', True, 0) == results[0]
+    assert 1 == single_flight.stats()['timeouts']
+
+
+class SlowConnector(object):
+    """Articles connector blocking reads"""
+
+    def __init__(self):
+        self.release = Event()
+        self.views = 0
+        self.reads = 0
+
+    def get_content(self, article_id, *, comments_size, count_view=True):
+        self.reads += 1
+        self.release.wait(5)
+        if count_view:
+            self.views += 1
+        return {'_id': article_id, 'views': self.views}
+
+    def update_views(self, article_id, n=1):
+        self.views += n
+
+
+def test_views_of_followers():
+    """Every coalesced reader is counted as a view"""
+    connector = SlowConnector()
+    articles = Articles(connector, coalescing_timeout=5)
+
+    results = []
+    threads = [
+        Thread(target=lambda: results.append(articles.get_content('a', comments_size=10)))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    wait_for_followers(articles.single_flight, 3)
+    connector.release.set()
+    for t in threads:
+        t.join()
+
+    assert 1 == connector.reads
+    assert 4 == connector.views
+    assert 4 == len(results)
+
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about slow-query log"""
+
+import json
+import time
+
+from marucat_app.database_helper.slow_queries import SlowQueryListener, summarize_plan, pid_path
+from marucat_app.utils.metrics import INSTRUMENTATION, REGISTRY
+
+# output of explain of an aggregation, the plan is in the $cursor stage
+EXPLAINED = {
+    'stages': [
+        {
+            '$cursor': {
+                'queryPlanner': {
+                    'winningPlan': {
+                        'stage': 'FETCH',
+                        'inputStage': {'stage': 'IXSCAN', 'indexName': 'tags_1_timestamp_-1'}
+                    }
+                },
+                'executionStats': {
+                    'nReturned': 10,
+                    'executionTimeMillis': 3,
+                    'totalKeysExamined': 10,
+                    'totalDocsExamined': 10
+                }
+            }
+        },
+        {'$project': {'comments': 0}}
+    ],
+    'ok': 1
+}
+
+
+class Event(object):
+
+    def __init__(self, name, *, command=None, duration_micros=0, request_id=1):
+        self.command_name = name
+        self.command = command
+        self.database_name = 'blog_test'
+        self.duration_micros = duration_micros
+        self.request_id = request_id
+        self.connection_id = ('localhost', 27017)
+        self.failure = None
+
+
+class FakeDatabase(object):
+
+    def __init__(self, commands):
+        self._commands = commands
+
+    def command(self, command):
+        self._commands.append(command)
+        return EXPLAINED
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def __getitem__(self, name):
+        return FakeDatabase(self.commands)
+
+
+def test_summarize_plan():
+    assert {
+        'stages': ['FETCH', 'IXSCAN'],
+        'indexes': ['tags_1_timestamp_-1'],
+        'keys_examined': 10,
+        'docs_examined': 10,
+        'returned': 10,
+        'ms': 3
+    } == summarize_plan(EXPLAINED)
+
+
+def test_slow_query(tmp_path):
+    """Slow commands are logged and explained, fast ones are only timed"""
+    path = str(tmp_path / 'slow.log')
+    listener = SlowQueryListener(threshold_ms=100, sample_rate=1, path=path)
+    client = FakeClient()
+    listener.attach(client)
+
+    pipeline = [{'$match': {'deleted': False}}, {'$limit': 10}]
+    command = {'aggregate': 'articles', 'pipeline': pipeline, 'cursor': {}, 'lsid': {'id': 1}, '$db': 'blog_test'}
+
+    # fast
+    listener.started(Event('aggregate', command=command, request_id=1))
+    listener.succeeded(Event('aggregate', duration_micros=1000, request_id=1))
+    # not explainable
+    listener.started(Event('ping', command={'ping': 1}, request_id=2))
+    listener.succeeded(Event('ping', duration_micros=500000, request_id=2))
+    assert 0 == listener.slow
+
+    # slow
+    listener.started(Event('aggregate', command=command, request_id=3))
+    listener.succeeded(Event('aggregate', duration_micros=250000, request_id=3))
+    assert 1 == listener.slow
+
+    deadline = time.monotonic() + 5
+    while listener.explained < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listener.stop()
+
+    # fields of the driver are removed
+    assert [{
+        'explain': {'aggregate': 'articles', 'pipeline': pipeline, 'cursor': {}},
+        'verbosity': 'executionStats'
+    }] == client.commands
+
+    # written after explained
+    lines = []
+    deadline = time.monotonic() + 5
+    while not lines and time.monotonic() < deadline:
+        try:
+            with open(pid_path(path)) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            time.sleep(0.01)
+    record = json.loads(lines[0])
+    assert 'aggregate' == record['command']
+    assert 'articles' == record['collection']
+    assert 250 == record['ms']
+    # values are redacted
+    assert [{'$match': {'deleted': '?'}}, {'$limit': '?'}] == record['args']['pipeline']
+    assert ['FETCH', 'IXSCAN'] == record['plan']['stages']
+
+
+def test_metrics_switch():
+    """Latency of commands is only recorded if metrics are enabled"""
+    metrics, logs = INSTRUMENTATION.metrics, INSTRUMENTATION.logs
+    listener = SlowQueryListener(path=None)
+    try:
+        INSTRUMENTATION.configure(metrics=False, logs=False)
+        listener.succeeded(Event('getMore', duration_micros=10))
+        assert ('getMore',) not in [
+            (labels.get('command'),) for name, _, labels, _ in REGISTRY.collect()
+            if name == 'mongodb_command_seconds'
+        ]
+
+        INSTRUMENTATION.configure(metrics=True, logs=False)
+        listener.succeeded(Event('getMore', duration_micros=10))
+        assert REGISTRY.histogram('mongodb_command_seconds', command='getMore').snapshot()['count'] == 1
+    finally:
+        INSTRUMENTATION.configure(metrics=metrics, logs=logs)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Unit tests about views counter"""
+
+import atexit
+from threading import Event
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from marucat_app.database_helper.views_counter import ViewsCounter
+
+
+class FakeCollection(object):
+    """Collection which records bulk writes"""
+
+    def __init__(self):
+        self.writes = []
+        self.failed = False
+        self.written = Event()
+
+    def bulk_write(self, requests, ordered=True):
+        if self.failed:
+            raise PyMongoError('Failed.')
+        self.writes.append({r._filter['_id']: r._doc['$inc']['views'] for r in requests})
+        self.written.set()
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+def test_flush(collection):
+    """Views are written by one bulk write"""
+    counter = ViewsCounter(collection, interval=60)
+    a, b = str(ObjectId()), str(ObjectId())
+
+    assert 1 == counter.add(a)
+    assert 2 == counter.add(a)
+    assert 1 == counter.add(b)
+    assert 2 == counter.pending(a)
+
+    assert 2 == counter.flush()
+    assert [{ObjectId(a): 2, ObjectId(b): 1}] == collection.writes
+    assert 0 == counter.pending(a)
+
+    # nothing to write
+    assert 0 == counter.flush()
+    assert 1 == len(collection.writes)
+
+
+def test_failed_flush(collection):
+    """Views are kept if the write was failed"""
+    counter = ViewsCounter(collection, interval=60)
+    a = str(ObjectId())
+
+    counter.add(a, 3)
+    collection.failed = True
+    assert 0 == counter.flush()
+    assert 3 == counter.pending(a)
+
+    collection.failed = False
+    counter.add(a)
+    assert 1 == counter.flush()
+    assert [{ObjectId(a): 4}] == collection.writes
+
+
+def test_threshold_and_stop(collection):
+    """Background thread writes when threshold was reached and when stopped"""
+    counter = ViewsCounter(collection, interval=60, threshold=3)
+    counter.start()
+    a = str(ObjectId())
+
+    counter.add(a, 3)
+    assert collection.written.wait(5)
+    assert [{ObjectId(a): 3}] == collection.writes
+
+    counter.add(a)
+    counter.stop()
+    assert {ObjectId(a): 1} == collection.writes[-1]
+
+
+def test_in_flight(collection):
+    """Views being written are counted until the write succeeds"""
+    counter = ViewsCounter(collection, interval=60)
+    a = str(ObjectId())
+    seen = []
+
+    def bulk_write(requests, ordered=True):
+        seen.append(counter.pending(a))
+        if collection.failed:
+            raise PyMongoError('Failed.')
+
+    collection.bulk_write = bulk_write
+    counter.add(a, 2)
+    collection.failed = True
+    counter.flush()
+    assert 2 == counter.pending(a)
+
+    collection.failed = False
+    counter.flush()
+    assert [2, 2] == seen
+    assert 0 == counter.pending(a)
+
+
+def test_atexit_once(collection, monkeypatch):
+    """Counter is registered to exit once, and not kept after stopped"""
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    monkeypatch.setattr(atexit, 'unregister', lambda f: registered.remove(f) if f in registered else None)
+    counter = ViewsCounter(collection, interval=60)
+
+    counter.start()
+    counter.start()
+    assert [counter.stop] == registered
+    counter.stop()
+    assert [] == registered